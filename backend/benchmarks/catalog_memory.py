@@ -0,0 +1,108 @@
+"""
+Memoria del catálogo en proceso: dicts congelados (representación anterior)
+frente a PropertyTable (registros con __slots__, textos internados y
+columnas numéricas).
+
+    cd backend
+    python -m benchmarks.catalog_memory            # 100.000 propiedades
+    python -m benchmarks.catalog_memory --count 500000
+    python benchmarks/catalog_memory.py --count 20000   # también como script
+
+Genera un catálogo sintético con títulos y descripciones únicos, y zonas,
+tipos y características repetidos como en un export real del MLS; mide con
+tracemalloc la memoria que queda retenida tras construir cada representación
+a partir del JSON parseado.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Permite ejecutarlo también como script (python benchmarks/catalog_memory.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.property_catalog import freeze
+from modules.property_record import PropertyTable
+
+TYPES = ("apartamento", "casa", "villa", "ático", "loft", "piso", "chalet")
+FEATURES = (
+    "terraza", "piscina comunitaria", "piscina privada", "jardín", "parking", "trastero",
+    "ascensor", "aire acondicionado", "calefacción", "chimenea", "vistas al mar", "cerca de la playa",
+    "cerca del golf", "amueblado", "cocina equipada", "gimnasio", "zona infantil", "portero",
+    "domótica", "placas solares", "barbacoa", "jacuzzi", "bodega", "buhardilla"
+)
+TARGETS = ("Parejas o inversores", "Familias", "Lujo, zona premium", "Estudiantes", "Teletrabajo", "Jubilados")
+WORDS = (
+    "luminoso", "reformado", "amplio", "tranquilo", "céntrico", "exterior", "moderno", "acogedor",
+    "salón", "dormitorio", "cocina", "baño", "vistas", "zona", "transporte", "colegios", "comercios",
+    "playa", "montaña", "centro", "calle", "edificio", "urbanización", "orientación", "sur"
+)
+
+
+def synthetic_catalog(count: int, seed: int = 7) -> str:
+    """JSON de un catálogo sintético de `count` propiedades."""
+    rng = random.Random(seed)
+    zones = [f"Zona {i}, Provincia {i % 50}" for i in range(500)]
+    listings = []
+    for i in range(count):
+        objective = "alquiler" if rng.random() < 0.3 else "venta"
+        listing = {
+            "id": f"prop-{i:07d}",
+            "title": f"{rng.choice(TYPES).capitalize()} {rng.choice(WORDS)} {i}",
+            "type": rng.choice(TYPES),
+            "zone": rng.choice(zones),
+            "objective": objective,
+            "price": rng.randint(500, 3000) if objective == "alquiler" else rng.randint(60, 2000) * 1000,
+            "bedrooms": rng.randint(1, 6),
+            "bathrooms": rng.randint(1, 4),
+            "area": rng.randint(35, 600),
+            "description": " ".join(rng.choice(WORDS) for _ in range(rng.randint(15, 30))) + f" (ref. {i}).",
+            "features": rng.sample(FEATURES, rng.randint(2, 6)),
+            "target": rng.choice(TARGETS)
+        }
+        if objective == "alquiler":
+            listing["priceType"] = "mes"
+        listings.append(listing)
+    return json.dumps(listings, ensure_ascii=False)
+
+
+def retained_memory(build, content: str) -> tuple:
+    """(bytes retenidos, segundos) al construir una representación a partir del JSON."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    catalog = build(json.loads(content))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del catalog
+    return retained, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memoria del catálogo: dicts frente a PropertyTable")
+    parser.add_argument("--count", type=int, default=100_000, help="Número de propiedades")
+    args = parser.parse_args()
+
+    content = synthetic_catalog(args.count)
+    print(f"Catálogo sintético: {args.count:,} propiedades, {len(content) / 1e6:.1f} MB de JSON")
+
+    results = [
+        ("dicts congelados", retained_memory(lambda data: tuple(freeze(prop) for prop in data), content)),
+        ("PropertyTable", retained_memory(PropertyTable, content))
+    ]
+    per_100k = 100_000 / args.count
+    for name, (retained, elapsed) in results:
+        print(f"{name:<18} {retained / 1e6:8.1f} MB  ({retained * per_100k / 1e6:6.1f} MB / 100k)  "
+              f"{retained / args.count:6.0f} B/propiedad  construcción {elapsed:.2f}s")
+    before, after = results[0][1][0], results[1][1][0]
+    print(f"Ahorro: {(1 - after / before) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,21 @@ DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY", "")
 # Seleccionar proveedor de voz (deepgram es más barato)
 VOICE_PROVIDER = os.getenv("VOICE_PROVIDER", "deepgram")  # "deepgram" o "openai"
 
+# Llamadas al modelo (cliente asíncrono con conexiones reutilizadas)
+# Completions leyéndose del modelo a la vez por worker (el envío al cliente no cuenta);
+# el resto espera turno sin bloquear el event loop
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+# Conexiones HTTP abiertas con la API (total y reutilizables entre peticiones)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 32))
+# Segundos máximos por completion
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 8.0))
+
 # Telegram Configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+# Segundos mínimos entre ediciones del mensaje mientras la respuesta se va generando
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", 1.0))
 
 # CORS Configuration
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
@@ -22,7 +34,56 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 # Server Configuration
 PORT = int(os.getenv("PORT", 8000))
 
+# Clave de los endpoints de administración (importar/recargar el catálogo); vacío = desactivados
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+
 # File paths
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 PROPERTIES_FILE = os.path.join(DATA_DIR, "properties.json")
 LEADS_FILE = os.path.join(DATA_DIR, "leads.json")
+LEADS_JOURNAL_FILE = os.path.join(DATA_DIR, "leads.journal.jsonl")
+LEADS_DB_FILE = os.path.join(DATA_DIR, "leads.db")
+TRANSCRIPTS_DIR = os.path.join(DATA_DIR, "transcripts")
+SEMANTIC_INDEX_DIR = os.path.join(DATA_DIR, "semantic_index")
+
+# Property catalog
+# Segundos entre comprobaciones del mtime de properties.json (0 = en cada acceso)
+PROPERTIES_RELOAD_INTERVAL = float(os.getenv("PROPERTIES_RELOAD_INTERVAL", 2.0))
+
+# System prompt: sección de catálogo con las propiedades relevantes para la conversación
+PROMPT_CATALOG_MAX_LISTINGS = int(os.getenv("PROMPT_CATALOG_MAX_LISTINGS", 10))
+# Presupuesto aproximado de tokens de esa sección (web/Telegram y voz)
+PROMPT_CATALOG_TOKEN_BUDGET = int(os.getenv("PROMPT_CATALOG_TOKEN_BUDGET", 600))
+VOICE_PROMPT_CATALOG_TOKEN_BUDGET = int(os.getenv("VOICE_PROMPT_CATALOG_TOKEN_BUDGET", 250))
+
+# Historial en el prompt: turnos recientes que se envían tal cual (web/Telegram y voz)
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", 6))
+VOICE_CONTEXT_RECENT_TURNS = int(os.getenv("VOICE_CONTEXT_RECENT_TURNS", 3))
+# Presupuesto aproximado de tokens del historial (resumen + turnos) por canal
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2500))
+VOICE_CONTEXT_TOKEN_BUDGET = int(os.getenv("VOICE_CONTEXT_TOKEN_BUDGET", 400))
+# Turnos antiguos que se acumulan antes de plegarlos en el resumen (en segundo plano)
+CONTEXT_SUMMARY_BATCH = int(os.getenv("CONTEXT_SUMMARY_BATCH", 4))
+# Modelo barato para el resumen y tokens máximos del resumen
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", 200))
+
+# Caché de respuestas a mensajes de apertura ("hola", "quiero ver propiedades"):
+# entradas máximas y segundos de validez (0 = desactivada)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+
+# Búsqueda semántica: modelo local de sentence-transformers (vacío = solo BM25)
+SEMANTIC_EMBEDDING_MODEL = os.getenv("SEMANTIC_EMBEDDING_MODEL", "")
+
+# Lead storage
+# Backend de leads: "journal" (leads.json + journal) o "sqlite" (leads.db indexado)
+LEADS_BACKEND = os.getenv("LEADS_BACKEND", "journal")
+# Caché de leads con escritura diferida (opcional): segundos entre volcados a disco.
+# 0 (por defecto) = escritura inmediata. Solo para un único proceso servidor: la caché
+# es local a cada proceso, así que con varios workers (uvicorn --workers N) debe ser 0.
+LEADS_FLUSH_INTERVAL = float(os.getenv("LEADS_FLUSH_INTERVAL", 0))
+# Leads con cambios pendientes que fuerzan un volcado antes del temporizador
+LEADS_FLUSH_MAX_DIRTY = int(os.getenv("LEADS_FLUSH_MAX_DIRTY", 100))
+# Número de registros en el journal antes de compactarlo en leads.json
+LEADS_COMPACT_EVERY = int(os.getenv("LEADS_COMPACT_EVERY", 500))
@@ -0,0 +1,62 @@
+"""
+Importa un feed de propiedades (JSON, NDJSON o CSV) en el catálogo.
+
+    python import_properties.py feed.csv
+    python import_properties.py feed.ndjson --replace
+    python import_properties.py feed.json --server http://localhost:8000
+
+Sin --server escribe data/properties.json directamente; un servidor en marcha
+lo recarga solo (PROPERTIES_RELOAD_INTERVAL). Con --server sube el feed al
+endpoint /api/properties/import, que además prepara los índices antes de
+publicar la versión nueva.
+"""
+import argparse
+import json
+import os
+import sys
+
+import httpx
+
+from config import ADMIN_API_KEY
+from modules.catalog_ingest import FEED_FORMATS, FeedError, detect_format
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Importa un feed de propiedades en el catálogo")
+    parser.add_argument("feed", help="Fichero JSON (array), NDJSON o CSV")
+    parser.add_argument("--format", choices=FEED_FORMATS, help="Formato del feed (por defecto, según la extensión)")
+    parser.add_argument("--replace", action="store_true", help="El feed es el catálogo completo: elimina lo que no aparezca")
+    parser.add_argument("--server", help="URL del backend en marcha (p. ej. http://localhost:8000)")
+    args = parser.parse_args()
+
+    feed_format = args.format or detect_format(args.feed)
+    if feed_format is None:
+        parser.error(f"No se reconoce el formato de {args.feed}: usa --format")
+
+    with open(args.feed, "rb") as feed:
+        if args.server:
+            response = httpx.post(
+                args.server.rstrip("/") + "/api/properties/import",
+                files={"feed": (os.path.basename(args.feed), feed)},
+                data={"format": feed_format, "replace": str(args.replace).lower()},
+                headers={"X-Admin-Key": ADMIN_API_KEY} if ADMIN_API_KEY else {},
+                timeout=None
+            )
+            if response.status_code != 200:
+                print(f"[IMPORT] Error {response.status_code}: {response.text}", file=sys.stderr)
+                return 1
+            report = response.json()
+        else:
+            from modules.lead_manager import import_catalog
+            try:
+                report = import_catalog(feed, feed_format, replace=args.replace)
+            except FeedError as e:
+                print(f"[IMPORT] {e}", file=sys.stderr)
+                return 1
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,37 @@
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
-from fastapi.responses import Response
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Query, Header, Depends
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
 import uuid
 import asyncio
+import gzip
+import hashlib
+import hmac
+import json
 import time
 
 import httpx
-from config import FRONTEND_URL, PORT, OPENAI_API_KEY
-from modules.ai_agent import process_message
-from modules.lead_manager import get_all_leads, load_properties, get_lead_by_id, create_or_update_lead
-from modules.telegram_bot import send_telegram_message, extract_message_data, set_webhook, get_webhook_info
+
+try:
+    import brotli  # En requirements.txt; sin él /api/properties solo comprime con gzip
+except ImportError:
+    brotli = None
+
+from config import FRONTEND_URL, PORT, OPENAI_API_KEY, ADMIN_API_KEY
+from modules.ai_agent import process_message, stream_message, close_llm_client, response_cache
+from modules.lead_manager import (
+    get_catalog, reload_catalog, warm_catalog_indexes, query_properties, import_catalog,
+    get_lead_by_id,
+    create_or_update_lead_async, close_lead_store, get_lead_store, get_lead_transcript, run_lead_flusher,
+    query_leads, count_leads, get_leads_version, get_lead_stats, export_leads
+)
+from modules.property_catalog import thaw
+from modules.catalog_ingest import FEED_FORMATS, FeedError, detect_format
+from modules.lead_events import lead_events, format_sse
+from modules.telegram_bot import (
+    TelegramReplyStream, extract_message_data, set_webhook, get_webhook_info
+)
 from modules.voice_handler import transcribe_audio, synthesize_speech, adapt_text_for_voice
 
 # Inicializar FastAPI
@@ -46,12 +66,34 @@ telegram_conversations = {}
 voice_sessions = {}
 
 
+# Tareas de fondo del servidor
+background_tasks = []
+
+
+@app.on_event("startup")
+async def startup_lead_store():
+    """Carga los leads en memoria e inicia el volcado periódico a disco."""
+    get_lead_store()
+    # Construir (o abrir desde disco) los índices del catálogo antes de la primera consulta
+    await asyncio.to_thread(warm_catalog_indexes)
+    background_tasks.append(asyncio.create_task(run_lead_flusher()))
+
+
+@app.on_event("shutdown")
+async def shutdown_lead_store():
+    """Detiene el volcado periódico, cierra el pool del modelo y escribe los leads pendientes."""
+    for task in background_tasks:
+        task.cancel()
+    await close_llm_client()
+    close_lead_store()
+
+
 # ==================== UTILIDADES ====================
 
 async def save_lead_async(session_id: str, lead_data: dict, conversation_history: list):
     """Guarda el lead de forma asíncrona sin bloquear la respuesta"""
     try:
-        create_or_update_lead(
+        await create_or_update_lead_async(
             channel="voice",
             session_id=session_id,
             lead_data=lead_data or {},
@@ -61,6 +103,17 @@ async def save_lead_async(session_id: str, lead_data: dict, conversation_history
         print(f"Error guardando lead (no crítico): {lead_error}")
 
 
+def require_admin_key(x_admin_key: Optional[str] = Header(None)):
+    """
+    Exige la cabecera X-Admin-Key con el valor de ADMIN_API_KEY. Sin clave
+    configurada los endpoints de administración quedan desactivados (503).
+    """
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=503, detail="Administración desactivada: configura ADMIN_API_KEY")
+    if not hmac.compare_digest(x_admin_key or "", ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Clave de administración inválida")
+
+
 # ==================== MODELOS ====================
 
 class ChatRequest(BaseModel):
@@ -205,7 +258,7 @@ async def chat_web(request: ChatRequest):
     sessions[session_id] = updated_history
     
     # Crear o actualizar lead automáticamente en cada interacción
-    create_or_update_lead(
+    await create_or_update_lead_async(
         channel="web",
         session_id=session_id,
         lead_data=lead_data or {},
@@ -219,6 +272,54 @@ async def chat_web(request: ChatRequest):
     )
 
 
+@app.post("/api/chat/stream")
+async def chat_web_stream(request: ChatRequest):
+    """
+    Variante en streaming de /api/chat (Server-Sent Events).
+    Eventos: token {"text"} según se genera la respuesta, tool {"name"} cuando el
+    agente usa una herramienta (el texto parcial se descarta) y done
+    {"response", "session_id", "lead_data"} con la respuesta completa.
+    """
+    session_id = request.session_id or str(uuid.uuid4())
+    conversation_history = sessions.setdefault(session_id, [])
+
+    async def event_generator():
+        async for event in stream_message(
+            message=request.message,
+            conversation_history=conversation_history,
+            channel="web",
+            session_id=session_id
+        ):
+            if event["type"] != "done":
+                yield format_sse(event["type"], {key: value for key, value in event.items() if key != "type"})
+                continue
+
+            # Crear o actualizar lead automáticamente en cada interacción
+            await create_or_update_lead_async(
+                channel="web",
+                session_id=session_id,
+                lead_data=event["lead_data"] or {},
+                conversation_history=conversation_history
+            )
+            yield format_sse("done", {
+                "response": event["response"],
+                "session_id": session_id,
+                "lead_data": event["lead_data"] or None
+            })
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/chat/cache/stats")
+async def chat_cache_stats():
+    """Métricas de la caché de respuestas de apertura: entradas, aciertos, tasa de acierto y descartes."""
+    return response_cache.stats()
+
+
 @app.post("/webhook/telegram")
 async def telegram_webhook(request: Request):
     """
@@ -249,17 +350,26 @@ async def telegram_webhook(request: Request):
         
         conversation_history = telegram_conversations[telegram_session]
         
-        # Procesar mensaje con IA
-        response, updated_history, lead_data = await process_message(
+        # Procesar mensaje con IA: la respuesta se va mostrando editando el mensaje
+        reply = TelegramReplyStream(chat_id)
+        partial = ""
+        async for event in stream_message(
             message=text,
             conversation_history=conversation_history,
             channel="telegram",
             session_id=telegram_session,
             telegram_username=username
-        )
-        
-        # Actualizar historial
-        telegram_conversations[telegram_session] = updated_history
+        ):
+            if event["type"] == "token":
+                partial += event["text"]
+                await reply.update(partial)
+            elif event["type"] == "tool":
+                partial = ""
+            else:
+                response, lead_data = event["response"], event["lead_data"]
+
+        # Mostrar la respuesta completa en Telegram
+        await reply.finish(response)
         
         # Crear o actualizar lead automáticamente en cada interacción
         # Incluir nombre de Telegram si está disponible
@@ -267,18 +377,15 @@ async def telegram_webhook(request: Request):
         if first_name and not combined_lead_data.get("name"):
             combined_lead_data["name"] = first_name
         
-        create_or_update_lead(
+        await create_or_update_lead_async(
             channel="telegram",
             session_id=telegram_session,
             telegram_username=username,
             telegram_chat_id=str(chat_id),
             lead_data=combined_lead_data,
-            conversation_history=updated_history
+            conversation_history=conversation_history
         )
         
-        # Enviar respuesta a Telegram
-        await send_telegram_message(chat_id, response)
-        
         return {"ok": True}
         
     except Exception as e:
@@ -287,34 +394,246 @@ async def telegram_webhook(request: Request):
 
 
 @app.get("/api/leads")
-async def get_leads():
-    """Retorna todos los leads capturados."""
-    leads = get_all_leads()
-    return {
-        "total": len(leads),
-        "leads": leads
+async def get_leads(
+    request: Request,
+    channel: Optional[str] = None,
+    temperature: Optional[str] = None,
+    status: Optional[str] = None,
+    min_score: Optional[int] = None,
+    max_score: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    fields: Optional[str] = None
+):
+    """
+    Retorna los leads capturados, paginados por cursor (más recientes primero).
+    - Filtros: channel, temperature, status, min_score, max_score
+    - fields: lista separada por comas (por defecto todo salvo conversation_history)
+    - total: leads que cumplen los filtros (en todas las páginas)
+    - Soporta ETag / If-None-Match: si nada cambió responde 304 sin cuerpo
+    """
+    query_key = str(sorted(request.query_params.multi_items()))
+    etag = f'W/"{get_leads_version()}-{hashlib.md5(query_key.encode()).hexdigest()[:12]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    filters = {
+        "channel": channel,
+        "temperature": temperature,
+        "status": status,
+        "min_score": min_score,
+        "max_score": max_score
     }
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
+    try:
+        leads, next_cursor = query_leads(filters, cursor=cursor, limit=limit, fields=field_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return JSONResponse(
+        content={
+            # Leads que cumplen los filtros (todas las páginas), no el tamaño del almacén
+            "total": count_leads(filters),
+            "count": len(leads),
+            "leads": leads,
+            "next_cursor": next_cursor
+        },
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
+
+
+@app.get("/api/leads/export")
+async def export_leads_endpoint(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[str] = None,
+    include_transcript: bool = False
+):
+    """
+    Exporta los leads en streaming (NDJSON o CSV), más recientes primero.
+    - since: solo leads actualizados desde esa fecha ISO (p. ej. 2024-01-31T00:00:00)
+    - include_transcript: incluir el historial de conversación de cada lead
+    """
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_leads(format, since=since, include_transcript=include_transcript),
+        media_type=f"{media_type}; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename=leads.{format}"}
+    )
+
+
+@app.get("/api/leads/stats")
+async def leads_stats():
+    """
+    Agregados de leads: totales por temperatura, canal y estado, score medio,
+    histograma de score y solicitudes de visita. Se mantienen incrementalmente.
+    """
+    return get_lead_stats()
+
+
+@app.get("/api/leads/stream")
+async def stream_leads(request: Request):
+    """
+    Stream Server-Sent Events con los cambios de leads.
+    Eventos: lead_created (lead completo), lead_updated (id + campos cambiados)
+    y resync (el cliente debe recargar el listado).
+    """
+    queue = lead_events.subscribe()
+
+    async def event_generator():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=15.0)
+                    yield message
+                except asyncio.TimeoutError:
+                    # Comentario SSE para mantener viva la conexión en proxies
+                    yield ": keep-alive\n\n"
+        finally:
+            lead_events.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/api/leads/{lead_id}")
 async def get_lead(lead_id: str):
-    """Retorna un lead específico por su ID."""
+    """Retorna un lead específico por su ID, con su historial de conversación."""
     lead = get_lead_by_id(lead_id)
     if not lead:
         raise HTTPException(status_code=404, detail="Lead no encontrado")
-    return lead
+    return {**lead, "conversation_history": get_lead_transcript(lead)}
+
+
+# Respuestas más pequeñas que esto se envían sin comprimir
+COMPRESS_MIN_BYTES = 1024
+
+
+def accepted_encodings(request: Request) -> set:
+    """Codificaciones que admite el cliente según Accept-Encoding (las de q=0 no cuentan)."""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding.strip() and weight > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def compressed_json_response(request: Request, content: Optional[dict], headers: dict) -> Response:
+    """
+    Respuesta JSON comprimida con brotli o gzip según Accept-Encoding, siempre
+    con Vary: Accept-Encoding. Con content=None responde 304 (Not Modified).
+    """
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if content is None:
+        return Response(status_code=304, headers=headers)
+    body = json.dumps(content, ensure_ascii=False).encode("utf-8")
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = accepted_encodings(request)
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=5)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get("/api/properties")
-async def get_properties():
-    """Retorna todas las propiedades disponibles."""
-    properties = load_properties()
+async def get_properties(
+    request: Request,
+    zone: Optional[str] = None,
+    type: Optional[str] = None,
+    objective: Optional[str] = None,
+    min_price: Optional[int] = Query(None, ge=0),
+    max_price: Optional[int] = Query(None, ge=0),
+    min_bedrooms: Optional[int] = Query(None, ge=0),
+    sort: Optional[str] = Query(None, pattern="^-?(price|bedrooms|bathrooms|area)$"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Retorna las propiedades disponibles, filtradas y paginadas.
+    - Filtros: zone (tolerante a tildes y erratas), type, objective, min_price, max_price, min_bedrooms
+    - sort: price, bedrooms, bathrooms o area ("-" delante = descendente)
+    - Soporta ETag / If-None-Match (versión del catálogo) y compresión gzip/brotli
+    """
+    catalog = get_catalog()
+    query_key = str(sorted(request.query_params.multi_items()))
+    etag = f'W/"{catalog.content_hash}-{hashlib.md5(query_key.encode()).hexdigest()[:12]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return compressed_json_response(request, None, headers)
+
+    filters = {
+        "zone": zone,
+        "property_type": type,
+        "objective": objective,
+        "min_price": min_price,
+        "max_price": max_price,
+        "min_bedrooms": min_bedrooms
+    }
+    properties, total = query_properties(filters, sort=sort, offset=offset, limit=limit)
+    return compressed_json_response(request, {
+        "total": total,
+        "count": len(properties),
+        "offset": offset,
+        "limit": limit,
+        "version": catalog.version,
+        "properties": [thaw(prop) for prop in properties]
+    }, headers)
+
+
+@app.post("/api/properties/reload", dependencies=[Depends(require_admin_key)])
+async def reload_properties():
+    """
+    Vuelve a leer properties.json sin reiniciar el servidor.
+    Requiere ADMIN_API_KEY configurada y la cabecera X-Admin-Key.
+    """
+    catalog = await asyncio.to_thread(reload_catalog)
     return {
-        "total": len(properties),
-        "properties": properties
+        "version": catalog.version,
+        "total": len(catalog),
+        "loaded_at": catalog.loaded_at
     }
 
 
+@app.post("/api/properties/import", dependencies=[Depends(require_admin_key)])
+async def import_properties(
+    feed: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    replace: bool = Form(False)
+):
+    """
+    Importa un feed de propiedades (JSON, NDJSON o CSV) sin reiniciar el servidor.
+    - Cada registro es un alta/actualización por id; con "action": "delete" es una baja
+    - replace=true: el feed es el catálogo completo (lo que no aparece se elimina)
+    - format: se deduce de la extensión del fichero si no se indica
+    Requiere ADMIN_API_KEY configurada y la cabecera X-Admin-Key.
+    """
+    feed_format = (format or detect_format(feed.filename) or "").lower()
+    if feed_format not in FEED_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado (usa {', '.join(FEED_FORMATS)})")
+
+    # El fichero subido ya está en disco (SpooledTemporaryFile) y se procesa en un hilo
+    try:
+        return await asyncio.to_thread(import_catalog, feed.file, feed_format, replace)
+    except FeedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/api/telegram/setup-webhook")
 async def setup_telegram_webhook(request: WebhookSetupRequest):
     """Configura el webhook de Telegram."""
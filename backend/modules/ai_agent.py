@@ -1,12 +1,41 @@
+import asyncio
 import json
 from typing import Optional
-from openai import OpenAI
 
-from config import OPENAI_API_KEY
-from modules.lead_manager import search_properties, save_lead, load_properties
-
-# Inicializar cliente OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+import httpx
+from openai import AsyncOpenAI
+
+from config import (
+    OPENAI_API_KEY, PROMPT_CATALOG_MAX_LISTINGS, PROMPT_CATALOG_TOKEN_BUDGET,
+    VOICE_PROMPT_CATALOG_TOKEN_BUDGET, LLM_MAX_CONCURRENCY, LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_TIMEOUT, CONTEXT_SUMMARY_MODEL,
+    RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+)
+from modules.lead_manager import (
+    search_properties, closest_properties, semantic_search, create_or_update_lead_async, get_catalog
+)
+from modules.catalog_retrieval import CatalogRetriever
+from modules.conversation_context import ConversationContext, estimate_tokens, transcript_lines
+from modules.response_cache import ResponseCache
+
+# Cliente OpenAI asíncrono sobre un pool de conexiones compartido por todas las conversaciones:
+# mientras una completion espera a la API, el event loop sigue atendiendo otras peticiones
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+    ),
+    timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0)
+)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client) if OPENAI_API_KEY else None
+
+# Completions en curso como máximo en este worker (solo mientras se lee del modelo)
+llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+# Fragmentos de un streaming que esperan a un consumidor lento; más que los de
+# cualquier respuesta (max_tokens), así que la lectura del modelo no se detiene
+STREAM_BUFFER_CHUNKS = 2048
+# Marca de fin del streaming en la cola
+_STREAM_END = object()
 
 # Modelo a usar - GPT-4o para mejor calidad
 MODEL = "gpt-4o"
@@ -26,50 +55,13 @@ VOICE_SYSTEM_PROMPT = """Eres InmoBot, asesor inmobiliario por teléfono. Respon
 - Respuestas cortas (20-40 palabras máximo)
 - Di precios en números: "200 mil euros", no "doscientos mil euros"
 
-## CATÁLOGO COMPLETO (MEMORIZA ESTO)
-1. Villa Paraíso, Costa del Sol - 200.000 euros
-   - 2 habitaciones, 85 metros cuadrados
-   - Cerca de la playa, ideal para parejas
-
-2. Villa María, Alicante - 450.000 euros
-   - 3 habitaciones, 180 metros cuadrados
-   - Piscina privada, jardín amplio
-
-3. San Jacobo, Costa Blanca - 150.000 euros (ALQUILER)
-   - 1 habitación, 55 metros cuadrados
-   - Amueblado, listo para entrar
-
-4. Chalet Mediterráneo, Marbella - 890.000 euros
-   - 4 habitaciones, 250 metros cuadrados
-   - Lujo, zona premium, vistas al mar
-
-5. Apartamento Centro, Valencia - 280.000 euros
-   - 2 habitaciones, 95 metros cuadrados
-   - Reformado, centro ciudad
-
-6. Casa Rural, Segovia - 195.000 euros
-   - 3 habitaciones, 150 metros cuadrados
-   - Chimenea, jardín, ambiente tranquilo
-
-7. Penthouse Barcelona - 650.000 euros
-   - 3 habitaciones, 140 metros cuadrados
-   - Terraza de 80 metros cuadrados, Eixample
-
-8. Apartamento Playa, Benidorm - 1.200 euros al mes (ALQUILER)
-   - 2 habitaciones, 70 metros cuadrados
-   - Primera línea de playa
-
-9. Villa Golf, Murcia - 385.000 euros
-   - 3 habitaciones, 200 metros cuadrados
-   - Junto a campo de golf
-
-10. Loft Madrid - 320.000 euros
-    - 1 habitación, 65 metros cuadrados
-    - Malasaña, moderno y céntrico
+## CATÁLOGO
+Las propiedades más relevantes para la conversación te llegan en un mensaje aparte titulado CATÁLOGO. Habla solo de esas o de las que devuelvan las herramientas.
 
 ## HERRAMIENTAS DISPONIBLES
 - show_catalog: Muestra TODAS las propiedades (úsalo si pide ver opciones)
 - search_properties: Busca propiedades específicas (úsalo si da zona, precio o características)
+- semantic_search: Busca por descripción libre (úsalo si pide algo como "tranquilo con chimenea" o "cerca del golf")
 - save_lead_info: Guarda datos del cliente (úsalo si da nombre o teléfono)
 
 ## EJEMPLOS DE BUENAS RESPUESTAS
@@ -124,17 +116,8 @@ SYSTEM_PROMPT = """Eres InmoBot, un asesor inmobiliario virtual amigable especia
 ## REGLA DE ORO
 Si el usuario quiere ver propiedades, catálogo, opciones, precios o algo similar → USA show_catalog INMEDIATAMENTE. No pidas presupuesto primero.
 
-## CATÁLOGO DISPONIBLE (precios: 150.000€ - 890.000€)
-1. Villa Paraíso, Costa del Sol - 200.000€ (2 hab, 85m², cerca playa)
-2. Villa María, Alicante - 450.000€ (3 hab, 180m², piscina propia)  
-3. San Jacobo, Costa Blanca - 150.000€ (1 hab, 55m², alquiler)
-4. Chalet Mediterráneo, Marbella - 890.000€ (4 hab, 250m², lujo)
-5. Apartamento Centro, Valencia - 280.000€ (2 hab, 95m², reformado)
-6. Casa Rural, Segovia - 195.000€ (3 hab, 150m², chimenea)
-7. Penthouse Barcelona, Eixample - 650.000€ (3 hab, 140m², terraza 80m²)
-8. Apartamento Playa, Benidorm - 1.200€/mes (2 hab, 70m², primera línea)
-9. Villa Golf, Murcia - 385.000€ (3 hab, 200m², campo de golf)
-10. Loft Moderno, Madrid - 320.000€ (1 hab, 65m², Malasaña)
+## CATÁLOGO
+Las propiedades más relevantes para la conversación te llegan en un mensaje aparte titulado CATÁLOGO. Si el cliente busca algo que no aparece ahí, usa search_properties o show_catalog.
 
 ## CUÁNDO USAR CADA HERRAMIENTA
 
@@ -152,6 +135,11 @@ Si el usuario quiere ver propiedades, catálogo, opciones, precios o algo simila
 - Tipo de propiedad + criterios
 - Después de ver el catálogo y decir cuál le interesa
 
+### semantic_search - USAR cuando el usuario describe lo que busca con sus palabras:
+- "Algo tranquilo con chimenea"
+- "Cerca del golf" o "para teletrabajar"
+- "Ideal para familias con niños"
+
 ### save_lead_info - USAR cuando el usuario da:
 - Su nombre
 - Su teléfono o email
@@ -233,6 +221,23 @@ TOOLS = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "semantic_search",
+            "description": "Busca propiedades por descripción libre (ambiente, características, para quién es). Usar cuando el cliente describe lo que quiere con sus palabras en vez de zona o precio.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Lo que busca el cliente, con sus palabras (ej: 'tranquilo con chimenea', 'cerca del golf')"
+                    }
+                },
+                "required": ["query"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -258,74 +263,371 @@ TOOLS = [
     }
 ]
 
-def format_property_card(prop: dict, index: int = None, compact: bool = False) -> str:
-    """Formatea una propiedad de forma atractiva."""
-    prefix = f"{index}. " if index else ""
-    
-    # Formato de precio según tipo (alquiler vs venta)
-    price_str = f"{prop['price']:,}€"
-    if prop.get('priceType') == 'mes' or prop.get('objective') == 'alquiler':
-        price_str = f"{prop['price']:,}€/mes" if prop['price'] < 10000 else f"{prop['price']:,}€"
-    
+# Respuesta tras cada herramienta: "direct" devuelve al cliente la salida ya renderizada
+# (plantilla del canal, sin segunda llamada al modelo); "model" deja que el modelo la redacte
+TOOL_REPLY_POLICY = {
+    "show_catalog": "direct",
+    "search_properties": "direct",
+    "semantic_search": "model",
+    "save_lead_info": "model"
+}
+
+
+def direct_reply_marker(function_name: str, shown) -> str:
+    """
+    Contenido del resultado de una herramienta "direct" en el historial: la
+    respuesta completa ya queda en el mensaje del asistente, así que aquí
+    solo se anota qué propiedades se mostraron.
+    """
+    ids = ", ".join(str(prop["id"]) for prop in shown)
+    return f"[{function_name}: {len(shown)} propiedades mostradas al cliente ({ids})]" if shown \
+        else f"[{function_name}: sin propiedades que mostrar]"
+
+def format_price(prop, spoken: bool = False) -> str:
+    """Precio de una propiedad según su tipo (alquiler vs venta); `spoken` para voz."""
+    price = prop['price']
+    monthly = (prop.get('priceType') == 'mes' or prop.get('objective') == 'alquiler') and price < 10000
+    if spoken:
+        amount = f"{price // 1000} mil" if price >= 10000 and price % 1000 == 0 else f"{price:,}".replace(",", ".")
+        return f"{amount} euros al mes" if monthly else f"{amount} euros"
+    return f"{price:,}€/mes" if monthly else f"{price:,}€"
+
+
+def render_property_card(prop, compact: bool = False, channel: str = "web") -> str:
+    """Ficha de una propiedad sin numerar (markdown, o texto hablado para voz)."""
+    bedrooms = prop.get('bedrooms', 0)
+    area = prop.get('area', 0)
+    features = prop.get('features') or ()
+    if channel == "voice":
+        rooms = "1 habitación" if bedrooms == 1 else f"{bedrooms} habitaciones"
+        card = (f"{prop['title']}, {prop.get('zone', 'España')}: {format_price(prop, spoken=True)}, "
+                f"{rooms}, {area} metros cuadrados")
+        if not compact and features:
+            card += f". {', '.join(features[:2]).capitalize()}"
+        return card + "."
+
+    price_str = format_price(prop)
     if compact:
-        return f"{prefix}**{prop['title']}** - {price_str} | {prop['bedrooms']} hab, {prop['area']}m²"
+        return f"**{prop['title']}** - {price_str} | {bedrooms} hab, {area}m²"
     
-    return f"""
-{prefix}🏠 **{prop['title']}** ({prop.get('zone', 'España')})
+    card = f"""🏠 **{prop['title']}** ({prop.get('zone', 'España')})
 💶 {price_str}
-📐 {prop['area']}m² | 🛏️ {prop['bedrooms']} hab | 🚿 {prop['bathrooms']} baños
-✨ {prop['description'][:80]}...
-🎯 {', '.join(prop['features'][:3])}
+📐 {area}m² | 🛏️ {bedrooms} hab | 🚿 {prop.get('bathrooms', 0)} baños
 """
+    if prop.get('description'):
+        card += f"✨ {prop['description'][:80]}...\n"
+    if features:
+        card += f"🎯 {', '.join(features[:3])}\n"
+    return card
+
+
+def _rendered(channel: str) -> dict:
+    """Textos ya renderizados de la versión vigente del catálogo para un canal."""
+    return get_catalog().derived(f"rendered:{channel}", lambda properties: {})
+
+
+def format_property_card(prop: dict, index: int = None, compact: bool = False, channel: str = "web") -> str:
+    """Formatea una propiedad de forma atractiva (memorizado por versión del catálogo y canal)."""
+    cache = _rendered(channel)
+    key = (prop.get('id'), compact)
+    cached = cache.get(key)
+    if cached is not None and cached[0] is prop:
+        card = cached[1]
+    else:
+        card = render_property_card(prop, compact=compact, channel=channel)
+        # Solo se memoriza si la propiedad pertenece a la versión vigente
+        if get_catalog().get(prop.get('id')) is prop:
+            cache[key] = (prop, card)
+
+    prefix = f"{index}. " if index else ""
+    if compact or channel == "voice":
+        return prefix + card
+    return "\n" + prefix + card
+
+
+def get_full_catalog(channel: str = "web") -> str:
+    """Genera el catálogo completo formateado (se renderiza una vez por versión del catálogo)."""
+    cache = _rendered(channel)
+    result = cache.get("catalog")
+    if result is None:
+        result = render_full_catalog(get_catalog().properties, channel)
+        cache["catalog"] = result
+    return result
 
 
-def get_full_catalog() -> str:
-    """Genera el catálogo completo formateado."""
-    properties = load_properties()
-    
+def render_full_catalog(properties, channel: str = "web") -> str:
+    """Construye el texto del catálogo completo."""
     if not properties:
         return "No hay propiedades disponibles en este momento."
     
     # Agrupar por objetivo (venta vs alquiler)
     venta = [p for p in properties if p.get("objective") == "venta"]
     alquiler = [p for p in properties if p.get("objective") == "alquiler"]
+
+    if channel == "voice":
+        parts = ["Propiedades disponibles:"]
+        for i, prop in enumerate(venta + alquiler, 1):
+            parts.append(format_property_card(prop, index=i, compact=True, channel=channel))
+        return "\n".join(parts)
     
-    result = "📋 **NUESTRAS PROPIEDADES EN ESPAÑA**\n"
-    result += "━" * 30 + "\n\n"
+    parts = ["📋 **NUESTRAS PROPIEDADES EN ESPAÑA**\n", "━" * 30 + "\n\n"]
     
     if venta:
-        result += "🏠 **EN VENTA:**\n"
+        parts.append("🏠 **EN VENTA:**\n")
         for i, prop in enumerate(venta, 1):
-            result += format_property_card(prop, index=i)
-        result += "\n"
+            parts.append(format_property_card(prop, index=i, channel=channel))
+        parts.append("\n")
     
     if alquiler:
-        result += "🔑 **EN ALQUILER:**\n"
+        parts.append("🔑 **EN ALQUILER:**\n")
         for i, prop in enumerate(alquiler, len(venta) + 1):
-            result += format_property_card(prop, index=i)
+            parts.append(format_property_card(prop, index=i, channel=channel))
     
-    result += "\n━" * 30 + "\n"
-    result += "💡 Precios desde 150.000€ hasta 890.000€ (venta) | Alquileres desde 1.200€/mes\n"
-    result += "¿Alguna te interesa? Puedo darte más detalles."
+    parts.append("\n" + "━" * 30 + "\n")
+    ranges = price_ranges(properties)
+    if ranges:
+        parts.append(f"💡 Precios: {' | '.join(ranges)}\n")
+    parts.append("¿Alguna te interesa? Puedo darte más detalles.")
     
-    return result
+    return "".join(parts)
+
+
+
+def spoken_catalog_reply() -> str:
+    """Resumen hablado del catálogo para voz: tamaño, precios y dos ejemplos (una vez por versión)."""
+    cache = _rendered("voice")
+    reply = cache.get("spoken_catalog")
+    if reply is None:
+        properties = get_catalog().properties
+        if not properties:
+            reply = "Ahora mismo no tengo propiedades disponibles. ¿Quieres que te avise cuando haya novedades?"
+        else:
+            venta = [p for p in properties if p.get("objective") == "venta"]
+            alquiler = [p for p in properties if p.get("objective") == "alquiler"]
+            parts = []
+            if venta:
+                parts.append(f"{len(venta)} en venta desde {format_price(min(venta, key=lambda p: p['price']), spoken=True)}")
+            if alquiler:
+                parts.append(f"{len(alquiler)} en alquiler desde {format_price(min(alquiler, key=lambda p: p['price']), spoken=True)}")
+            examples = " y ".join(f"{p['title']} en {p.get('zone', 'España')}" for p in (venta + alquiler)[:2])
+            reply = (f"Tengo {len(properties)} propiedades: {' y '.join(parts)}. Por ejemplo, {examples}. "
+                     "¿Buscas alguna zona o presupuesto en concreto?")
+        cache["spoken_catalog"] = reply
+    return reply
+
+
+def search_reply(result: str, properties: list, closest: list, channel: str) -> str:
+    """Respuesta directa a search_properties: las fichas en markdown, o dos opciones habladas para voz."""
+    if channel != "voice":
+        if properties:
+            return result + "\n¿Te interesa alguna? Puedo darte más detalles o agendar una visita."
+        return result + "\n¿Quieres que ajuste la búsqueda con otra zona o presupuesto?"
+
+    if properties:
+        count = "una opción" if len(properties) == 1 else f"{len(properties)} opciones"
+        reply = f"Encontré {count}. {render_property_card(properties[0], compact=True, channel=channel)}"
+        if len(properties) > 1:
+            reply += f" También tengo {properties[1]['title']}."
+        return reply + " ¿Te interesa?"
+    if closest:
+        return (f"No tengo nada exacto con esos criterios. Lo más parecido es "
+                f"{render_property_card(closest[0][0], compact=True, channel=channel)} ¿Te sirve o ajustamos la búsqueda?")
+    return "No tengo propiedades con esos criterios. ¿Ajustamos la zona o el presupuesto?"
+
+
+def price_ranges(properties, spoken: bool = False) -> list:
+    """Rangos de precio del catálogo: ["venta de X a Y", "alquiler desde Z"]."""
+    venta = [p["price"] for p in properties if p.get("objective") == "venta"]
+    alquiler = [p for p in properties if p.get("objective") == "alquiler"]
+    ranges = []
+    if venta:
+        ranges.append(f"venta de {format_price({'price': min(venta)}, spoken)} a {format_price({'price': max(venta)}, spoken)}")
+    if alquiler:
+        cheapest = min(alquiler, key=lambda p: p["price"])
+        ranges.append(f"alquiler desde {format_price(cheapest, spoken)}")
+    return ranges
+
+
+def _catalog_summary(properties, channel: str) -> str:
+    """Cabecera de la sección de catálogo: tamaño y rangos de precio."""
+    ranges = price_ranges(properties, spoken=channel == "voice")
+    summary = f"## CATÁLOGO ({len(properties)} propiedades"
+    return summary + (f"; {'; '.join(ranges)})" if ranges else ")")
+
+
+def format_prompt_listing(prop, index: int, channel: str = "web") -> str:
+    """Línea de una propiedad en la sección de catálogo del prompt."""
+    cache = _rendered(channel)
+    key = ("prompt", prop.get('id'))
+    cached = cache.get(key)
+    if cached is not None and cached[0] is prop:
+        line = cached[1]
+    else:
+        if channel == "voice":
+            line = render_property_card(prop, compact=False, channel=channel)
+        else:
+            features = ", ".join((prop.get('features') or ())[:2])
+            line = (f"{prop['title']}, {prop.get('zone', 'España')} - {format_price(prop)} "
+                    f"({prop.get('type', 'propiedad')}, {prop.get('bedrooms', 0)} hab, {prop.get('area', 0)}m²"
+                    f"{', ' + features if features else ''})")
+        if get_catalog().get(prop.get('id')) is prop:
+            cache[key] = (prop, line)
+    return f"{index}. {line}"
+
+
+def build_catalog_context(conversation_history: list, channel: str = "web") -> str:
+    """
+    Sección de catálogo para el prompt: las propiedades más relevantes para los
+    últimos turnos de la conversación, hasta PROMPT_CATALOG_MAX_LISTINGS o hasta
+    agotar el presupuesto de tokens del canal.
+    """
+    catalog = get_catalog()
+    properties = catalog.properties
+    if not properties:
+        return "## CATÁLOGO\nNo hay propiedades disponibles en este momento."
+
+    cache = _rendered(channel)
+    header = cache.get("prompt_header")
+    if header is None:
+        header = cache["prompt_header"] = _catalog_summary(properties, channel)
+
+    # Texto reciente: últimos mensajes del cliente y la última respuesta del asistente
+    user_texts = [m["content"] for m in conversation_history if m.get("role") == "user" and isinstance(m.get("content"), str)]
+    assistant_texts = [m["content"] for m in conversation_history if m.get("role") == "assistant" and isinstance(m.get("content"), str)]
+    recent_text = " ".join(user_texts[-3:] + assistant_texts[-1:])
+
+    budget = VOICE_PROMPT_CATALOG_TOKEN_BUDGET if channel == "voice" else PROMPT_CATALOG_TOKEN_BUDGET
+    retriever = catalog.derived("retriever", CatalogRetriever)
+    lines = [header]
+    used = estimate_tokens(header)
+    for prop in retriever.rank(recent_text):
+        if len(lines) > PROMPT_CATALOG_MAX_LISTINGS:
+            break
+        line = format_prompt_listing(prop, len(lines), channel)
+        used += estimate_tokens(line)
+        if used > budget and len(lines) > 1:
+            break
+        lines.append(line)
+
+    shown = len(lines) - 1
+    if shown < len(properties):
+        lines.append(f"(Mostrando {shown} de {len(properties)}. Para otras zonas o criterios usa search_properties.)")
+    return "\n".join(lines)
+
+
+def build_messages(system_prompt: str, conversation_history: list, catalog_context: str) -> list:
+    """
+    Mensajes para la API. El system prompt fijo va primero y no cambia nunca, y la
+    sección de catálogo (que sí cambia) se inserta justo antes del último mensaje del
+    cliente: así el prefijo system + historial anterior se repite byte a byte entre
+    turnos y el proveedor puede reutilizar su caché de prompts.
+    """
+    last_user = max(
+        (i for i, message in enumerate(conversation_history) if message.get("role") == "user"),
+        default=len(conversation_history)
+    )
+    return (
+        [{"role": "system", "content": system_prompt}]
+        + conversation_history[:last_user]
+        + [{"role": "system", "content": catalog_context}]
+        + conversation_history[last_user:]
+    )
+
+
+async def stream_completion(**kwargs):
+    """
+    Completion del modelo en streaming: itera los fragmentos según llegan.
+    El hueco de llm_slots solo cubre la lectura del modelo: una tarea la vuelca
+    en una cola, así que un consumidor lento (ediciones de Telegram esperando
+    retry_after, un cliente SSE lento) no retiene el hueco.
+    """
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+
+    async def pump():
+        try:
+            async with llm_slots:
+                stream = await client.chat.completions.create(model=MODEL, timeout=LLM_TIMEOUT, stream=True, **kwargs)
+                async for chunk in stream:
+                    if chunk.choices:
+                        await queue.put(chunk.choices[0].delta)
+            await queue.put(_STREAM_END)
+        except Exception as e:
+            # El error llega al consumidor en su sitio de la secuencia
+            await queue.put(e)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # El consumidor dejó de leer (p. ej. el cliente se desconectó): cortar la lectura
+        task.cancel()
+
+
+async def close_llm_client() -> None:
+    """Cierra las conexiones del pool (al apagar el servidor)."""
+    await http_client.aclose()
+
+
+async def summarize_conversation(previous: str, messages: list, channel: str, max_tokens: int) -> str:
+    """Pliega mensajes antiguos en el resumen de la conversación con un modelo barato."""
+    if not client:
+        return ""
+    prompt = (
+        "Actualiza el resumen de una conversación entre un cliente y InmoBot, asesor inmobiliario. "
+        "Conserva en viñetas breves solo lo útil para seguir atendiendo: qué busca (compra o alquiler, "
+        "zona, tipo, presupuesto, habitaciones), propiedades que se le mostraron o le interesaron, "
+        "datos de contacto que dio y lo que quedó pendiente. "
+        f"Máximo {max_tokens * 3 // 4} palabras, sin introducción."
+    )
+    content = f"RESUMEN ACTUAL:\n{previous or '(vacío)'}\n\nMENSAJES NUEVOS:\n" + "\n".join(transcript_lines(messages))
+    async with llm_slots:
+        response = await client.chat.completions.create(
+            model=CONTEXT_SUMMARY_MODEL,
+            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": content}],
+            max_tokens=max_tokens,
+            temperature=0.2,
+            timeout=LLM_TIMEOUT
+        )
+    return response.choices[0].message.content or ""
+
 
+# Vista acotada del historial que se envía al modelo en cada turno
+conversation_context = ConversationContext(summarize=summarize_conversation)
 
+# Respuestas a mensajes de apertura, por texto normalizado, canal y versión del catálogo
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
 
-def process_tool_calls(tool_calls: list, channel: str, session_id: str, 
-                       telegram_username: Optional[str], conversation_history: list) -> tuple[list, dict]:
-    """Procesa las llamadas a herramientas."""
+
+async def process_tool_calls(tool_calls: list, channel: str, session_id: str, 
+                             telegram_username: Optional[str], conversation_history: list) -> tuple[list, dict, dict]:
+    """
+    Procesa las llamadas a herramientas. Devuelve (resultados para el modelo,
+    datos del lead, respuestas directas): las herramientas con política "direct"
+    aportan, por tool_call_id, la respuesta ya redactada para el canal y la
+    marca que la sustituye en el historial.
+    """
     tool_results = []
     lead_data = {}
+    direct_replies = {}
     
     for tool_call in tool_calls:
-        function_name = tool_call.function.name
-        arguments = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
+        function_name = tool_call["function"]["name"]
+        arguments = json.loads(tool_call["function"]["arguments"]) if tool_call["function"]["arguments"] else {}
         
         if function_name == "show_catalog":
-            result = get_full_catalog()
+            result = get_full_catalog(channel)
+            direct_replies[tool_call["id"]] = (
+                spoken_catalog_reply() if channel == "voice" else result,
+                direct_reply_marker(function_name, get_catalog().properties)
+            )
             tool_results.append({
-                "tool_call_id": tool_call.id,
+                "tool_call_id": tool_call["id"],
                 "role": "tool",
                 "content": result
             })
@@ -338,20 +640,46 @@ def process_tool_calls(tool_calls: list, channel: str, session_id: str,
                 min_bedrooms=arguments.get("min_bedrooms")
             )
             
+            closest = []
             if properties:
                 result = f"🔍 Encontré {len(properties)} propiedad(es):\n\n"
                 for prop in properties[:3]:
-                    result += format_property_card(prop)
+                    result += format_property_card(prop, channel=channel)
             else:
-                # Si no hay resultados, mostrar alternativas
-                all_props = load_properties()
+                # Si no hay resultados, mostrar las más cercanas a lo pedido
+                closest = closest_properties(
+                    zone=arguments.get("zone"),
+                    property_type=arguments.get("property_type"),
+                    max_price=arguments.get("max_price"),
+                    min_bedrooms=arguments.get("min_bedrooms"),
+                    k=3
+                )
                 result = "No encontré propiedades exactas con esos criterios.\n\n"
-                result += "📋 **Opciones similares disponibles:**\n"
-                for prop in all_props[:3]:
-                    result += format_property_card(prop, compact=True) + "\n"
+                result += "📋 **Opciones más parecidas disponibles:**\n"
+                for prop, _ in closest:
+                    result += format_property_card(prop, compact=True, channel=channel) + "\n"
+            direct_replies[tool_call["id"]] = (
+                search_reply(result, properties, closest, channel),
+                direct_reply_marker(function_name, properties[:3] or [prop for prop, _ in closest])
+            )
             
             tool_results.append({
-                "tool_call_id": tool_call.id,
+                "tool_call_id": tool_call["id"],
+                "role": "tool",
+                "content": result
+            })
+            
+        elif function_name == "semantic_search":
+            hits = semantic_search(arguments.get("query", ""), k=3)
+            if hits:
+                result = f"🔎 Propiedades que encajan con \"{arguments.get('query', '')}\":\n\n"
+                for prop, _ in hits:
+                    result += format_property_card(prop, channel=channel)
+            else:
+                result = "No encontré propiedades que encajen con esa descripción. Puedes ofrecer el catálogo completo."
+            
+            tool_results.append({
+                "tool_call_id": tool_call["id"],
                 "role": "tool",
                 "content": result
             })
@@ -361,41 +689,63 @@ def process_tool_calls(tool_calls: list, channel: str, session_id: str,
             saved_fields = [k for k, v in arguments.items() if v]
             result = f"✅ Guardado: {', '.join(saved_fields)}"
             
-            # Guardar en base de datos
-            save_lead(
+            # Guardar en base de datos (en un hilo, sin bloquear el event loop)
+            await create_or_update_lead_async(
                 channel=channel,
-                lead_data=lead_data,
-                conversation_history=conversation_history,
+                session_id=session_id,
                 telegram_username=telegram_username,
-                session_id=session_id
+                lead_data=lead_data,
+                conversation_history=conversation_history
             )
             
             tool_results.append({
-                "tool_call_id": tool_call.id,
+                "tool_call_id": tool_call["id"],
                 "role": "tool",
                 "content": result
             })
     
-    return tool_results, lead_data
+    return tool_results, lead_data, direct_replies
 
 
-async def process_message(
+async def stream_message(
     message: str,
     conversation_history: list,
     channel: str = "web",
     session_id: Optional[str] = None,
     telegram_username: Optional[str] = None
-) -> tuple[str, list, dict]:
-    """Procesa un mensaje del usuario y genera una respuesta."""
-
+):
+    """
+    Procesa un mensaje del usuario emitiendo la respuesta según se genera.
+    Eventos (dicts):
+    - {"type": "token", "text": ...}: fragmento de texto de la respuesta
+    - {"type": "tool", "name": ...}: el modelo ejecuta una herramienta; el texto
+      emitido hasta aquí se descarta y la respuesta final llega a continuación
+    - {"type": "done", "response": ..., "lead_data": ...}: respuesta completa (siempre el último)
+    """
     if not client:
-        return "Lo siento, el servicio no está disponible. Intenta más tarde.", conversation_history, {}
+        yield {"type": "done", "response": "Lo siento, el servicio no está disponible. Intenta más tarde.", "lead_data": {}}
+        return
+
+    # Turno de apertura (sin mensajes previos del cliente): la respuesta no depende de la sesión
+    cache_key = None
+    if not any(m.get("role") == "user" for m in conversation_history):
+        cache_key = response_cache.key(message, channel, get_catalog().version)
 
     # Agregar mensaje al historial
     conversation_history.append({
         "role": "user",
         "content": message
     })
+    turn_start = len(conversation_history)
+
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            bot_response, messages = cached
+            conversation_history.extend(messages)
+            yield {"type": "token", "text": bot_response}
+            yield {"type": "done", "response": bot_response, "lead_data": {}}
+            return
 
     # OPTIMIZACIÓN PARA VOZ: Usar configuración MÁS rápida y concisa
     is_voice = channel == "voice"
@@ -404,73 +754,115 @@ async def process_message(
     max_tokens_second = 60 if is_voice else 600  # Reducido a 60
     temperature = 0.4 if is_voice else 0.8  # Más predecible y rápido (0.5 → 0.4)
 
-    messages = [{"role": "system", "content": system_prompt}] + conversation_history
+    # El historial completo se conserva; al modelo solo va la vista acotada del canal
+    context_key = (channel, session_id) if session_id else None
 
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
+        catalog_context = build_catalog_context(conversation_history, channel)
+        messages = build_messages(
+            system_prompt, conversation_context.messages(conversation_history, channel, context_key), catalog_context
+        )
+
+        content = []
+        tool_calls = {}
+        async for delta in stream_completion(
             messages=messages,
             tools=TOOLS,
             tool_choice="auto",
             max_tokens=max_tokens_first,
-            temperature=temperature,
-            timeout=8.0  # Timeout de 8 segundos para respuesta rápida
-        )
-        
-        assistant_message = response.choices[0].message
+            temperature=temperature
+        ):
+            if delta.content:
+                content.append(delta.content)
+                yield {"type": "token", "text": delta.content}
+            # Las llamadas a herramientas llegan troceadas: se reconstruyen por índice
+            for call in delta.tool_calls or ():
+                entry = tool_calls.setdefault(call.index, {
+                    "id": "",
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""}
+                })
+                if call.id:
+                    entry["id"] = call.id
+                if call.function and call.function.name:
+                    entry["function"]["name"] += call.function.name
+                if call.function and call.function.arguments:
+                    entry["function"]["arguments"] += call.function.arguments
+
         lead_data = {}
-        
-        if assistant_message.tool_calls:
+
+        if tool_calls:
+            calls = [tool_calls[index] for index in sorted(tool_calls)]
             conversation_history.append({
                 "role": "assistant",
-                "content": assistant_message.content or "",
-                "tool_calls": [
-                    {
-                        "id": tc.id,
-                        "type": "function",
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
-                        }
-                    }
-                    for tc in assistant_message.tool_calls
-                ]
+                "content": "".join(content),
+                "tool_calls": calls
             })
-            
-            tool_results, lead_data = process_tool_calls(
-                assistant_message.tool_calls,
+            for call in calls:
+                yield {"type": "tool", "name": call["function"]["name"]}
+
+            tool_results, lead_data, direct_replies = await process_tool_calls(
+                calls,
                 channel,
                 session_id,
                 telegram_username,
                 conversation_history
             )
             
+            direct = all(TOOL_REPLY_POLICY.get(call["function"]["name"]) == "direct" for call in calls)
             for result in tool_results:
+                if direct:
+                    # La salida completa va en la respuesta; en el historial basta una marca
+                    result["content"] = direct_replies[result["tool_call_id"]][1]
                 conversation_history.append(result)
             
-            # Segunda llamada para respuesta final
-            messages = [{"role": "system", "content": system_prompt}] + conversation_history
-
-            final_response = client.chat.completions.create(
-                model=MODEL,
-                messages=messages,
-                max_tokens=max_tokens_second,
-                temperature=temperature,
-                timeout=8.0  # Timeout de 8 segundos
-            )
-            
-            bot_response = final_response.choices[0].message.content
-        else:
-            bot_response = assistant_message.content
-        
+            if direct:
+                # Herramientas deterministas: su salida ya es la respuesta, sin segunda llamada
+                content = ["\n\n".join(reply for reply, _ in direct_replies.values())]
+                yield {"type": "token", "text": content[0]}
+            else:
+                # Segunda llamada para respuesta final
+                messages = build_messages(
+                    system_prompt, conversation_context.messages(conversation_history, channel, context_key), catalog_context
+                )
+
+                content = []
+                async for delta in stream_completion(
+                    messages=messages,
+                    max_tokens=max_tokens_second,
+                    temperature=temperature
+                ):
+                    if delta.content:
+                        content.append(delta.content)
+                        yield {"type": "token", "text": delta.content}
+
+        bot_response = "".join(content)
         conversation_history.append({
             "role": "assistant",
             "content": bot_response
         })
+
+        # Los turnos que guardaron datos del cliente no se reutilizan
+        if cache_key is not None and not lead_data and bot_response:
+            response_cache.put(cache_key, bot_response, conversation_history[turn_start:])
         
-        return bot_response, conversation_history, lead_data
+        yield {"type": "done", "response": bot_response, "lead_data": lead_data}
         
     except Exception as e:
-        error_message = "Disculpa, tuve un problema técnico. ¿Podrías repetirlo?"
         print(f"Error: {str(e)}")
-        return error_message, conversation_history, {}
+        yield {"type": "done", "response": "Disculpa, tuve un problema técnico. ¿Podrías repetirlo?", "lead_data": {}}
+
+
+async def process_message(
+    message: str,
+    conversation_history: list,
+    channel: str = "web",
+    session_id: Optional[str] = None,
+    telegram_username: Optional[str] = None
+) -> tuple[str, list, dict]:
+    """Procesa un mensaje del usuario y genera una respuesta (completa, sin streaming)."""
+    result = {}
+    async for event in stream_message(message, conversation_history, channel, session_id, telegram_username):
+        if event["type"] == "done":
+            result = event
+    return result["response"], conversation_history, result["lead_data"]
@@ -0,0 +1,267 @@
+"""
+Importación masiva del catálogo desde feeds JSON, NDJSON o CSV (export del MLS).
+
+El feed se lee como un flujo: cada formato tiene un generador que produce
+un registro cada vez (el array JSON se decodifica por trozos), así que el
+fichero nunca se carga entero en memoria. Cada registro se valida y se
+normaliza a una operación:
+
+- ("upsert", propiedad): alta o actualización por ID
+- ("delete", id): baja (registro con "action": "delete")
+
+Los registros inválidos no detienen la importación: se cuentan y se guardan
+los primeros errores para el informe.
+"""
+import csv
+import io
+import itertools
+import json
+import re
+from typing import Iterator, Optional
+
+# Formatos admitidos
+FEED_FORMATS = ("json", "ndjson", "csv")
+# Tamaño de cada lectura del feed
+READ_CHUNK_SIZE = 64 * 1024
+# Tamaño máximo (caracteres) de un elemento del array JSON: uno roto o enorme no
+# debe acumular el resto del fichero en el buffer ni redecodificarlo en cada trozo
+MAX_JSON_ELEMENT_SIZE = 1024 * 1024
+# Errores que se conservan en el informe (el resto solo se cuentan)
+MAX_REPORTED_ERRORS = 50
+
+# Campos de una propiedad y su tipo
+# (las fichas del chat muestran habitaciones, baños y superficie de todas las propiedades)
+REQUIRED_FIELDS = ("id", "title", "type", "zone", "price", "bedrooms", "bathrooms", "area")
+TEXT_FIELDS = ("id", "title", "type", "zone", "objective", "priceType", "description", "target")
+INT_FIELDS = ("price", "bedrooms", "bathrooms", "area")
+OBJECTIVES = ("venta", "alquiler")
+# Valores de "action" que indican una baja
+DELETE_ACTIONS = ("delete", "deleted", "remove", "baja")
+
+# Enteros con separador de miles español o decimales ("200.000", "200000", "85,5")
+NUMBER = re.compile(r"\d{1,3}(?:\.\d{3})+|\d+(?:[.,]\d+)?")
+DECIMAL = re.compile(r"\d+\.\d{1,2}")
+
+
+class FeedError(ValueError):
+    """El feed no se puede leer (formato desconocido o estructura rota)."""
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """Formato del feed según la extensión del fichero."""
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    if extension in ("jsonl", "ndjson"):
+        return "ndjson"
+    return extension if extension in FEED_FORMATS else None
+
+
+# ==================== LECTURA DEL FEED ====================
+
+def _text_stream(stream):
+    """Flujo de texto UTF-8 (con o sin BOM) sobre un fichero binario o de texto."""
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+
+def iter_json_array(stream) -> Iterator[tuple]:
+    """
+    (número, objeto) de cada elemento de un array JSON, decodificado por trozos.
+    Lanza FeedError con el offset en bytes si un elemento supera MAX_JSON_ELEMENT_SIZE.
+    """
+    decoder = json.JSONDecoder()
+    text = _text_stream(stream)
+    buffer = ""
+    position = 0
+    # Bytes del feed ya descartados del buffer (para situar los errores)
+    consumed = 0
+    started = False
+    number = 0
+    while True:
+        chunk = text.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        consumed += len(buffer[:position].encode("utf-8"))
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            # Saltar espacios y separadores hasta el siguiente elemento
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise FeedError("El feed JSON debe ser un array de propiedades")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if len(buffer) - position > MAX_JSON_ELEMENT_SIZE:
+                    offset = consumed + len(buffer[:position].encode("utf-8"))
+                    raise FeedError(
+                        f"Elemento {number + 1} (byte {offset}) inválido o mayor de "
+                        f"{MAX_JSON_ELEMENT_SIZE} caracteres"
+                    )
+                # Elemento incompleto: esperar al siguiente trozo
+                break
+            number += 1
+            position = end
+            yield number, item
+    if buffer[position:].strip():
+        raise FeedError(f"JSON inválido o truncado tras el elemento {number}")
+    if not started:
+        raise FeedError("El feed JSON está vacío")
+    raise FeedError("Falta el cierre ']' del array JSON")
+
+
+def iter_ndjson(stream) -> Iterator[tuple]:
+    """(línea, objeto) de cada línea de un feed NDJSON."""
+    for number, line in enumerate(_text_stream(stream), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, FeedError(f"JSON inválido: {e.msg}")
+
+
+def iter_csv(stream) -> Iterator[tuple]:
+    """(fila, registro) de cada fila de un CSV con cabecera (separador , o ;)."""
+    text = _text_stream(stream)
+    header = text.readline()
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    reader = csv.DictReader(itertools.chain([header], text), delimiter=delimiter)
+    for row in reader:
+        yield reader.line_num, {key.strip(): value for key, value in row.items() if key and value not in (None, "")}
+
+
+def iter_records(stream, feed_format: str) -> Iterator[tuple]:
+    """(número, registro en bruto) del feed según su formato."""
+    if feed_format == "json":
+        return iter_json_array(stream)
+    if feed_format == "ndjson":
+        return iter_ndjson(stream)
+    if feed_format == "csv":
+        return iter_csv(stream)
+    raise FeedError(f"Formato no soportado: {feed_format} (usa {', '.join(FEED_FORMATS)})")
+
+
+# ==================== VALIDACIÓN ====================
+
+def parse_int(value, field: str) -> int:
+    """Entero de un número JSON o de un texto ("200.000 €", "85", "1,5")."""
+    if isinstance(value, bool):
+        raise ValueError(f"{field}: valor no numérico")
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        match = NUMBER.search(str(value))
+        if not match:
+            raise ValueError(f"{field}: valor no numérico '{value}'")
+        text = match.group()
+        if "," in text:
+            text = text.replace(",", ".")
+        elif not DECIMAL.fullmatch(text):
+            # El punto es separador de miles salvo en decimales cortos ("85.5")
+            text = text.replace(".", "")
+        number = float(text)
+    if number < 0:
+        raise ValueError(f"{field}: no puede ser negativo")
+    return int(round(number))
+
+
+def parse_features(value) -> list:
+    """Características: lista JSON o texto separado por | o ;"""
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = re.split(r"[|;]", str(value))
+    return [str(item).strip() for item in items if str(item).strip()]
+
+
+def validate_record(record) -> tuple:
+    """
+    Convierte un registro del feed en una operación ("upsert", propiedad) o
+    ("delete", id). Lanza ValueError si el registro no es válido.
+    """
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("El registro no es un objeto")
+
+    property_id = str(record.get("id") or "").strip()
+    if not property_id:
+        raise ValueError("Falta el campo id")
+    action = str(record.get("action") or "").strip().lower()
+    if action in DELETE_ACTIONS or record.get("deleted") is True:
+        return "delete", property_id
+
+    missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, "")]
+    if missing:
+        raise ValueError(f"Faltan campos obligatorios: {', '.join(missing)}")
+
+    prop = {}
+    for field in TEXT_FIELDS:
+        value = record.get(field)
+        if value not in (None, ""):
+            prop[field] = str(value).strip()
+    prop["id"] = property_id
+    prop["type"] = prop["type"].lower()
+    if "objective" in prop:
+        prop["objective"] = prop["objective"].lower()
+        if prop["objective"] not in OBJECTIVES:
+            raise ValueError(f"objective debe ser {' o '.join(OBJECTIVES)}")
+    for field in INT_FIELDS:
+        if record.get(field) not in (None, ""):
+            prop[field] = parse_int(record[field], field)
+    if prop["price"] <= 0:
+        raise ValueError("price debe ser mayor que 0")
+    if record.get("features") not in (None, ""):
+        prop["features"] = parse_features(record["features"])
+    return "upsert", prop
+
+
+def iter_changes(stream, feed_format: str, report: dict, strict: bool = False) -> Iterator[tuple]:
+    """
+    Operaciones válidas del feed, en orden. Los registros inválidos se
+    anotan en report["invalid"] / report["errors"] y se saltan; con
+    strict=True, al terminar el feed se lanza FeedError si hubo alguno
+    (una sustitución completa no debe borrar propiedades por un registro roto).
+    """
+    records = iter_records(stream, feed_format)
+    while True:
+        try:
+            number, record = next(records)
+        except StopIteration:
+            break
+        except UnicodeDecodeError:
+            raise FeedError(f"El feed no está codificado en UTF-8 (tras el registro {report['read']})")
+        report["read"] += 1
+        try:
+            yield validate_record(record)
+        except ValueError as e:
+            report["invalid"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"record": number, "error": str(e)})
+    if strict and report["invalid"]:
+        raise FeedError(f"{report['invalid']} registros inválidos: no se sustituye el catálogo")
+
+
+def new_report(feed_format: str) -> dict:
+    """Informe vacío de una importación."""
+    return {
+        "format": feed_format,
+        "read": 0,
+        "invalid": 0,
+        "created": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "deleted": 0,
+        "errors": []
+    }
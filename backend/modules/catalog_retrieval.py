@@ -0,0 +1,117 @@
+"""
+Selección de las propiedades relevantes para una conversación.
+
+Sirve para construir la sección de catálogo del system prompt: en lugar de
+enviar todas las propiedades en cada llamada, se ordenan según lo que el
+cliente ha dicho en los últimos turnos (zona, tipo, características,
+presupuesto, habitaciones) y solo las primeras caben en el prompt.
+
+El índice se construye una vez por versión del catálogo: un índice invertido
+token -> posiciones sobre título, zona, tipo, objetivo y características,
+con un peso por rareza de cada token.
+"""
+import math
+import re
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from modules.property_index import normalize_text, tokenize
+
+# Cantidades: "300.000", "300 mil", "1,5 millones", "1.200 €"
+AMOUNT = re.compile(r"(\d{1,3}(?:\.\d{3})+|\d+(?:,\d+)?)\s*(millones|millón|millon|mil|k\b|€|euros)?")
+BEDROOMS = re.compile(r"(\d+)\s*(?:hab|dormitorio|cuarto)")
+
+# Importes por debajo de esto se interpretan como alquiler mensual
+MONTHLY_LIMIT = 10000
+# Rango de importes que se aceptan como presupuesto (descarta teléfonos y años)
+MIN_AMOUNT = 300
+MAX_AMOUNT = 50_000_000
+# Peso del encaje de presupuesto y habitaciones frente a un token raro
+BUDGET_WEIGHT = 2.0
+BEDROOMS_WEIGHT = 1.0
+
+
+def parse_amount(number: str, unit: str = None) -> int:
+    """Convierte "300.000", "300 mil" o "1,5 millones" en euros."""
+    value = float(number.replace(".", "").replace(",", "."))
+    if unit and unit.startswith("mill"):
+        value *= 1_000_000
+    elif unit in ("mil", "k"):
+        value *= 1000
+    return int(value)
+
+
+def find_budget(text: str):
+    """Último importe mencionado en el texto que parece un presupuesto, o None."""
+    budget = None
+    for number, unit in AMOUNT.findall(text.lower()):
+        # Sin unidad ni separador de miles solo cuentan cifras redondas grandes ("300000")
+        if not unit and "." not in number and int(float(number.replace(",", "."))) < MONTHLY_LIMIT:
+            continue
+        amount = parse_amount(number, unit)
+        if MIN_AMOUNT <= amount <= MAX_AMOUNT:
+            budget = amount
+    return budget
+
+
+class CatalogRetriever:
+    """Ordena las propiedades de una versión del catálogo por relevancia para un texto."""
+
+    def __init__(self, properties):
+        self.properties = properties
+        prices = [prop.get("price") or 0 for prop in properties]
+        self.price_order = sorted(range(len(properties)), key=prices.__getitem__)
+        self.sorted_prices = [prices[i] for i in self.price_order]
+        self.bedrooms = [prop.get("bedrooms") or 0 for prop in properties]
+        self.postings: dict[str, list] = {}
+        for position, prop in enumerate(properties):
+            text = " ".join([
+                prop.get("title") or "", prop.get("zone") or "", prop.get("type") or "",
+                prop.get("objective") or "", " ".join(prop.get("features") or ())
+            ])
+            for token in set(tokenize(text)):
+                self.postings.setdefault(token, []).append(position)
+        total = len(properties) or 1
+        self.weights = {
+            token: math.log(1 + total / len(positions))
+            for token, positions in self.postings.items()
+        }
+
+    def scores(self, text: str) -> Counter:
+        """Posición -> puntuación de las propiedades que encajan con el texto."""
+        normalized = normalize_text(text)
+        scores = Counter()
+        for token in set(tokenize(normalized, normalized=True)):
+            weight = self.weights.get(token)
+            if weight:
+                for position in self.postings[token]:
+                    scores[position] += weight
+
+        # Presupuesto: favorece lo que cabe en él y se le acerca (entre 50% y 110%)
+        budget = find_budget(text)
+        if budget:
+            low = bisect_left(self.sorted_prices, budget * 0.5)
+            high = bisect_right(self.sorted_prices, budget * 1.1)
+            for i in range(low, high):
+                scores[self.price_order[i]] += BUDGET_WEIGHT * (1 - abs(budget - self.sorted_prices[i]) / budget)
+
+        rooms = BEDROOMS.findall(normalized)
+        if rooms:
+            wanted = int(rooms[-1])
+            for position, bedrooms in enumerate(self.bedrooms):
+                if bedrooms >= wanted:
+                    scores[position] += BEDROOMS_WEIGHT
+        return scores
+
+    def rank(self, text: str):
+        """
+        Itera las propiedades de más a menos relevante: primero las que encajan
+        con el texto y después el resto en el orden del catálogo.
+        """
+        scores = self.scores(text)
+        ranked = sorted(scores, key=lambda position: (-scores[position], position))
+        for position in ranked:
+            yield self.properties[position]
+        for position, prop in enumerate(self.properties):
+            if position not in scores:
+                yield prop
@@ -0,0 +1,272 @@
+"""
+Contexto acotado de la conversación para el prompt.
+
+El historial completo de cada sesión se conserva (transcripts y leads), pero
+al modelo solo se le envía una vista acotada:
+
+- los últimos N turnos del cliente, tal cual
+- los turnos anteriores aún no resumidos, con las salidas de herramientas
+  (show_catalog y compañía, que son lo más voluminoso) sustituidas por una
+  referencia corta
+- lo anterior, plegado en un resumen acumulativo que se recalcula en segundo
+  plano cada CONTEXT_SUMMARY_BATCH turnos, sin esperar en el turno en curso
+
+Todo ello cabe en un presupuesto de tokens por canal: si no cabe, se
+descartan primero los turnos antiguos pendientes de resumir, después se
+acortan las herramientas de los turnos recientes y por último los propios
+turnos recientes. El turno en curso siempre va entero, así que la voz se
+queda en un prompt pequeño y estable.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from config import (
+    CONTEXT_RECENT_TURNS, VOICE_CONTEXT_RECENT_TURNS, CONTEXT_TOKEN_BUDGET,
+    VOICE_CONTEXT_TOKEN_BUDGET, CONTEXT_SUMMARY_BATCH, CONTEXT_SUMMARY_MAX_TOKENS
+)
+
+# Sesiones cuyo resumen se mantiene en memoria (las menos usadas se olvidan)
+MAX_TRACKED_SESSIONS = 10000
+# Caracteres de la salida de una herramienta que se conservan en su referencia
+REFERENCE_PREVIEW_CHARS = 80
+# Caracteres de cada mensaje en el resumen extractivo de respaldo
+EXTRACT_CHARS = 120
+
+SUMMARY_TITLE = "## RESUMEN DE LA CONVERSACIÓN ANTERIOR"
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens (unos 4 caracteres por token en español)."""
+    return len(text) // 4 + 1
+
+
+def message_tokens(message: dict) -> int:
+    """Tokens aproximados de un mensaje de la API (contenido, herramientas y envoltorio)."""
+    tokens = 4 + estimate_tokens(message.get("content") or "")
+    for call in message.get("tool_calls") or ():
+        tokens += estimate_tokens(call["function"]["name"] + call["function"]["arguments"])
+    return tokens
+
+
+def split_turns(messages: list) -> list:
+    """
+    Agrupa los mensajes por turnos: cada turno empieza en un mensaje del cliente
+    (lo anterior al primero, como el saludo de voz, forma su propio turno). Así
+    una llamada a herramienta y sus resultados nunca se separan.
+    """
+    turns = []
+    for message in messages:
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def tool_reference(name: str, content: str) -> str:
+    """Referencia corta que sustituye a la salida de una herramienta ya mostrada."""
+    first_line = next((line.strip() for line in content.splitlines() if line.strip()), "")
+    if len(first_line) > REFERENCE_PREVIEW_CHARS:
+        first_line = first_line[:REFERENCE_PREVIEW_CHARS] + "…"
+    return f"[Resultado de {name} ya mostrado al cliente: \"{first_line}\". Vuelve a llamarla si necesitas los detalles.]"
+
+
+def collapse_tool_outputs(messages: list) -> list:
+    """Copia de los mensajes con las salidas de herramientas sustituidas por referencias."""
+    names = {}
+    collapsed = []
+    for message in messages:
+        for call in message.get("tool_calls") or ():
+            names[call["id"]] = call["function"]["name"]
+        if message.get("role") == "tool":
+            message = {
+                **message,
+                "content": tool_reference(names.get(message.get("tool_call_id"), "herramienta"), message.get("content") or "")
+            }
+        collapsed.append(message)
+    return collapsed
+
+
+def transcript_lines(messages: list) -> list:
+    """Líneas legibles de unos mensajes (para resumirlos)."""
+    lines = []
+    for message in collapse_tool_outputs(messages):
+        role = message.get("role")
+        content = (message.get("content") or "").strip()
+        if role == "user":
+            lines.append(f"Cliente: {content}")
+        elif role == "assistant":
+            if content:
+                lines.append(f"InmoBot: {content}")
+            for call in message.get("tool_calls") or ():
+                lines.append(f"(InmoBot usa {call['function']['name']} {call['function']['arguments']})")
+        elif role == "tool":
+            lines.append(content)
+    return lines
+
+
+def extractive_summary(previous: str, messages: list, max_tokens: int) -> str:
+    """
+    Resumen de respaldo sin modelo: el resumen anterior más lo que dijo el
+    cliente, conservando lo más reciente si no cabe en `max_tokens`.
+    """
+    lines = previous.splitlines() if previous else []
+    for message in messages:
+        content = message.get("content")
+        if message.get("role") == "user" and isinstance(content, str) and content.strip():
+            content = " ".join(content.split())
+            if len(content) > EXTRACT_CHARS:
+                content = content[:EXTRACT_CHARS] + "…"
+            lines.append(f"- Cliente: {content}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta un texto a unos `max_tokens` conservando el final (lo más reciente)."""
+    max_chars = max(max_tokens, 1) * 4
+    return text if len(text) <= max_chars else "…" + text[-max_chars:]
+
+
+class SessionSummary:
+    """Resumen acumulado de una sesión: cubre history[:upto]."""
+
+    __slots__ = ("text", "upto", "anchor", "task")
+
+    def __init__(self):
+        self.text = ""
+        self.upto = 0
+        # Último mensaje resumido: si el historial ya no lo contiene en su sitio, el resumen no vale
+        self.anchor = None
+        self.task = None
+
+    def matches(self, history: list) -> bool:
+        return self.upto == 0 or (self.upto <= len(history) and history[self.upto - 1] is self.anchor)
+
+
+class ConversationContext:
+    """
+    Vistas acotadas del historial por sesión. `summarize(previous, messages,
+    channel, max_tokens)` es la corrutina que pliega mensajes en el resumen;
+    sin ella (o si falla) se usa el resumen extractivo.
+    """
+
+    def __init__(self, summarize: Optional[Callable[..., Awaitable[str]]] = None):
+        self.summarize = summarize
+        self._summaries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def limits(channel: str) -> tuple:
+        """(turnos recientes, presupuesto de tokens, tokens del resumen) del canal."""
+        if channel == "voice":
+            recent_turns, budget = VOICE_CONTEXT_RECENT_TURNS, VOICE_CONTEXT_TOKEN_BUDGET
+        else:
+            recent_turns, budget = CONTEXT_RECENT_TURNS, CONTEXT_TOKEN_BUDGET
+        return max(recent_turns, 1), budget, min(CONTEXT_SUMMARY_MAX_TOKENS, budget // 4)
+
+    def _summary(self, session_key) -> Optional[SessionSummary]:
+        if session_key is None:
+            return None
+        summary = self._summaries.get(session_key)
+        if summary is None:
+            summary = self._summaries[session_key] = SessionSummary()
+            while len(self._summaries) > MAX_TRACKED_SESSIONS:
+                self._summaries.popitem(last=False)
+        else:
+            self._summaries.move_to_end(session_key)
+        return summary
+
+    def forget(self, session_key) -> None:
+        """Descarta el resumen de una sesión."""
+        summary = self._summaries.pop(session_key, None)
+        if summary is not None and summary.task is not None:
+            summary.task.cancel()
+
+    # ==================== VISTA DEL HISTORIAL ====================
+
+    def messages(self, history: list, channel: str = "web", session_key=None) -> list:
+        """
+        Mensajes del historial que se envían al modelo (sin el system prompt):
+        resumen, turnos antiguos con herramientas abreviadas y turnos recientes,
+        dentro del presupuesto del canal. No modifica `history`.
+        """
+        recent_turns, budget, summary_tokens = self.limits(channel)
+        summary = self._summary(session_key)
+        if summary is not None and not summary.matches(history):
+            # El historial se sustituyó o recortó: el resumen ya no corresponde
+            self.forget(session_key)
+            summary = self._summary(session_key)
+
+        summarized = summary.upto if summary is not None else 0
+        turns = split_turns(history[summarized:])
+        pending = [collapse_tool_outputs(turn) for turn in turns[:-recent_turns]]
+        recent = turns[-recent_turns:]
+
+        if summary is not None and len(pending) >= CONTEXT_SUMMARY_BATCH and summary.task is None:
+            folded = sum(len(turn) for turn in pending)
+            self._schedule(session_key, summary, history, summarized + folded, channel, summary_tokens)
+
+        summary_text = summary.text if summary is not None else ""
+        return self._fit(summary_text, pending, recent, budget)
+
+    @staticmethod
+    def _fit(summary_text: str, pending: list, recent: list, budget: int) -> list:
+        """Ajusta resumen + turnos al presupuesto; el último turno siempre entra entero."""
+        def total() -> int:
+            summary_cost = estimate_tokens(summary_text) + 4 if summary_text else 0
+            return summary_cost + sum(message_tokens(m) for turn in pending + recent for m in turn)
+
+        # 1. Turnos antiguos pendientes de resumir (ya abreviados), del más antiguo al más nuevo
+        while pending and total() > budget:
+            pending.pop(0)
+        # 2. Herramientas de los turnos recientes anteriores al actual
+        if total() > budget:
+            recent = [collapse_tool_outputs(turn) for turn in recent[:-1]] + recent[-1:]
+        # 3. Turnos recientes, salvo el actual
+        while len(recent) > 1 and total() > budget:
+            recent.pop(0)
+        # 4. El propio resumen, conservando su final
+        if summary_text and total() > budget:
+            remaining = budget - sum(message_tokens(m) for turn in recent for m in turn) - 4
+            summary_text = truncate_to_tokens(summary_text, remaining) if remaining > 0 else ""
+
+        messages = [{"role": "system", "content": f"{SUMMARY_TITLE}\n{summary_text}"}] if summary_text else []
+        for turn in pending + recent:
+            messages.extend(turn)
+        return messages
+
+    # ==================== RESUMEN EN SEGUNDO PLANO ====================
+
+    def _schedule(self, session_key, summary: SessionSummary, history: list, upto: int,
+                  channel: str, max_tokens: int) -> None:
+        """Pliega history[summary.upto:upto] en el resumen sin bloquear el turno en curso."""
+        folded = history[summary.upto:upto]
+        anchor = history[upto - 1]
+        previous = summary.text
+
+        async def refresh():
+            text = None
+            if self.summarize is not None:
+                try:
+                    text = await self.summarize(previous, folded, channel, max_tokens)
+                except Exception as e:
+                    print(f"[CONTEXT] No se pudo resumir la conversación: {e}")
+            if not text:
+                text = extractive_summary(previous, folded, max_tokens)
+            summary.text = truncate_to_tokens(text.strip(), max_tokens)
+            summary.upto = upto
+            summary.anchor = anchor
+
+        def done(task):
+            summary.task = None
+
+        try:
+            summary.task = asyncio.get_running_loop().create_task(refresh())
+        except RuntimeError:
+            # Sin event loop (uso síncrono): resumen extractivo inmediato
+            summary.text = extractive_summary(previous, folded, max_tokens)
+            summary.upto = upto
+            summary.anchor = anchor
+            return
+        summary.task.add_done_callback(done)
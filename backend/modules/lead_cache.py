@@ -0,0 +1,257 @@
+"""
+Caché en memoria de leads con escritura diferida (write-behind), opcional:
+se activa con LEADS_FLUSH_INTERVAL > 0 (por defecto las escrituras van
+directas al backend).
+
+El conjunto completo de leads vive en memoria y es la fuente de verdad del
+proceso, por lo que solo es válida con un único proceso servidor; con
+varios workers no debe activarse. Las modificaciones se acumulan por lead
+en un lote de cambios pendientes, de modo que N actualizaciones del mismo
+lead dentro de una ventana se traducen en una sola escritura al backend
+(JournalLeadStore o SQLiteLeadRepository). El lote se vuelca por
+temporizador, al superar un tamaño máximo y al apagar el servidor.
+
+Dos locks: `_lock` protege la memoria y `_flush_lock` serializa los
+volcados. Cuando hacen falta los dos se toma primero `_flush_lock`, y nunca
+se vuelca con `_lock` tomado: dentro de una transacción el volcado queda
+pedido y se hace al salir de ella.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from modules.lead_identity import IdentityIndex
+from modules.lead_stats import LeadStats, stats_view
+from modules.lead_store import RecencyIndex, count_matching, iter_until, lead_sort_key, paginate_recent
+
+
+class LeadCache:
+    """Leads en memoria delante de un backend persistente."""
+
+    def __init__(self, backend, max_dirty: int = 100):
+        self.backend = backend
+        self.max_dirty = max_dirty
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        # Profundidad de transacción del hilo actual (para no volcar dentro de una)
+        self._local = threading.local()
+        self._flush_due = False
+        self._dirty: dict[str, dict] = {}
+        # Leads eliminados pendientes de borrar en el backend (antes que _dirty)
+        self._deleted: set = set()
+        self._leads: dict[str, dict] = {}
+        # Versión del backend tras el último volcado y escrituras en memoria desde entonces
+        self._base_version = backend.version
+        self._writes = 0
+        # Agregados, índice de identidad y orden por recencia de los leads en memoria
+        self.lead_stats = LeadStats()
+        self.identity = IdentityIndex()
+        self.recency = RecencyIndex()
+
+        # Los leads se mantienen ordenados por updated_at (el más reciente al final)
+        for lead in sorted(backend.all(), key=lead_sort_key):
+            if lead.get("id"):
+                # Copia propia: el backend puede estar serializando sus objetos en otro hilo
+                lead = dict(lead)
+                self._leads[lead["id"]] = lead
+        self._rebuild_indexes()
+
+    # ==================== TRANSACCIONES ====================
+
+    @contextmanager
+    def transaction(self):
+        """
+        Sección crítica entre hilos: solo memoria, sin E/S de disco. Si durante
+        ella se pidió un volcado, se hace al salir (ya sin `_lock`).
+        """
+        with self._lock:
+            self._local.depth = self._depth() + 1
+            try:
+                yield self
+            finally:
+                self._local.depth -= 1
+        self._flush_if_due()
+
+    def _depth(self) -> int:
+        return getattr(self._local, "depth", 0)
+
+    def _flush_if_due(self) -> None:
+        """Vuelca si hay un volcado pedido y el hilo no está dentro de una transacción."""
+        if self._flush_due and self._depth() == 0:
+            self.flush()
+
+    def refresh(self) -> None:
+        """Sin efecto: la caché es la fuente de verdad del proceso."""
+
+    @property
+    def version(self) -> str:
+        """
+        Versión de los datos (para ETags): la del backend en el último volcado
+        más las escrituras aún en memoria. Tras reiniciar parte de lo que hay
+        en disco, así que no repite versiones de la ejecución anterior.
+        """
+        with self._lock:
+            return f"{self._base_version}+{self._writes}"
+
+    # ==================== ÍNDICES ====================
+
+    def _rebuild_indexes(self) -> None:
+        self.lead_stats.rebuild(self._leads.values())
+        self.identity.rebuild(self._leads.values())
+        self.recency.rebuild(self._leads.values())
+
+    # ==================== LECTURA ====================
+
+    def get(self, lead_id: str) -> Optional[dict]:
+        """Retorna un lead por su ID."""
+        return self._leads.get(lead_id)
+
+    def all(self) -> list:
+        """Retorna todos los leads (sin orden garantizado)."""
+        return list(self._leads.values())
+
+    def resolve_identity(self, keys: list) -> list:
+        """IDs de los leads (supervivientes de uniones, sin repetir) a los que apuntan las claves."""
+        return self.identity.resolve(keys)
+
+    def having_field(self, field: str) -> list:
+        """Leads que tienen el campo dado (aunque sea nulo)."""
+        return [lead for lead in self._leads.values() if field in lead]
+
+    def stats(self) -> dict:
+        """Agregados de los leads (mantenidos incrementalmente)."""
+        return self.lead_stats.snapshot()
+
+    def by_field(self, field: str, value) -> list:
+        """Retorna los leads cuyo campo coincide con el valor dado."""
+        return [lead for lead in self._leads.values() if lead.get(field) == value]
+
+    def query(self, filters: dict, cursor: Optional[tuple] = None, limit: int = 50) -> list:
+        """Página de leads filtrados, del más reciente al más antiguo."""
+        with self._lock:
+            leads = (self._leads[lead_id] for lead_id in self.recency.recent(cursor))
+            return paginate_recent(leads, filters, limit)
+
+    def count(self, filters: dict) -> int:
+        """Número de leads que cumplen los filtros de query()."""
+        with self._lock:
+            return count_matching(self._leads.values(), filters, self.lead_stats)
+
+    def iter_recent(self, since: Optional[str] = None):
+        """Itera los leads del más reciente al más antiguo, hasta `since` (updated_at)."""
+        with self._lock:
+            leads = [self._leads[lead_id] for lead_id in self.recency.recent()]
+        return iter_until(leads, since)
+
+    def __len__(self) -> int:
+        return len(self._leads)
+
+    # ==================== ESCRITURA ====================
+
+    def set(self, lead_id: str, fields: dict) -> dict:
+        """Aplica los cambios en memoria y los deja pendientes de volcado."""
+        with self._lock:
+            if "updated_at" in fields:
+                # Un lead actualizado pasa al final del orden por recencia
+                lead = self._leads.pop(lead_id, None)
+            else:
+                lead = self._leads.get(lead_id)
+            before = stats_view(lead) if lead is not None else None
+            before_key = lead_sort_key(lead) if lead is not None else None
+            if lead is None:
+                lead = {"id": lead_id}
+            self._leads[lead_id] = lead
+            lead.update(fields)
+            self.lead_stats.update(before, stats_view(lead))
+            self.identity.add(lead)
+            self.recency.move(before_key, lead_sort_key(lead))
+
+            # Fusionar con los cambios pendientes del mismo lead
+            self._dirty.setdefault(lead_id, {}).update(fields)
+            self._writes += 1
+            if len(self._dirty) >= self.max_dirty:
+                self._flush_due = True
+
+        self._flush_if_due()
+        return lead
+
+    def delete(self, lead_id: str) -> Optional[dict]:
+        """Elimina un lead; el borrado en el backend se vuelca en cuanto se puede."""
+        with self._lock:
+            lead = self._leads.pop(lead_id, None)
+            if lead:
+                self.lead_stats.update(stats_view(lead), None)
+                self.recency.move(lead_sort_key(lead), None)
+            # Lo pendiente de este lead ya no se escribe
+            self._dirty.pop(lead_id, None)
+            self._deleted.add(lead_id)
+            self._writes += 1
+            self._flush_due = True
+
+        self._flush_if_due()
+        return lead
+
+    def replace_all(self, leads: list) -> None:
+        """Sustituye todos los leads en memoria y en el backend."""
+        # Sin volcados en curso que puedan escribir cambios anteriores después
+        with self._flush_lock, self._lock:
+            self._dirty = {}
+            self._deleted = set()
+            self._leads = {}
+            for lead in sorted(leads, key=lead_sort_key):
+                if lead.get("id"):
+                    self._leads[lead["id"]] = lead
+            self._rebuild_indexes()
+            self.backend.replace_all(leads)
+            self._base_version = self.backend.version
+            self._writes = 0
+
+    # ==================== VOLCADO ====================
+
+    @property
+    def pending(self) -> int:
+        """Número de leads con cambios pendientes de volcar."""
+        return len(self._dirty) + len(self._deleted)
+
+    def flush(self) -> int:
+        """
+        Vuelca al backend los cambios pendientes (primero los borrados). Retorna
+        cuántos leads se escribieron. No debe llamarse con `_lock` tomado.
+        """
+        # Los volcados se serializan entre sí, pero no bloquean las escrituras en memoria
+        with self._flush_lock:
+            with self._lock:
+                self._flush_due = False
+                if not self._dirty and not self._deleted:
+                    return 0
+                batch, self._dirty = self._dirty, {}
+                deleted, self._deleted = self._deleted, set()
+                writes = self._writes
+            try:
+                for lead_id in deleted:
+                    self.backend.delete(lead_id)
+                if batch:
+                    self.backend.set_many(batch)
+            except Exception:
+                # Reintentar en el siguiente volcado sin perder cambios posteriores
+                # (repetir un borrado ya aplicado no tiene efecto)
+                with self._lock:
+                    for lead_id in self._deleted:
+                        # Borrado después de tomar el lote: sus cambios ya no valen
+                        batch.pop(lead_id, None)
+                    for lead_id, fields in self._dirty.items():
+                        batch.setdefault(lead_id, {}).update(fields)
+                    self._dirty = batch
+                    self._deleted |= deleted
+                raise
+            base_version = self.backend.version
+            with self._lock:
+                self._base_version = base_version
+                self._writes -= writes
+            return len(batch) + len(deleted)
+
+    def close(self) -> None:
+        """Vuelca lo pendiente y cierra el backend."""
+        self.flush()
+        with self._flush_lock:
+            self.backend.close()
@@ -0,0 +1,102 @@
+"""
+Difusión de cambios de leads a los dashboards conectados (Server-Sent Events).
+
+Cada cambio se serializa una sola vez y se reparte a la cola de cada
+suscriptor. Un suscriptor demasiado lento no frena a los demás: si su cola
+se llena se vacía y recibe un evento "resync" para que vuelva a pedir el
+listado.
+"""
+import asyncio
+import json
+import threading
+from typing import Optional
+
+# Campos que viajan en los eventos (sin historial ni datos internos)
+EVENT_FIELDS = (
+    "id", "channel", "channels", "telegram_username", "name", "phone", "email",
+    "budget_min", "budget_max", "zone", "property_type", "bedrooms",
+    "urgency", "interested_property", "wants_visit", "status", "score",
+    "temperature", "message_count", "created_at", "updated_at"
+)
+
+
+def format_sse(event_type: str, data: dict) -> str:
+    """Formatea un evento en el formato de texto de Server-Sent Events."""
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class LeadEventBroker:
+    """Reparte eventos de leads a las colas de los suscriptores."""
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Registra un suscriptor (debe llamarse desde el event loop)."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """Elimina un suscriptor."""
+        with self._lock:
+            self._subscribers.discard(queue)
+
+    def publish(self, event_type: str, data: dict) -> None:
+        """Publica un evento. Se puede llamar desde el event loop o desde otro hilo."""
+        if not self._subscribers or self._loop is None:
+            return
+        message = format_sse(event_type, data)
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._deliver(message)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._deliver, message)
+
+    def _deliver(self, message: str) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Cliente lento: descartar lo pendiente y pedirle que recargue
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(format_sse("resync", {}))
+
+
+def lead_created_event(lead: dict) -> dict:
+    """Datos del evento de lead nuevo."""
+    return {field: lead.get(field) for field in EVENT_FIELDS}
+
+
+def lead_updated_event(lead_id: str, changes: dict) -> dict:
+    """Datos del evento de lead modificado: solo los campos que cambiaron."""
+    return {
+        "id": lead_id,
+        "changes": {field: value for field, value in changes.items() if field in EVENT_FIELDS}
+    }
+
+
+def lead_merged_event(merged_id: str, survivor_id: str) -> dict:
+    """Datos del evento de unión: el lead merged_id pasa a formar parte de survivor_id."""
+    return {"id": merged_id, "merged_into": survivor_id}
+
+
+# Broker compartido por todo el proceso
+lead_events = LeadEventBroker()
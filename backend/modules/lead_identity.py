@@ -0,0 +1,138 @@
+"""
+Índice de identidad de leads entre canales (web, Telegram y voz).
+
+Cada dato de contacto se normaliza a una clave ("phone:+34600123456",
+"email:ana@correo.es", "telegram:ana", "session:abc") y un diccionario
+apunta de cada clave al lead que la registró. Cuando una interacción trae
+claves de varios leads distintos, esos leads son la misma persona y se
+unen: el lead absorbido apunta al superviviente en una estructura
+union-find, así que las claves antiguas siguen resolviendo al lead correcto
+en O(1) amortizado sin reescribir el índice.
+
+Lo mantienen los almacenes en memoria (JournalLeadStore y LeadCache) con
+cada cambio que aplican; SQLiteLeadRepository guarda las mismas claves en
+su tabla lead_keys.
+"""
+import re
+import threading
+from typing import Optional
+
+# Números españoles: 9 cifras que empiezan por 6, 7, 8 o 9
+SPANISH_NUMBER = re.compile(r"[6789]\d{8}")
+
+
+def normalize_phone(phone) -> Optional[str]:
+    """
+    Normaliza un teléfono a formato internacional.
+    "600 123 456", "600123456", "0034 600-123-456" y "+34600123456" -> "+34600123456".
+    """
+    if not phone:
+        return None
+    raw = str(phone).strip()
+    digits = re.sub(r"\D", "", raw)
+    international = raw.startswith("+")
+    if digits.startswith("00"):
+        digits = digits[2:]
+        international = True
+
+    if len(digits) == 11 and digits.startswith("34") and SPANISH_NUMBER.fullmatch(digits[2:]):
+        return "+" + digits
+    if not international and SPANISH_NUMBER.fullmatch(digits):
+        return "+34" + digits
+    if len(digits) < 6:
+        return None
+    return ("+" if international else "") + digits
+
+
+def normalize_email(email) -> Optional[str]:
+    """Normaliza un email (sin espacios y en minúsculas)."""
+    if not email:
+        return None
+    email = str(email).strip().lower()
+    return email if "@" in email else None
+
+
+def identity_keys(session_id: str = None, telegram_username: str = None,
+                  phone: str = None, email: str = None) -> list:
+    """Claves de identidad normalizadas, en orden de prioridad."""
+    keys = []
+    if session_id:
+        keys.append(f"session:{session_id}")
+    if telegram_username:
+        keys.append(f"telegram:{str(telegram_username).lstrip('@').lower()}")
+    phone = normalize_phone(phone)
+    if phone:
+        keys.append(f"phone:{phone}")
+    email = normalize_email(email)
+    if email:
+        keys.append(f"email:{email}")
+    return keys
+
+
+def lead_identity_keys(lead: dict) -> list:
+    """
+    Claves de identidad de un lead: las de sus campos, las que se le vincularon
+    desde otros canales (linked_keys) y las de los leads que absorbió.
+    """
+    keys = identity_keys(
+        session_id=lead.get("session_id"),
+        telegram_username=lead.get("telegram_username"),
+        phone=lead.get("phone"),
+        email=lead.get("email")
+    )
+    keys.extend(lead.get("linked_keys") or [])
+    for merge in lead.get("merge_history") or []:
+        keys.extend(merge.get("keys", []))
+    return keys
+
+
+class IdentityIndex:
+    """Índice clave -> lead con uniones union-find entre leads de la misma persona."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys: dict[str, str] = {}
+        self._parent: dict[str, str] = {}
+
+    def rebuild(self, leads) -> None:
+        """Reconstruye el índice desde los leads almacenados (al cargar el almacén)."""
+        with self._lock:
+            self._keys = {}
+            self._parent = {}
+            for lead in leads:
+                if lead.get("id"):
+                    self.add(lead)
+
+    def root(self, lead_id: str) -> str:
+        """Lead superviviente del grupo al que pertenece lead_id (con compresión de caminos)."""
+        with self._lock:
+            root = lead_id
+            while root in self._parent:
+                root = self._parent[root]
+            while lead_id != root:
+                self._parent[lead_id], lead_id = root, self._parent[lead_id]
+            return root
+
+    def resolve(self, keys: list) -> list:
+        """Leads (supervivientes, sin repetir) a los que apuntan las claves, en orden."""
+        with self._lock:
+            lead_ids = []
+            for key in keys:
+                lead_id = self._keys.get(key)
+                if lead_id is not None:
+                    lead_id = self.root(lead_id)
+                    if lead_id not in lead_ids:
+                        lead_ids.append(lead_id)
+            return lead_ids
+
+    def add(self, lead: dict) -> None:
+        """
+        Registra las claves de un lead; una clave ya registrada conserva su lead.
+        Los leads de su merge_history pasan a apuntar a él (unión).
+        """
+        with self._lock:
+            for merge in lead.get("merge_history") or []:
+                if merge.get("merged_id"):
+                    self._parent[merge["merged_id"]] = lead["id"]
+            for key in lead_identity_keys(lead):
+                self._keys.setdefault(key, lead["id"])
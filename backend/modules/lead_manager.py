@@ -1,73 +1,303 @@
+import asyncio
+import base64
+import csv
+import io
 import json
 import os
 from datetime import datetime
 from typing import Optional
 import uuid
+from contextlib import asynccontextmanager
 
-from config import LEADS_FILE, PROPERTIES_FILE
+from config import (
+    LEADS_FILE, LEADS_JOURNAL_FILE, LEADS_DB_FILE, LEADS_BACKEND, LEADS_COMPACT_EVERY,
+    LEADS_FLUSH_INTERVAL, LEADS_FLUSH_MAX_DIRTY, PROPERTIES_FILE, PROPERTIES_RELOAD_INTERVAL,
+    TRANSCRIPTS_DIR, SEMANTIC_INDEX_DIR, SEMANTIC_EMBEDDING_MODEL
+)
+from modules.lead_store import JournalLeadStore, lead_sort_key
+from modules.lead_repository import SQLiteLeadRepository
+from modules.lead_cache import LeadCache
+from modules.transcript_store import TranscriptStore
+from modules.lead_events import lead_events, lead_created_event, lead_updated_event, lead_merged_event
+from modules.property_catalog import PropertyCatalog, CatalogSnapshot
+from modules.catalog_ingest import iter_changes, new_report
+from modules.property_index import PropertyIndex
+from modules.property_ranking import PropertyRanker
+from modules.semantic_search import SemanticIndex
+from modules.lead_identity import identity_keys, lead_identity_keys
 
+# Campos de cualificación que se actualizan si llegan con valor
+LEAD_FIELDS = (
+    "name", "phone", "email", "budget_min", "budget_max", "zone",
+    "property_type", "bedrooms", "urgency", "interested_property"
+)
 
-def load_properties() -> list:
-    """Carga las propiedades desde el archivo JSON."""
-    try:
-        with open(PROPERTIES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+# Columnas de la exportación de leads
+EXPORT_FIELDS = (
+    "id", "channel", "session_id", "telegram_username", "telegram_chat_id",
+    "name", "phone", "email", "budget_min", "budget_max", "zone", "property_type",
+    "bedrooms", "urgency", "interested_property", "wants_visit", "status", "score",
+    "temperature", "message_count", "transcript_length", "created_at", "updated_at"
+)
+
+# Catálogo de propiedades (se parsea una vez y se recarga si cambia el fichero;
+# cada versión recargada se publica con sus índices ya preparados)
+property_catalog = PropertyCatalog(
+    PROPERTIES_FILE,
+    check_interval=PROPERTIES_RELOAD_INTERVAL,
+    prepare=lambda snapshot, previous: warm_catalog_indexes(snapshot, previous)
+)
+
+# Almacén de leads (se inicializa en el primer uso)
+_lead_store = None
+
+# Transcripciones de conversación, guardadas aparte de los leads
+transcript_store = TranscriptStore(TRANSCRIPTS_DIR)
+
+
+class KeyedLocks:
+    """asyncio.Lock por clave; cada lock se descarta cuando nadie lo espera."""
+
+    def __init__(self):
+        self._locks: dict[str, list] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+
+
+# Un lock por conversación: no se serializa todo el tráfico detrás de uno global
+_lead_locks = KeyedLocks()
+
+
+def get_catalog() -> CatalogSnapshot:
+    """Instantánea inmutable y versionada del catálogo de propiedades."""
+    return property_catalog.snapshot()
+
+
+def reload_catalog() -> CatalogSnapshot:
+    """Fuerza la relectura de properties.json (los índices se preparan antes de publicarla)."""
+    return property_catalog.reload()
+
+
+def warm_catalog_indexes(catalog: Optional[CatalogSnapshot] = None,
+                         previous: Optional[CatalogSnapshot] = None) -> None:
+    """
+    Construye (o abre desde disco) los índices de una versión del catálogo antes
+    de la primera consulta. Con `previous`, el índice de búsqueda parte del suyo.
+    """
+    catalog = catalog or get_catalog()
+    get_property_index(catalog, previous)
+    get_semantic_index(catalog)
+
+
+def get_property_index(catalog: Optional[CatalogSnapshot] = None,
+                       previous: Optional[CatalogSnapshot] = None) -> PropertyIndex:
+    """Índice de búsqueda de una versión del catálogo (por defecto la vigente)."""
+    return (catalog or get_catalog()).derived("search_index", lambda properties: PropertyIndex(
+        properties, previous=get_property_index(previous) if previous is not None else None
+    ))
+
+
+def import_catalog(stream, feed_format: str, replace: bool = False) -> dict:
+    """
+    Importa un feed (JSON, NDJSON o CSV) sobre el catálogo vigente y retorna el informe.
+    El feed se valida mientras se lee; los índices de la versión nueva se construyen
+    antes de publicarla, así las búsquedas en curso siguen con la anterior sin esperar.
+    Con replace=True el feed es el catálogo completo (lo que no aparece se elimina).
+    """
+    report = new_report(feed_format)
+    previous = get_catalog()
+    catalog, counts = property_catalog.apply(
+        iter_changes(stream, feed_format, report, strict=replace),
+        replace=replace,
+        prepare=lambda snapshot: warm_catalog_indexes(snapshot, previous)
+    )
+    report.update(counts)
+    report["version"] = catalog.version
+    report["total"] = len(catalog)
+    return report
+
+
+def load_properties() -> tuple:
+    """Retorna las propiedades del catálogo vigente (solo lectura, sin reparsear el fichero)."""
+    return get_catalog().properties
 
 
 def search_properties(
     zone: Optional[str] = None,
     property_type: Optional[str] = None,
     max_price: Optional[int] = None,
-    min_bedrooms: Optional[int] = None
+    min_bedrooms: Optional[int] = None,
+    objective: Optional[str] = None,
+    min_price: Optional[int] = None
 ) -> list:
-    """Busca propiedades según criterios."""
-    properties = load_properties()
-    results = []
-    
-    for prop in properties:
-        # Filtrar por zona (búsqueda parcial)
-        if zone:
-            zone_lower = zone.lower()
-            prop_zone_lower = prop["zone"].lower()
-            if zone_lower not in prop_zone_lower and prop_zone_lower not in zone_lower:
-                continue
-        
-        # Filtrar por tipo
-        if property_type and property_type.lower() != prop["type"].lower():
-            continue
-        
-        # Filtrar por precio máximo
-        if max_price and prop["price"] > max_price:
-            continue
-        
-        # Filtrar por habitaciones mínimas
-        if min_bedrooms and prop["bedrooms"] < min_bedrooms:
-            continue
-        
-        results.append(prop)
-    
-    return results
+    """Busca propiedades según criterios (índice construido una vez por versión del catálogo)."""
+    index = get_property_index()
+    return index.search(
+        zone=zone,
+        property_type=property_type,
+        max_price=max_price,
+        min_bedrooms=min_bedrooms,
+        objective=objective,
+        min_price=min_price
+    )
+
+
+def closest_properties(
+    zone: Optional[str] = None,
+    property_type: Optional[str] = None,
+    max_price: Optional[int] = None,
+    min_bedrooms: Optional[int] = None,
+    k: int = 3
+) -> list:
+    """
+    Las k propiedades más parecidas a los criterios aunque no los cumplan todos.
+    Retorna [(propiedad, distancia)], de la más a la menos cercana (distancia 0 = cumple todo).
+    """
+    catalog = get_catalog()
+    ranker = catalog.derived("ranker", PropertyRanker)
+    zone_scores = get_property_index(catalog).zone_scores(zone) if zone else None
+    return ranker.closest(
+        k=k,
+        zone_scores=zone_scores,
+        property_type=property_type,
+        max_price=max_price,
+        min_bedrooms=min_bedrooms
+    )
+
+
+def get_semantic_index(catalog: Optional[CatalogSnapshot] = None) -> SemanticIndex:
+    """Índice de texto libre de una versión del catálogo (persistido en SEMANTIC_INDEX_DIR)."""
+    catalog = catalog or get_catalog()
+    return catalog.derived("semantic_index", lambda properties: SemanticIndex.open(
+        properties, SEMANTIC_INDEX_DIR, catalog.content_hash, SEMANTIC_EMBEDDING_MODEL
+    ))
+
+
+def semantic_search(query: str, k: int = 3) -> list:
+    """Propiedades cuya descripción, características o público encajan con el texto: [(propiedad, puntuación)]."""
+    return get_semantic_index().search(query, k=k)
+
+
+# Ordenaciones admitidas en el listado de propiedades ("-" = descendente)
+PROPERTY_SORT_FIELDS = ("price", "bedrooms", "bathrooms", "area")
+
+
+def query_properties(filters: dict, sort: Optional[str] = None,
+                     offset: int = 0, limit: int = 50) -> tuple[list, int]:
+    """
+    Página de propiedades filtradas con search_properties.
+    Sin `sort` se mantiene el orden de la búsqueda (similitud de zona o catálogo).
+    Retorna (propiedades de la página, total de coincidencias).
+    """
+    results = search_properties(**filters)
+    if sort:
+        field = sort.lstrip("-")
+        if field not in PROPERTY_SORT_FIELDS:
+            raise ValueError(f"Ordenación no válida: {sort}")
+        results = sorted(results, key=lambda prop: prop.get(field) or 0, reverse=sort.startswith("-"))
+    return results[offset:offset + limit], len(results)
+
+
+def get_lead_store():
+    """
+    Retorna el almacén de leads configurado (LEADS_BACKEND), abriéndolo la primera vez.
+    Con el backend SQLite, los leads de leads.json se migran automáticamente en el primer arranque.
+    Si LEADS_FLUSH_INTERVAL > 0, el backend queda detrás de una caché en memoria con escritura diferida.
+    """
+    global _lead_store
+    if _lead_store is None:
+        if LEADS_BACKEND == "sqlite":
+            backend = SQLiteLeadRepository(LEADS_DB_FILE)
+            if os.path.exists(LEADS_FILE) or os.path.exists(LEADS_JOURNAL_FILE):
+                legacy_store = JournalLeadStore(LEADS_FILE, LEADS_JOURNAL_FILE, compact_every=0)
+                migrated = backend.migrate_from(legacy_store)
+                legacy_store.close()
+                if migrated:
+                    print(f"[LEADS] Migrados {migrated} leads de leads.json a SQLite")
+        else:
+            backend = JournalLeadStore(LEADS_FILE, LEADS_JOURNAL_FILE, compact_every=LEADS_COMPACT_EVERY)
+
+        if LEADS_FLUSH_INTERVAL > 0:
+            _lead_store = LeadCache(backend, max_dirty=LEADS_FLUSH_MAX_DIRTY)
+        else:
+            _lead_store = backend
+        migrate_embedded_transcripts(_lead_store)
+    return _lead_store
+
+
+def migrate_embedded_transcripts(store) -> None:
+    """Mueve al almacén de transcripciones los historiales guardados dentro de los leads."""
+    legacy_leads = store.having_field("conversation_history")
+    if not legacy_leads:
+        return
+
+    # Migración única: se reescriben todos los leads sin el historial embebido
+    legacy_ids = {lead["id"] for lead in legacy_leads}
+    leads = [lead for lead in store.all() if lead["id"] not in legacy_ids] + legacy_leads
+
+    for lead in legacy_leads:
+        history = lead.pop("conversation_history") or []
+        transcript_store.append(lead["id"], history)
+        lead["transcript_id"] = lead["id"]
+        lead["transcript_length"] = lead.get("transcript_length", 0) + len(history)
+
+    store.replace_all(leads)
+    print(f"[LEADS] Migradas {len(legacy_leads)} transcripciones al almacén de transcripciones")
+
+
+def flush_leads() -> int:
+    """Vuelca a disco los cambios pendientes de la caché de leads."""
+    if isinstance(_lead_store, LeadCache):
+        return _lead_store.flush()
+    return 0
+
+
+async def run_lead_flusher() -> None:
+    """Tarea de fondo: vuelca la caché de leads cada LEADS_FLUSH_INTERVAL segundos."""
+    if LEADS_FLUSH_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(LEADS_FLUSH_INTERVAL)
+        try:
+            # La escritura a disco se hace fuera del event loop
+            await asyncio.to_thread(flush_leads)
+        except Exception as e:
+            print(f"[LEADS] Error volcando leads a disco: {e}")
+
+
+def close_lead_store() -> None:
+    """Vuelca los cambios pendientes y cierra el almacén de leads (al apagar el servidor)."""
+    global _lead_store
+    if _lead_store is not None:
+        _lead_store.close()
+        _lead_store = None
+
+
+def _refreshed_lead_store():
+    """Almacén de leads con los cambios de otros procesos ya aplicados."""
+    store = get_lead_store()
+    store.refresh()
+    return store
 
 
 def load_leads() -> list:
-    """Carga los leads desde el archivo JSON."""
-    try:
-        with open(LEADS_FILE, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if not content:
-                return []
-            return json.loads(content)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+    """Retorna todos los leads del almacén."""
+    return _refreshed_lead_store().all()
 
 
 def save_leads(leads: list) -> None:
-    """Guarda los leads en el archivo JSON."""
-    os.makedirs(os.path.dirname(LEADS_FILE), exist_ok=True)
-    with open(LEADS_FILE, "w", encoding="utf-8") as f:
-        json.dump(leads, f, indent=2, ensure_ascii=False)
+    """Sustituye todos los leads (reescritura completa, usar solo para migraciones)."""
+    get_lead_store().replace_all(leads)
 
 
 def calculate_lead_score(lead_data: dict) -> tuple[int, str]:
@@ -110,25 +340,6 @@ def calculate_lead_score(lead_data: dict) -> tuple[int, str]:
     return min(score, 100), temperature
 
 
-def find_existing_lead(leads: list, session_id: str = None, telegram_username: str = None, 
-                       phone: str = None, email: str = None) -> Optional[dict]:
-    """Busca un lead existente por múltiples criterios."""
-    for lead in leads:
-        # Buscar por session_id
-        if session_id and lead.get("session_id") == session_id:
-            return lead
-        # Buscar por telegram_username
-        if telegram_username and lead.get("telegram_username") == telegram_username:
-            return lead
-        # Buscar por teléfono (para detectar mismo usuario en diferentes canales)
-        if phone and lead.get("phone") == phone:
-            return lead
-        # Buscar por email
-        if email and lead.get("email") == email:
-            return lead
-    return None
-
-
 def create_or_update_lead(
     channel: str,
     session_id: Optional[str] = None,
@@ -141,17 +352,50 @@ def create_or_update_lead(
     Crea un nuevo lead o actualiza uno existente.
     Esta función se puede llamar cada vez que hay una interacción.
     """
-    leads = load_leads()
+    store = get_lead_store()
+    # find + modificación atómicos frente a otros hilos y procesos
+    with store.transaction():
+        lead, events = _upsert_lead(
+            store, channel, session_id, telegram_username, telegram_chat_id,
+            lead_data, conversation_history
+        )
+    for event in events:
+        lead_events.publish(*event)
+    return lead
+
+
+def _upsert_lead(
+    store,
+    channel: str,
+    session_id: Optional[str],
+    telegram_username: Optional[str],
+    telegram_chat_id: Optional[str],
+    lead_data: Optional[dict],
+    conversation_history: Optional[list]
+) -> tuple[dict, list]:
+    """
+    Cuerpo de create_or_update_lead; se ejecuta dentro de una transacción del almacén.
+    Retorna el lead y los eventos a publicar.
+    """
     lead_data = lead_data or {}
+    events = []
     
-    # Buscar lead existente
-    existing_lead = find_existing_lead(
-        leads,
+    # Buscar leads existentes por sus claves de identidad normalizadas
+    keys = identity_keys(
         session_id=session_id,
         telegram_username=telegram_username,
         phone=lead_data.get("phone"),
         email=lead_data.get("email")
     )
+    matches = [store.get(lead_id) for lead_id in store.resolve_identity(keys)]
+    matches = [lead for lead in matches if lead]
+    existing_lead = None
+    if matches:
+        # Si las claves apuntan a varios leads, son la misma persona: se unen en el más antiguo
+        existing_lead = min(matches, key=lambda lead: lead.get("created_at") or "")
+        for other in matches:
+            if other["id"] != existing_lead["id"]:
+                existing_lead = _merge_leads(store, existing_lead, other, events)
     
     # Calcular score con los datos actuales
     combined_data = {}
@@ -164,50 +408,54 @@ def create_or_update_lead(
     combined_data["message_count"] = message_count
     
     score, temperature = calculate_lead_score(combined_data)
+    now = datetime.now().isoformat()
     
     if existing_lead:
-        # Actualizar lead existente
-        # Solo actualizar campos que tienen valor
-        if lead_data.get("name"):
-            existing_lead["name"] = lead_data["name"]
-        if lead_data.get("phone"):
-            existing_lead["phone"] = lead_data["phone"]
-        if lead_data.get("email"):
-            existing_lead["email"] = lead_data["email"]
-        if lead_data.get("budget_min"):
-            existing_lead["budget_min"] = lead_data["budget_min"]
-        if lead_data.get("budget_max"):
-            existing_lead["budget_max"] = lead_data["budget_max"]
-        if lead_data.get("zone"):
-            existing_lead["zone"] = lead_data["zone"]
-        if lead_data.get("property_type"):
-            existing_lead["property_type"] = lead_data["property_type"]
-        if lead_data.get("bedrooms"):
-            existing_lead["bedrooms"] = lead_data["bedrooms"]
-        if lead_data.get("urgency"):
-            existing_lead["urgency"] = lead_data["urgency"]
-        if lead_data.get("interested_property"):
-            existing_lead["interested_property"] = lead_data["interested_property"]
+        # Actualizar lead existente: solo se registran los campos que cambian
+        changes = {field: lead_data[field] for field in LEAD_FIELDS if lead_data.get(field)}
         if lead_data.get("wants_visit") is not None:
-            existing_lead["wants_visit"] = lead_data["wants_visit"]
+            changes["wants_visit"] = lead_data["wants_visit"]
         
         # Actualizar campos calculados
-        existing_lead["score"] = score
-        existing_lead["temperature"] = temperature
-        existing_lead["message_count"] = message_count
-        existing_lead["updated_at"] = datetime.now().isoformat()
+        changes["score"] = score
+        changes["temperature"] = temperature
+        changes["message_count"] = message_count
+        changes["updated_at"] = now
+        channels = existing_lead.get("channels") or [existing_lead.get("channel")]
+        if channel not in channels:
+            changes["channels"] = channels + [channel]
+
+        # Identificadores del canal actual (p. ej. Telegram sobre un lead web encontrado
+        # por teléfono): se guardan en el lead para que el siguiente turno lo encuentre
+        if telegram_username and not existing_lead.get("telegram_username"):
+            changes["telegram_username"] = telegram_username
+        if telegram_chat_id and not existing_lead.get("telegram_chat_id"):
+            changes["telegram_chat_id"] = telegram_chat_id
+        if session_id and not existing_lead.get("session_id"):
+            changes["session_id"] = session_id
+        known = set(lead_identity_keys({**existing_lead, **changes}))
+        unlinked = [key for key in lead_identity_keys(existing_lead) + keys if key not in known]
+        if unlinked:
+            changes["linked_keys"] = list(dict.fromkeys((existing_lead.get("linked_keys") or []) + unlinked))
         
-        # Actualizar historial de conversación
-        if conversation_history:
-            existing_lead["conversation_history"] = conversation_history
+        # Añadir a la transcripción solo los mensajes nuevos del turno
+        lead_id = existing_lead["id"]
+        appended = transcript_store.append_new(lead_id, session_id or lead_id, conversation_history or [])
+        if appended:
+            changes["transcript_id"] = lead_id
+            changes["transcript_length"] = existing_lead.get("transcript_length", 0) + appended
         
-        save_leads(leads)
-        return existing_lead
+        lead = store.set(lead_id, changes)
+        events.append(("lead_updated", lead_updated_event(lead_id, changes)))
+        return lead, events
     else:
         # Crear nuevo lead
+        lead_id = str(uuid.uuid4())
+        appended = transcript_store.append_new(lead_id, session_id or lead_id, conversation_history or [])
         new_lead = {
-            "id": str(uuid.uuid4()),
+            "id": lead_id,
             "channel": channel,
+            "channels": [channel],
             "session_id": session_id,
             "telegram_username": telegram_username,
             "telegram_chat_id": telegram_chat_id,
@@ -226,13 +474,88 @@ def create_or_update_lead(
             "score": score,
             "temperature": temperature,
             "message_count": message_count,
-            "conversation_history": conversation_history or [],
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
+            "transcript_id": lead_id,
+            "transcript_length": appended,
+            "created_at": now,
+            "updated_at": now
         }
-        leads.append(new_lead)
-        save_leads(leads)
-        return new_lead
+        lead = store.set(new_lead["id"], new_lead)
+        events.append(("lead_created", lead_created_event(lead)))
+        return lead, events
+
+
+def _merge_leads(store, survivor: dict, merged: dict, events: list) -> dict:
+    """
+    Une `merged` en `survivor` (misma persona en otro canal): completa los datos que
+    faltan, registra la unión en merge_history y elimina el lead absorbido.
+    Retorna el lead superviviente actualizado.
+    """
+    changes = {
+        field: merged[field]
+        for field in LEAD_FIELDS + ("telegram_username", "telegram_chat_id")
+        if merged.get(field) and not survivor.get(field)
+    }
+    if merged.get("wants_visit") and not survivor.get("wants_visit"):
+        changes["wants_visit"] = merged["wants_visit"]
+
+    channels = survivor.get("channels") or [survivor.get("channel")]
+    for merged_channel in merged.get("channels") or [merged.get("channel")]:
+        if merged_channel not in channels:
+            channels = channels + [merged_channel]
+    changes["channels"] = channels
+
+    # El historial del absorbido se hereda para que el índice se pueda reconstruir
+    changes["merge_history"] = (
+        (survivor.get("merge_history") or []) + (merged.get("merge_history") or []) + [{
+            "merged_id": merged["id"],
+            "channel": merged.get("channel"),
+            "keys": identity_keys(
+                session_id=merged.get("session_id"),
+                telegram_username=merged.get("telegram_username"),
+                phone=merged.get("phone"),
+                email=merged.get("email")
+            ) + (merged.get("linked_keys") or []),
+            "transcript_id": merged.get("transcript_id"),
+            "created_at": merged.get("created_at"),
+            "merged_at": datetime.now().isoformat()
+        }]
+    )
+
+    # El almacén reasigna al superviviente las claves del absorbido (merge_history)
+    store.delete(merged["id"])
+    survivor = store.set(survivor["id"], changes)
+
+    print(f"[LEADS] Lead {merged['id']} ({merged.get('channel')}) unido a {survivor['id']}")
+    events.append(("lead_merged", lead_merged_event(merged["id"], survivor["id"])))
+    events.append(("lead_updated", lead_updated_event(survivor["id"], changes)))
+    return survivor
+
+
+
+async def create_or_update_lead_async(
+    channel: str,
+    session_id: Optional[str] = None,
+    telegram_username: Optional[str] = None,
+    telegram_chat_id: Optional[str] = None,
+    lead_data: Optional[dict] = None,
+    conversation_history: Optional[list] = None
+) -> dict:
+    """
+    Versión asíncrona de create_or_update_lead para los endpoints.
+    Las actualizaciones de una misma conversación se aplican en orden (lock por lead),
+    y la escritura se ejecuta en un hilo para no bloquear el event loop.
+    """
+    key = session_id or telegram_username or (lead_data or {}).get("phone") or ""
+    async with _lead_locks.hold(key):
+        return await asyncio.to_thread(
+            create_or_update_lead,
+            channel=channel,
+            session_id=session_id,
+            telegram_username=telegram_username,
+            telegram_chat_id=telegram_chat_id,
+            lead_data=lead_data,
+            conversation_history=conversation_history
+        )
 
 
 # Mantener compatibilidad con función anterior
@@ -261,22 +584,129 @@ def get_all_leads() -> list:
     return leads
 
 
+def encode_cursor(lead: dict) -> str:
+    """Cursor opaco que apunta justo después de este lead en el listado."""
+    raw = json.dumps(list(lead_sort_key(lead)), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decodifica un cursor de encode_cursor. Lanza ValueError si no es válido."""
+    try:
+        updated_at, lead_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (str(updated_at), str(lead_id))
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
+
+def project_lead(lead: dict, fields: Optional[list] = None) -> dict:
+    """
+    Proyecta un lead a los campos pedidos. Sin `fields` retorna el lead completo
+    sin historial; `conversation_history` solo se incluye si se pide explícitamente.
+    """
+    if not fields:
+        return {k: v for k, v in lead.items() if k != "conversation_history"}
+    projected = {"id": lead["id"]}
+    for field in fields:
+        if field == "conversation_history":
+            projected[field] = get_lead_transcript(lead)
+        elif field in lead:
+            projected[field] = lead[field]
+    return projected
+
+
+def query_leads(
+    filters: dict,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    fields: Optional[list] = None
+) -> tuple[list, Optional[str]]:
+    """
+    Retorna una página de leads (más recientes primero) y el cursor de la siguiente,
+    o None si no hay más.
+    """
+    store = _refreshed_lead_store()
+    position = decode_cursor(cursor) if cursor else None
+    # Pedir uno más para saber si hay siguiente página
+    page = store.query(filters, cursor=position, limit=limit + 1)
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return [project_lead(lead, fields) for lead in page[:limit]], next_cursor
+
+
+def count_leads(filters: dict) -> int:
+    """Número de leads que cumplen los filtros de query_leads (todas las páginas)."""
+    return _refreshed_lead_store().count(filters)
+
+
+def export_leads(export_format: str = "ndjson", since: Optional[str] = None,
+                 include_transcript: bool = False, rows_per_chunk: int = 200):
+    """
+    Generador de la exportación de leads en NDJSON o CSV (más recientes primero).
+    Produce el texto por trozos para poder enviarlo en streaming sin construir
+    el documento completo en memoria.
+    """
+    store = _refreshed_lead_store()
+    columns = EXPORT_FIELDS + (("conversation_history",) if include_transcript else ())
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer:
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    rows = 0
+    for lead in store.iter_recent(since=since):
+        row = {field: lead.get(field) for field in EXPORT_FIELDS}
+        if include_transcript:
+            row["conversation_history"] = get_lead_transcript(lead)
+
+        if writer:
+            if include_transcript:
+                row["conversation_history"] = json.dumps(row["conversation_history"], ensure_ascii=False)
+            writer.writerow(["" if row[c] is None else row[c] for c in columns])
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+        rows += 1
+        if rows % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def get_lead_stats() -> dict:
+    """Agregados actuales de los leads (los mantiene o calcula el propio almacén)."""
+    return _refreshed_lead_store().stats()
+
+
+def get_leads_version() -> str:
+    """
+    Versión actual del conjunto de leads (cambia con cada escritura). Sale de
+    estado compartido, así que es la misma en todos los workers.
+    """
+    return _refreshed_lead_store().version
+
+
 def get_lead_by_id(lead_id: str) -> Optional[dict]:
     """Busca un lead por su ID."""
-    leads = load_leads()
-    for lead in leads:
-        if lead["id"] == lead_id:
-            return lead
-    return None
+    return _refreshed_lead_store().get(lead_id)
+
+
+def get_lead_transcript(lead: dict) -> list:
+    """Retorna el historial de conversación completo de un lead."""
+    return transcript_store.read(lead.get("transcript_id") or lead["id"])
 
 
 def get_leads_by_channel(channel: str) -> list:
     """Retorna leads filtrados por canal."""
-    leads = load_leads()
-    return [lead for lead in leads if lead.get("channel") == channel]
+    return _refreshed_lead_store().by_field("channel", channel)
 
 
 def get_hot_leads() -> list:
     """Retorna leads con temperatura 'caliente'."""
-    leads = load_leads()
-    return [lead for lead in leads if lead.get("temperature") == "caliente"]
+    return _refreshed_lead_store().by_field("temperature", "caliente")
@@ -0,0 +1,357 @@
+"""
+Repositorio de leads sobre SQLite (módulo estándar sqlite3).
+
+Cada lead se guarda como un documento JSON en la columna `data`, y los campos
+por los que se busca (id, session_id, telegram_username, phone, email,
+channel, temperature, updated_at) se duplican en columnas indexadas para que
+las búsquedas no dependan del número de leads.
+
+La identidad entre canales vive en la tabla lead_keys (clave normalizada ->
+lead): al unir dos leads, las claves del absorbido se reasignan al
+superviviente. Los agregados se calculan con consultas sobre las columnas,
+así que nada de esto obliga a cargar los leads en memoria.
+
+Expone la misma interfaz que JournalLeadStore para poder intercambiarlos
+detrás de lead_manager. Las transacciones usan BEGIN IMMEDIATE, que toma el
+lock de escritura de la base de datos, así que varios procesos pueden
+compartir el mismo fichero sin perder escrituras.
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from modules.lead_identity import lead_identity_keys
+from modules.lead_stats import SCORE_BUCKETS, LeadStats
+from modules.lead_store import EQUALITY_FILTERS
+
+# Columnas indexadas que se extraen del documento del lead
+INDEXED_COLUMNS = (
+    "channel", "session_id", "telegram_username", "phone", "email",
+    "temperature", "status", "score", "updated_at"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    id TEXT PRIMARY KEY,
+    channel TEXT,
+    session_id TEXT,
+    telegram_username TEXT,
+    phone TEXT,
+    email TEXT,
+    temperature TEXT,
+    status TEXT,
+    score INTEGER,
+    updated_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leads_session_id ON leads(session_id);
+CREATE INDEX IF NOT EXISTS idx_leads_telegram_username ON leads(telegram_username);
+CREATE INDEX IF NOT EXISTS idx_leads_phone ON leads(phone);
+CREATE INDEX IF NOT EXISTS idx_leads_email ON leads(email);
+CREATE INDEX IF NOT EXISTS idx_leads_channel ON leads(channel);
+CREATE INDEX IF NOT EXISTS idx_leads_temperature ON leads(temperature);
+CREATE INDEX IF NOT EXISTS idx_leads_updated_at ON leads(updated_at);
+CREATE TABLE IF NOT EXISTS lead_keys (
+    key TEXT PRIMARY KEY,
+    lead_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lead_keys_lead_id ON lead_keys(lead_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columnas de los desgloses de get_lead_stats y su atributo en LeadStats
+STATS_GROUPS = (("temperature", "by_temperature"), ("channel", "by_channel"), ("status", "by_status"))
+
+
+class SQLiteLeadRepository:
+    """Leads persistidos en SQLite con búsquedas indexadas."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._tx_depth = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        with self.transaction():
+            # Generación de la base de datos: distingue versiones de un fichero recreado
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', ?)", (uuid.uuid4().hex[:12],)
+            )
+        self._index_identities()
+
+    def _index_identities(self) -> None:
+        """Rellena lead_keys una única vez en bases de datos creadas antes de existir la tabla."""
+        with self.transaction():
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'identity_indexed'").fetchone()
+            if done:
+                return
+            for (data,) in self._conn.execute("SELECT data FROM leads"):
+                self._index_keys(json.loads(data))
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('identity_indexed', '1')")
+
+    @property
+    def version(self) -> str:
+        """
+        Versión de los datos (para ETags de los listados): contador de la tabla
+        meta que incrementa cada transacción con cambios, en cualquier proceso.
+        """
+        values = dict(self._query("SELECT key, value FROM meta WHERE key IN ('generation', 'data_version')"))
+        return f"{values.get('generation', '')}.{values.get('data_version', '0')}"
+
+    # ==================== TRANSACCIONES ====================
+
+    @contextmanager
+    def transaction(self):
+        """Transacción de escritura (BEGIN IMMEDIATE); las anidadas se integran en la exterior."""
+        with self._lock:
+            if self._tx_depth > 0:
+                self._tx_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._tx_depth -= 1
+                return
+
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._tx_depth = 1
+            changes = self._conn.total_changes
+            try:
+                yield self
+                if self._conn.total_changes != changes:
+                    self._conn.execute(
+                        "INSERT INTO meta (key, value) VALUES ('data_version', '1') "
+                        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._tx_depth = 0
+
+    def refresh(self) -> None:
+        """Sin efecto: cada lectura consulta la base de datos."""
+
+    # ==================== LECTURA ====================
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        # La conexión se comparte entre hilos: serializar su uso
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, lead_id: str) -> Optional[dict]:
+        """Retorna un lead por su ID."""
+        rows = self._query("SELECT data FROM leads WHERE id = ?", (lead_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def all(self) -> list:
+        """Retorna todos los leads (sin orden garantizado)."""
+        return [json.loads(row[0]) for row in self._query("SELECT data FROM leads")]
+
+    def resolve_identity(self, keys: list) -> list:
+        """IDs de los leads (supervivientes de uniones, sin repetir) a los que apuntan las claves."""
+        if not keys:
+            return []
+        placeholders = ", ".join("?" for _ in keys)
+        owners = dict(self._query(f"SELECT key, lead_id FROM lead_keys WHERE key IN ({placeholders})", tuple(keys)))
+        lead_ids = []
+        for key in keys:
+            lead_id = owners.get(key)
+            if lead_id is not None and lead_id not in lead_ids:
+                lead_ids.append(lead_id)
+        return lead_ids
+
+    def having_field(self, field: str) -> list:
+        """Leads que tienen el campo dado (aunque sea nulo)."""
+        rows = self._query("SELECT data FROM leads WHERE json_type(data, ?) IS NOT NULL", (f"$.{field}",))
+        return [json.loads(row[0]) for row in rows]
+
+    def stats(self) -> dict:
+        """Agregados de los leads, calculados en SQLite sobre las columnas."""
+        stats = LeadStats()
+        total, score_sum, visits = self._query(
+            "SELECT COUNT(*), COALESCE(SUM(COALESCE(score, 0)), 0), "
+            "COALESCE(SUM(json_type(data, '$.wants_visit') = 'true'), 0) FROM leads"
+        )[0]
+        stats.total, stats.score_sum, stats.visit_requests = total, score_sum, visits
+        for column, attribute in STATS_GROUPS:
+            rows = self._query(
+                f"SELECT COALESCE(NULLIF({column}, ''), 'sin definir'), COUNT(*) FROM leads GROUP BY 1"
+            )
+            getattr(stats, attribute).update(dict(rows))
+        rows = self._query(
+            f"SELECT MIN(COALESCE(score, 0) / {SCORE_BUCKETS}, {SCORE_BUCKETS - 1}), COUNT(*) FROM leads GROUP BY 1"
+        )
+        for bucket, count in rows:
+            stats.score_histogram[int(bucket)] = count
+        return stats.snapshot()
+
+    def by_field(self, field: str, value) -> list:
+        """Retorna los leads cuyo campo indexado coincide con el valor dado."""
+        if field not in INDEXED_COLUMNS:
+            raise ValueError(f"Campo no indexado: {field}")
+        rows = self._query(f"SELECT data FROM leads WHERE {field} = ?", (value,))
+        return [json.loads(row[0]) for row in rows]
+
+    @staticmethod
+    def _filter_conditions(filters: dict) -> tuple:
+        """Condiciones SQL (y sus parámetros) de los filtros de query()."""
+        conditions = []
+        params = []
+        for field in EQUALITY_FILTERS:
+            if filters.get(field) is not None:
+                conditions.append(f"{field} = ?")
+                params.append(filters[field])
+        if filters.get("min_score") is not None:
+            conditions.append("COALESCE(score, 0) >= ?")
+            params.append(filters["min_score"])
+        if filters.get("max_score") is not None:
+            conditions.append("COALESCE(score, 0) <= ?")
+            params.append(filters["max_score"])
+        return conditions, params
+
+    def query(self, filters: dict, cursor: Optional[tuple] = None, limit: int = 50) -> list:
+        """Página de leads filtrados, del más reciente al más antiguo (usa idx_leads_updated_at)."""
+        conditions, params = self._filter_conditions(filters)
+        if cursor is not None:
+            conditions.append("(updated_at, id) < (?, ?)")
+            params.extend(cursor)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._query(
+            f"SELECT data FROM leads {where} ORDER BY updated_at DESC, id DESC LIMIT ?",
+            tuple(params) + (limit,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, filters: dict) -> int:
+        """Número de leads que cumplen los filtros de query()."""
+        conditions, params = self._filter_conditions(filters)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._query(f"SELECT COUNT(*) FROM leads {where}", tuple(params))[0][0]
+
+    def iter_recent(self, since: Optional[str] = None, batch_size: int = 500):
+        """
+        Itera los leads del más reciente al más antiguo, hasta `since` (updated_at).
+        Lee por lotes con paginación por clave para no cargar la tabla entera.
+        """
+        cursor = None
+        while True:
+            conditions = ["updated_at >= ?"] if since else []
+            params = [since] if since else []
+            if cursor is not None:
+                conditions.append("(updated_at, id) < (?, ?)")
+                params.extend(cursor)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            rows = self._query(
+                f"SELECT data FROM leads {where} ORDER BY updated_at DESC, id DESC LIMIT ?",
+                tuple(params) + (batch_size,)
+            )
+            for row in rows:
+                lead = json.loads(row[0])
+                yield lead
+            if len(rows) < batch_size:
+                return
+            cursor = (lead.get("updated_at"), lead["id"])
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM leads")[0][0]
+
+    # ==================== ESCRITURA ====================
+
+    def set(self, lead_id: str, fields: dict) -> dict:
+        """Aplica los campos modificados a un lead (lo crea si no existe)."""
+        with self.transaction():
+            lead = self.get(lead_id) or {"id": lead_id}
+            lead.update(fields)
+            self._upsert(lead)
+        return lead
+
+    def set_many(self, changes: dict) -> None:
+        """Aplica un lote {lead_id: campos} en una única transacción."""
+        if not changes:
+            return
+        with self.transaction():
+            for lead_id, fields in changes.items():
+                lead = self.get(lead_id) or {"id": lead_id}
+                lead.update(fields)
+                self._upsert(lead)
+
+    def delete(self, lead_id: str) -> Optional[dict]:
+        """Elimina un lead."""
+        with self.transaction():
+            lead = self.get(lead_id)
+            self._conn.execute("DELETE FROM leads WHERE id = ?", (lead_id,))
+        return lead
+
+    def replace_all(self, leads: list) -> None:
+        """Sustituye todos los leads en una única transacción."""
+        with self.transaction():
+            self._conn.execute("DELETE FROM leads")
+            self._conn.execute("DELETE FROM lead_keys")
+            for lead in leads:
+                if lead.get("id"):
+                    self._upsert(lead)
+
+    def _upsert(self, lead: dict) -> None:
+        columns = ("id",) + INDEXED_COLUMNS + ("data",)
+        values = [lead["id"]] + [lead.get(column) for column in INDEXED_COLUMNS]
+        values.append(json.dumps(lead, ensure_ascii=False))
+        placeholders = ", ".join("?" for _ in columns)
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO leads ({', '.join(columns)}) VALUES ({placeholders})",
+            values
+        )
+        self._index_keys(lead)
+
+    def _index_keys(self, lead: dict) -> None:
+        """Registra las claves de identidad del lead y le reasigna las de los leads que absorbió."""
+        for merge in lead.get("merge_history") or []:
+            if merge.get("merged_id"):
+                self._conn.execute(
+                    "UPDATE lead_keys SET lead_id = ? WHERE lead_id = ?", (lead["id"], merge["merged_id"])
+                )
+        # Una clave ya registrada conserva su lead
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO lead_keys (key, lead_id) VALUES (?, ?)",
+            [(key, lead["id"]) for key in lead_identity_keys(lead)]
+        )
+
+    # ==================== MIGRACIÓN ====================
+
+    def migrate_from(self, source) -> int:
+        """
+        Importa una única vez los leads de otro almacén (p. ej. leads.json + journal).
+        Retorna el número de leads importados (0 si ya se migró antes).
+        """
+        with self.transaction():
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+            if done:
+                return 0
+
+            leads = source.all()
+            for lead in leads:
+                if lead.get("id"):
+                    self._upsert(lead)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (str(len(leads)),)
+            )
+            return len(leads)
+
+    def close(self) -> None:
+        """Cierra la conexión con la base de datos."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,101 @@
+"""
+Agregados de leads mantenidos de forma incremental.
+
+Los contadores se calculan una vez al cargar los leads y después solo se
+ajustan con la diferencia entre el estado anterior y el nuevo de cada lead
+modificado, así que consultarlos cuesta O(1) sin importar cuántos leads haya.
+"""
+import threading
+from collections import Counter
+from typing import Optional
+
+# Campos de un lead que afectan a los agregados
+STATS_FIELDS = ("channel", "temperature", "status", "score", "wants_visit")
+
+# Cubetas del histograma de score: 0-9, 10-19, ..., 90-100
+SCORE_BUCKETS = 10
+
+
+def stats_view(lead: dict) -> dict:
+    """Extrae de un lead solo los campos que intervienen en los agregados."""
+    return {field: lead.get(field) for field in STATS_FIELDS}
+
+
+class LeadStats:
+    """Contadores por temperatura, canal y estado, histograma de score y visitas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.total = 0
+        self.score_sum = 0
+        self.visit_requests = 0
+        self.by_temperature = Counter()
+        self.by_channel = Counter()
+        self.by_status = Counter()
+        self.score_histogram = [0] * SCORE_BUCKETS
+
+    def rebuild(self, leads: list) -> None:
+        """Recalcula todos los agregados (solo al cargar el almacén)."""
+        with self._lock:
+            self.reset()
+            for lead in leads:
+                self._apply(stats_view(lead), 1)
+
+    def update(self, before: Optional[dict], after: Optional[dict]) -> None:
+        """Ajusta los agregados con el cambio de un lead (None = no existía / se eliminó)."""
+        if before == after:
+            return
+        with self._lock:
+            if before is not None:
+                self._apply(before, -1)
+            if after is not None:
+                self._apply(after, 1)
+
+    def _apply(self, view: dict, sign: int) -> None:
+        score = view.get("score") or 0
+        self.total += sign
+        self.score_sum += sign * score
+        self.score_histogram[min(score // SCORE_BUCKETS, SCORE_BUCKETS - 1)] += sign
+        if view.get("wants_visit"):
+            self.visit_requests += sign
+        self.by_temperature[view.get("temperature") or "sin definir"] += sign
+        self.by_channel[view.get("channel") or "sin definir"] += sign
+        self.by_status[view.get("status") or "sin definir"] += sign
+
+    def count(self, filters: dict) -> Optional[int]:
+        """
+        Leads que cumplen los filtros de query(), si los contadores bastan para
+        saberlo (sin filtros o con un único filtro de igualdad); si no, None.
+        """
+        active = {field: value for field, value in filters.items() if value is not None}
+        if len(active) > 1 or not active.keys() <= {"channel", "temperature", "status"}:
+            return None
+        with self._lock:
+            if not active:
+                return self.total
+            (field, value), = active.items()
+            return getattr(self, f"by_{field}")[value]
+
+    def snapshot(self) -> dict:
+        """Retorna una copia de los agregados actuales."""
+        with self._lock:
+            width = 100 // SCORE_BUCKETS
+            return {
+                "total": self.total,
+                "average_score": round(self.score_sum / self.total, 1) if self.total else 0,
+                "visit_requests": self.visit_requests,
+                "by_temperature": {k: v for k, v in self.by_temperature.items() if v},
+                "by_channel": {k: v for k, v in self.by_channel.items() if v},
+                "by_status": {k: v for k, v in self.by_status.items() if v},
+                "score_histogram": [
+                    {
+                        "min": i * width,
+                        "max": 100 if i == SCORE_BUCKETS - 1 else (i + 1) * width - 1,
+                        "count": count
+                    }
+                    for i, count in enumerate(self.score_histogram)
+                ]
+            }
@@ -0,0 +1,449 @@
+"""
+Almacenamiento de leads basado en un journal append-only.
+
+Cada mutación se añade como una línea JSON al journal, de modo que un turno
+de conversación cuesta O(tamaño del cambio) en disco. Al arrancar se carga el
+snapshot (leads.json) y se reaplica el journal sobre él para reconstruir el
+estado en memoria. Cada cierto número de registros el journal se compacta:
+se reescribe el snapshot de forma atómica y el journal se vacía.
+
+Varios procesos (uvicorn --workers N) pueden compartir los mismos ficheros:
+cada transacción toma un lock de fichero (flock) y, antes de modificar nada,
+aplica los registros que otros procesos añadieron al journal desde la última
+vez. La compactación también ocurre bajo ese lock y publica el snapshot con
+un rename atómico.
+
+Los agregados (LeadStats), el índice de identidad y el orden por recencia
+(RecencyIndex, para paginar por cursor) se actualizan en cada registro
+aplicado, sea propio o de otro proceso, así que no hay que recalcularlos
+cuando otro worker escribe.
+"""
+import json
+import os
+import threading
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+from modules.lead_identity import IdentityIndex
+from modules.lead_stats import LeadStats, stats_view
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo exclusión dentro del proceso
+    fcntl = None
+
+# Filtros de igualdad admitidos por query()
+EQUALITY_FILTERS = ("channel", "temperature", "status")
+
+
+def lead_sort_key(lead: dict) -> tuple:
+    """Clave de orden (y de cursor) de los listados: (updated_at, id)."""
+    return (lead.get("updated_at") or "", lead.get("id") or "")
+
+
+def matches_filters(lead: dict, filters: dict) -> bool:
+    """Comprueba si un lead cumple los filtros de query()."""
+    for field in EQUALITY_FILTERS:
+        if filters.get(field) is not None and lead.get(field) != filters[field]:
+            return False
+    score = lead.get("score") or 0
+    if filters.get("min_score") is not None and score < filters["min_score"]:
+        return False
+    if filters.get("max_score") is not None and score > filters["max_score"]:
+        return False
+    return True
+
+
+def paginate_recent(leads: Iterable[dict], filters: dict, limit: int) -> list:
+    """
+    Recorre leads ya ordenados del más reciente al más antiguo (empezando
+    después del cursor, ver RecencyIndex) y retorna hasta `limit` que
+    cumplan los filtros.
+    """
+    page = []
+    for lead in leads:
+        if not matches_filters(lead, filters):
+            continue
+        page.append(lead)
+        if len(page) >= limit:
+            break
+    return page
+
+
+class RecencyIndex:
+    """
+    Claves (updated_at, id) de los leads en orden, para que una página empiece
+    directamente en el cursor (bisect) en vez de recorrer las anteriores.
+    """
+
+    def __init__(self):
+        self.keys: list = []
+
+    def rebuild(self, leads: Iterable[dict]) -> None:
+        self.keys = sorted(lead_sort_key(lead) for lead in leads)
+
+    def move(self, before: Optional[tuple], after: Optional[tuple]) -> None:
+        """Sustituye la clave de un lead (None = no existía / se eliminó)."""
+        if before == after:
+            return
+        if before is not None:
+            position = bisect_left(self.keys, before)
+            if position < len(self.keys) and self.keys[position] == before:
+                del self.keys[position]
+        if after is not None:
+            insort(self.keys, after)
+
+    def recent(self, cursor: Optional[tuple] = None) -> Iterable[str]:
+        """IDs del más reciente al más antiguo, empezando justo antes del cursor."""
+        end = bisect_left(self.keys, cursor) if cursor is not None else len(self.keys)
+        for position in range(end - 1, -1, -1):
+            yield self.keys[position][1]
+
+
+def count_matching(leads: Iterable[dict], filters: dict, lead_stats) -> int:
+    """Leads que cumplen los filtros: de los contadores si es posible, si no recorriéndolos."""
+    counted = lead_stats.count(filters)
+    if counted is not None:
+        return counted
+    return sum(1 for lead in leads if matches_filters(lead, filters))
+
+
+def iter_until(leads_recent_first: Iterable[dict], since: Optional[str]) -> Iterable[dict]:
+    """Corta una secuencia ordenada por recencia en el primer lead anterior a `since`."""
+    for lead in leads_recent_first:
+        if since and (lead.get("updated_at") or "") < since:
+            return
+        yield lead
+
+
+class JournalLeadStore:
+    """Estado de leads en memoria respaldado por snapshot + journal."""
+
+    def __init__(self, snapshot_path: str, journal_path: str, compact_every: int = 500):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self._leads: dict[str, dict] = {}
+        self._journal_records = 0
+        # Bytes del journal ya aplicados y firma del snapshot cargado (False = sin cargar)
+        self._offset = 0
+        self._snapshot_signature = False
+        self._journal = None
+        self._lock_file = None
+        self._lock = threading.RLock()
+        self._tx_depth = 0
+        # Agregados, índice de identidad y orden por recencia, al día con cada registro aplicado
+        self.lead_stats = LeadStats()
+        self.identity = IdentityIndex()
+        self.recency = RecencyIndex()
+        self.load()
+
+    # ==================== TRANSACCIONES ====================
+
+    @contextmanager
+    def transaction(self):
+        """
+        Sección crítica entre hilos y procesos: al entrar se aplican los cambios
+        que otros procesos hayan escrito, y las escrituras dentro quedan serializadas.
+        """
+        with self._lock:
+            if self._tx_depth == 0:
+                self._acquire_file_lock()
+                try:
+                    self._catch_up()
+                except Exception:
+                    self._release_file_lock()
+                    raise
+            self._tx_depth += 1
+            try:
+                yield self
+            finally:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    self._release_file_lock()
+
+    def refresh(self) -> None:
+        """Aplica los cambios escritos por otros procesos desde la última lectura."""
+        with self.transaction():
+            pass
+
+    def _acquire_file_lock(self) -> None:
+        if fcntl is None:
+            return
+        if self._lock_file is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._lock_file = open(f"{self.journal_path}.lock", "a")
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+
+    def _release_file_lock(self) -> None:
+        if fcntl is not None and self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _catch_up(self) -> None:
+        signature = self._file_signature(self.snapshot_path)
+        journal_size = self._file_size(self.journal_path)
+
+        if signature != self._snapshot_signature or journal_size < self._offset:
+            # Otro proceso compactó: recargar desde el nuevo snapshot
+            self._reload()
+        elif journal_size > self._offset:
+            self._replay_journal()
+
+    @property
+    def version(self) -> str:
+        """
+        Versión de los datos (para ETags de los listados): firma del snapshot y
+        bytes del journal aplicados. Es estado compartido, así que todos los
+        procesos al día con los ficheros dan la misma versión.
+        """
+        with self._lock:
+            inode, mtime_ns, size = self._snapshot_signature or (0, 0, 0)
+            return f"{inode:x}.{mtime_ns:x}.{size:x}.{self._offset:x}"
+
+    @staticmethod
+    def _file_signature(path: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    # ==================== CARGA ====================
+
+    def load(self) -> None:
+        """Reconstruye el estado: snapshot + reaplicación del journal."""
+        with self._lock:
+            self._snapshot_signature = False
+            with self.transaction():
+                pass
+
+    def _reload(self) -> None:
+        self._close_journal()
+        self._leads = {}
+        self._journal_records = 0
+        self._offset = 0
+
+        self._snapshot_signature = self._file_signature(self.snapshot_path)
+        for lead in self._read_snapshot():
+            if lead.get("id"):
+                self._leads[lead["id"]] = lead
+        self._rebuild_indexes()
+        self._replay_journal()
+
+        # Mantener los leads ordenados por updated_at (el más reciente al final)
+        self._leads = dict(sorted(self._leads.items(), key=lambda item: lead_sort_key(item[1])))
+
+    def _rebuild_indexes(self) -> None:
+        """Agregados e índices desde cero (al cargar un snapshot)."""
+        self.lead_stats.rebuild(self._leads.values())
+        self.identity.rebuild(self._leads.values())
+        self.recency.rebuild(self._leads.values())
+
+    def _read_snapshot(self) -> list:
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+                if not content:
+                    return []
+                return json.loads(content)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def _replay_journal(self) -> int:
+        """Aplica los registros del journal a partir del último offset. Retorna cuántos."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            # Última línea a medio escribir (caída durante un append): se descarta
+            print(f"[LEADS] Registro de journal incompleto descartado ({len(data) - end} bytes)")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(self._offset + end)
+
+        applied = 0
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"[LEADS] Registro de journal corrupto ignorado: {line[:80]!r}")
+                continue
+            self._apply(record)
+            applied += 1
+
+        self._offset += end
+        self._journal_records += applied
+        return applied
+
+    def _apply(self, record: dict) -> Optional[dict]:
+        op = record.get("op")
+        lead_id = record.get("id")
+        if not lead_id:
+            return None
+
+        if op == "set":
+            fields = record.get("fields", {})
+            lead = self._leads.pop(lead_id, None) if "updated_at" in fields else self._leads.get(lead_id)
+            before = stats_view(lead) if lead is not None else None
+            before_key = lead_sort_key(lead) if lead is not None else None
+            if lead is None:
+                lead = {"id": lead_id}
+            # Un lead actualizado pasa al final del orden por recencia
+            self._leads[lead_id] = lead
+            lead.update(fields)
+            self.lead_stats.update(before, stats_view(lead))
+            self.identity.add(lead)
+            self.recency.move(before_key, lead_sort_key(lead))
+            return lead
+        if op == "delete":
+            lead = self._leads.pop(lead_id, None)
+            if lead is not None:
+                self.lead_stats.update(stats_view(lead), None)
+                self.recency.move(lead_sort_key(lead), None)
+            return lead
+        return None
+
+    # ==================== LECTURA ====================
+
+    def get(self, lead_id: str) -> Optional[dict]:
+        """Retorna un lead por su ID."""
+        return self._leads.get(lead_id)
+
+    def all(self) -> list:
+        """Retorna todos los leads (sin orden garantizado)."""
+        return list(self._leads.values())
+
+    def resolve_identity(self, keys: list) -> list:
+        """IDs de los leads (supervivientes de uniones, sin repetir) a los que apuntan las claves."""
+        return self.identity.resolve(keys)
+
+    def having_field(self, field: str) -> list:
+        """Leads que tienen el campo dado (aunque sea nulo)."""
+        return [lead for lead in self._leads.values() if field in lead]
+
+    def stats(self) -> dict:
+        """Agregados de los leads (mantenidos incrementalmente)."""
+        return self.lead_stats.snapshot()
+
+    def by_field(self, field: str, value) -> list:
+        """Retorna los leads cuyo campo coincide con el valor dado."""
+        return [lead for lead in self._leads.values() if lead.get(field) == value]
+
+    def query(self, filters: dict, cursor: Optional[tuple] = None, limit: int = 50) -> list:
+        """Página de leads filtrados, del más reciente al más antiguo."""
+        with self._lock:
+            leads = (self._leads[lead_id] for lead_id in self.recency.recent(cursor))
+            return paginate_recent(leads, filters, limit)
+
+    def count(self, filters: dict) -> int:
+        """Número de leads que cumplen los filtros de query()."""
+        with self._lock:
+            return count_matching(self._leads.values(), filters, self.lead_stats)
+
+    def iter_recent(self, since: Optional[str] = None) -> Iterable[dict]:
+        """Itera los leads del más reciente al más antiguo, hasta `since` (updated_at)."""
+        with self._lock:
+            leads = [self._leads[lead_id] for lead_id in self.recency.recent()]
+        return iter_until(leads, since)
+
+    def __len__(self) -> int:
+        return len(self._leads)
+
+    # ==================== ESCRITURA ====================
+
+    def set(self, lead_id: str, fields: dict) -> dict:
+        """Aplica los campos modificados a un lead (lo crea si no existe)."""
+        return self._write({"op": "set", "id": lead_id, "fields": fields})
+
+    def set_many(self, changes: dict) -> None:
+        """Aplica un lote {lead_id: campos} con una sola escritura al journal."""
+        if not changes:
+            return
+        records = [{"op": "set", "id": lead_id, "fields": fields} for lead_id, fields in changes.items()]
+        self._write_batch(records)
+
+    def delete(self, lead_id: str) -> Optional[dict]:
+        """Elimina un lead."""
+        return self._write({"op": "delete", "id": lead_id})
+
+    def replace_all(self, leads: list) -> None:
+        """Sustituye el estado completo y compacta (reescritura completa)."""
+        with self.transaction():
+            ordered = sorted((lead for lead in leads if lead.get("id")), key=lead_sort_key)
+            self._leads = {lead["id"]: lead for lead in ordered}
+            self._rebuild_indexes()
+            self.compact()
+
+    def _write(self, record: dict) -> Optional[dict]:
+        return self._write_batch([record])[0]
+
+    def _write_batch(self, records: list) -> list:
+        with self.transaction():
+            lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            data = lines.encode("utf-8")
+            journal = self._open_journal()
+            journal.write(data)
+            journal.flush()
+            self._offset += len(data)
+            self._journal_records += len(records)
+
+            results = [self._apply(record) for record in records]
+
+            if self.compact_every and self._journal_records >= self.compact_every:
+                self.compact()
+            return results
+
+    # ==================== COMPACTACIÓN ====================
+
+    def compact(self) -> None:
+        """Reescribe el snapshot de forma atómica y vacía el journal."""
+        with self.transaction():
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self._leads.values()), f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._snapshot_signature = self._file_signature(self.snapshot_path)
+
+            # El snapshot ya contiene todo lo registrado: vaciar el journal
+            self._close_journal()
+            with open(self.journal_path, "wb"):
+                pass
+            self._offset = 0
+            self._journal_records = 0
+
+    def close(self) -> None:
+        """Cierra el fichero del journal."""
+        with self._lock:
+            self._close_journal()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _open_journal(self):
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._journal = open(self.journal_path, "ab")
+        return self._journal
+
+    def _close_journal(self) -> None:
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
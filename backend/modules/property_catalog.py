@@ -0,0 +1,262 @@
+"""
+Catálogo de propiedades en memoria, versionado y con recarga en caliente.
+
+properties.json se parsea una sola vez y el resultado se publica como una
+instantánea inmutable (PropertyTable: registros compactos de solo lectura y
+columnas numéricas) con un número de versión. Las peticiones concurrentes
+comparten la misma instantánea sin volver a leer el fichero; solo se recarga
+cuando cambia su mtime y además su contenido (hash), o cuando se pide
+explícitamente.
+
+Ninguna versión nueva se publica sin preparar antes sus índices (prepare):
+
+- las importaciones (apply) construyen la versión nueva a partir de la
+  vigente (solo se congelan las propiedades que cambian) y reescriben
+  properties.json de forma atómica, publicando bajo el mismo lock
+- si el mtime cambia (otro proceso importó o se editó el fichero), la
+  recarga se hace en un hilo aparte
+
+Mientras tanto las lecturas siguen sirviendo la versión anterior.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+from typing import Optional
+
+from modules.property_record import PropertyRecord, PropertyTable
+
+
+def freeze(value):
+    """Copia de solo lectura de un valor JSON (dict -> mappingproxy, list -> tuple)."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Convierte un valor congelado de nuevo en dict/list (p. ej. para serializarlo)."""
+    if isinstance(value, PropertyRecord):
+        return {key: thaw(item) for key, item in value.as_dict().items()}
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class CatalogSnapshot:
+    """Versión inmutable del catálogo."""
+
+    __slots__ = ("version", "content_hash", "loaded_at", "properties", "_by_id", "_derived", "_lock")
+
+    def __init__(self, version: int, content_hash: str, properties: list):
+        self.version = version
+        self.content_hash = content_hash
+        self.loaded_at = datetime.now().isoformat()
+        self.properties = PropertyTable(properties, freeze)
+        self._by_id = MappingProxyType(
+            {prop["id"]: prop for prop in self.properties if prop.get("id")}
+        )
+        # Estructuras calculadas a partir de esta versión (índices, textos renderizados...)
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def get(self, property_id: str):
+        """Retorna una propiedad por su ID."""
+        return self._by_id.get(property_id)
+
+    def derived(self, key: str, factory):
+        """
+        Estructura derivada de esta versión, construida una sola vez con factory(properties).
+        Al recargar el catálogo la instantánea nueva empieza sin derivados.
+        """
+        value = self._derived.get(key)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(key)
+                if value is None:
+                    value = factory(self.properties)
+                    self._derived[key] = value
+        return value
+
+    def as_dicts(self) -> list:
+        """Propiedades como dicts normales (para respuestas JSON)."""
+        return [thaw(prop) for prop in self.properties]
+
+    def __len__(self) -> int:
+        return len(self.properties)
+
+    def __iter__(self):
+        return iter(self.properties)
+
+
+class PropertyCatalog:
+    """Mantiene la instantánea vigente del catálogo y la recarga si el fichero cambia."""
+
+    def __init__(self, path: str, check_interval: float = 2.0, prepare=None):
+        self.path = path
+        self.check_interval = check_interval
+        # prepare(snapshot, previous): se llama antes de publicar una versión recargada
+        self.prepare = prepare
+        self._lock = threading.Lock()
+        # Serializa importaciones y recargas sin bloquear las lecturas del catálogo
+        self._write_lock = threading.Lock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._stat = None
+        self._next_check = 0.0
+        self._reloading = False
+
+    def snapshot(self) -> CatalogSnapshot:
+        """
+        Instantánea vigente. Como mucho cada check_interval segundos se comprueba
+        el mtime del fichero; si cambió, la versión nueva se recarga y prepara en
+        un hilo aparte y mientras tanto se sigue sirviendo la vigente. Solo la
+        primera carga es síncrona.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._next_check:
+            return snapshot
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            if self._snapshot is None:
+                self._stat, self._snapshot = self._read(None)
+            elif not self._reloading and self._file_stat() != self._stat:
+                self._reloading = True
+                threading.Thread(target=self._background_reload, name="catalog-reload", daemon=True).start()
+            return self._snapshot
+
+    def _background_reload(self) -> None:
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"[CATALOG] Error recargando {self.path}: {e}")
+        finally:
+            self._reloading = False
+
+    def reload(self) -> CatalogSnapshot:
+        """
+        Recarga explícita: vuelve a leer el fichero aunque el mtime no haya cambiado.
+        Si el contenido cambió, prepara la versión nueva antes de publicarla.
+        """
+        with self._write_lock:
+            current = self._snapshot or self.snapshot()
+            stat, snapshot = self._read(current)
+            if snapshot is not current and self.prepare is not None:
+                self.prepare(snapshot, current)
+            with self._lock:
+                self._next_check = time.monotonic() + self.check_interval
+                self._stat = stat
+                self._snapshot = snapshot
+            return snapshot
+
+    def apply(self, changes, replace: bool = False, prepare=None) -> tuple:
+        """
+        Aplica operaciones ("upsert", propiedad) / ("delete", id) sobre la versión
+        vigente y publica el resultado como una versión nueva.
+
+        - replace=True: las propiedades que no aparecen en los cambios se eliminan
+        - prepare(snapshot): se llama antes de publicar (p. ej. para construir índices)
+        - si changes lanza una excepción no se publica nada
+
+        Retorna (instantánea, contadores de created/updated/unchanged/deleted).
+        """
+        with self._write_lock:
+            current = self.snapshot()
+            properties = {
+                prop.get("id") or f"#{position}": prop
+                for position, prop in enumerate(current.properties)
+            }
+            counts = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+            seen = set()
+            for action, value in changes:
+                if action == "delete":
+                    if properties.pop(value, None) is not None:
+                        counts["deleted"] += 1
+                    continue
+                prop = PropertyRecord.from_dict(value, freeze)
+                seen.add(prop["id"])
+                previous = properties.get(prop["id"])
+                if previous is None:
+                    counts["created"] += 1
+                elif previous == prop:
+                    counts["unchanged"] += 1
+                    continue
+                else:
+                    counts["updated"] += 1
+                properties[prop["id"]] = prop
+            if replace:
+                for property_id in [key for key in properties if key not in seen]:
+                    del properties[property_id]
+                    counts["deleted"] += 1
+
+            if not (counts["created"] or counts["updated"] or counts["deleted"]):
+                return current, counts
+
+            content = json.dumps(
+                [thaw(prop) for prop in properties.values()], ensure_ascii=False, indent=4
+            ).encode("utf-8")
+            content_hash = hashlib.sha256(content).hexdigest()[:16]
+            snapshot = CatalogSnapshot(current.version + 1, content_hash, list(properties.values()))
+            if prepare is not None:
+                prepare(snapshot)
+
+            # Escritura atómica: un lector nunca ve el fichero a medias. El rename y la
+            # publicación van bajo el mismo lock, para que snapshot() no vea el mtime
+            # nuevo antes que la versión ya preparada y la recargue por su cuenta
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            with self._lock:
+                os.replace(tmp_path, self.path)
+                self._snapshot = snapshot
+                self._stat = self._file_stat()
+            print(f"[CATALOG] Catálogo v{snapshot.version} publicado: {len(snapshot)} propiedades "
+                  f"(+{counts['created']} ~{counts['updated']} -{counts['deleted']})")
+            return snapshot, counts
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read(self, current: Optional[CatalogSnapshot]) -> tuple:
+        """
+        Lee y parsea el fichero sin publicar nada. Retorna (stat, instantánea): una
+        versión nueva si el contenido cambió, o `current` si no (o si no es válido).
+        """
+        stat = self._file_stat()
+        try:
+            with open(self.path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            content = b"[]"
+
+        content_hash = hashlib.sha256(content).hexdigest()[:16]
+        if current is not None and current.content_hash == content_hash:
+            return stat, current
+
+        try:
+            properties = json.loads(content)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            # Un fichero a medio escribir o inválido no tumba el catálogo vigente
+            print(f"[CATALOG] Error leyendo {self.path}: {e}")
+            if current is not None:
+                return stat, current
+            properties = []
+
+        version = current.version + 1 if current else 1
+        snapshot = CatalogSnapshot(version, content_hash, properties)
+        print(f"[CATALOG] Catálogo v{version} cargado: {len(snapshot)} propiedades")
+        return stat, snapshot
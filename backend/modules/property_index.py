@@ -0,0 +1,324 @@
+"""
+Índice de búsqueda de propiedades para catálogos grandes.
+
+Se construye una vez por versión del catálogo y responde a las mismas
+consultas que el filtro lineal original de search_properties:
+
+- zona: zona y título se normalizan al construir el índice (sin tildes, en
+  minúsculas, tokenizados) y sus tokens se indexan por trigramas, de modo
+  que "malaga", "Costa Sol" o "marbela" encuentran sus zonas; los
+  resultados se ordenan por similitud
+- tipo y objetivo (venta/alquiler): diccionario valor -> array de posiciones
+- rango de precio: posiciones ordenadas por precio, el rango con searchsorted
+- habitaciones mínimas: posiciones ordenadas por habitaciones
+
+Cada criterio estima primero cuántos candidatos aporta; el más selectivo
+genera los candidatos y el resto se comprueba en bloque sobre las columnas
+numéricas del catálogo (PropertyColumns), así el coste depende del tamaño
+del resultado y no del catálogo.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+# Conjunto vacío de posiciones (valor de tipo u objetivo inexistente)
+NO_POSITIONS = np.empty(0, dtype=np.intp)
+
+# Máximo de expansiones de tokens de zona memorizadas
+TOKEN_CACHE_SIZE = 1024
+
+# Palabras que no identifican una zona
+STOPWORDS = {"de", "del", "la", "las", "el", "los", "y", "en", "a", "al"}
+
+# Similitud mínima entre dos tokens para considerarlos el mismo (trigramas, coeficiente de Dice)
+TOKEN_MIN_SIMILARITY = 0.5
+# Fracción mínima (ponderada por rareza) de la consulta que debe encontrarse en la zona
+ZONE_MIN_SCORE = 0.5
+# Peso de una coincidencia en el título frente a una en la zona
+TITLE_WEIGHT = 0.8
+
+
+# Marcas diacríticas que quedan separadas tras la descomposición NFKD
+COMBINING_MARKS = re.compile(r"[\u0300-\u036f]")
+WORD = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """Texto sin tildes, en minúsculas y con la puntuación convertida en espacios."""
+    text = (text or "").lower()
+    if not text.isascii():
+        text = COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", text))
+    return " ".join(WORD.findall(text))
+
+
+def tokenize(text: str, normalized: bool = False) -> list:
+    """Tokens normalizados de un texto, sin palabras vacías."""
+    text = text if normalized else normalize_text(text)
+    return [token for token in text.split() if token not in STOPWORDS]
+
+
+def trigrams(token: str) -> set:
+    """Trigramas de caracteres de un token (con bordes, para que cuenten inicio y final)."""
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def place_tokens(place: str) -> list:
+    """Tokens de un lugar ya normalizado."""
+    return tokenize(place, normalized=True)
+
+
+def inverted_update(index: dict, removed, added, expand) -> dict:
+    """
+    Copia de un índice invertido término -> claves quitando las claves `removed`
+    y añadiendo las `added` (expand(clave) da sus términos).
+    """
+    index = {term: set(keys) for term, keys in index.items()}
+    for key in removed:
+        for term in expand(key):
+            keys = index.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[term]
+    for key in added:
+        for term in expand(key):
+            index.setdefault(term, set()).add(key)
+    return index
+
+
+class PropertyIndex:
+    """Índices de zona, tipo, precio y habitaciones sobre una versión del catálogo."""
+
+    def __init__(self, properties, previous: Optional["PropertyIndex"] = None):
+        self.properties = properties
+        # Textos ya normalizados (zonas y títulos se repiten); al importar cambios
+        # se reutilizan los de la versión anterior y solo se normaliza lo nuevo
+        known = previous.normalized if previous is not None else {}
+        self.normalized: dict[str, str] = {}
+        self.zones = [self._normalize(prop.zone, known) for prop in properties]
+        self.titles = [self._normalize(prop.title, known) for prop in properties]
+        # Columnas numéricas compartidas con el catálogo; tipo y objetivo como códigos enteros
+        self.prices = properties.columns.price
+        self.bedrooms = properties.columns.bedrooms
+        self.type_codes, self.type_ids, self.by_type = self._encode(prop.type for prop in properties)
+        self.objective_codes, self.objective_ids, self.by_objective = self._encode(
+            prop.objective for prop in properties
+        )
+
+        # Las zonas se repiten mucho: los índices de texto apuntan a lugares distintos
+        # (zonas y títulos normalizados), no a cada propiedad
+        self.positions_by_zone: dict[str, list] = {}
+        self.positions_by_title: dict[str, list] = {}
+        for position, zone in enumerate(self.zones):
+            if zone:
+                self.positions_by_zone.setdefault(zone, []).append(position)
+            if self.titles[position]:
+                self.positions_by_title.setdefault(self.titles[position], []).append(position)
+        places = set(self.positions_by_zone) | set(self.positions_by_title)
+        if previous is None:
+            self.place_tokens = inverted_update({}, (), places, place_tokens)
+            self.token_trigrams = inverted_update({}, (), self.place_tokens, trigrams)
+        else:
+            # Los índices de texto de la versión anterior se actualizan solo con los
+            # lugares y tokens que aparecen o desaparecen
+            previous_places = set(previous.positions_by_zone) | set(previous.positions_by_title)
+            self.place_tokens = inverted_update(
+                previous.place_tokens, previous_places - places, places - previous_places, place_tokens
+            )
+            self.token_trigrams = inverted_update(
+                previous.token_trigrams,
+                previous.place_tokens.keys() - self.place_tokens.keys(),
+                self.place_tokens.keys() - previous.place_tokens.keys(),
+                trigrams
+            )
+        # Rareza de cada token: los poco frecuentes ("alicante") pesan más que los comunes ("centro")
+        place_count = len(self.positions_by_zone) + len(self.positions_by_title) or 1
+        self.token_weight = {
+            token: math.log(1 + place_count / len(places))
+            for token, places in self.place_tokens.items()
+        }
+        self.max_token_weight = max(self.token_weight.values(), default=1.0)
+
+        # Posiciones ordenadas por precio y por habitaciones (estable: empates en orden de catálogo)
+        self.price_order = np.argsort(self.prices, kind="stable")
+        self.sorted_prices = self.prices[self.price_order]
+        self.bedroom_order = np.argsort(self.bedrooms, kind="stable")
+        self.sorted_bedrooms = self.bedrooms[self.bedroom_order]
+
+        self._token_cache: dict[str, set] = {}
+
+    @staticmethod
+    def _encode(values) -> tuple:
+        """Códigos enteros de un campo de texto (en minúsculas), valor -> código y valor -> posiciones."""
+        ids = {}
+        codes = np.array(
+            [ids.setdefault((value or "").lower(), len(ids)) for value in values], dtype=np.int32
+        )
+        positions = {value: np.flatnonzero(codes == code) for value, code in ids.items()}
+        return codes, ids, positions
+
+    def _normalize(self, text: Optional[str], known: dict) -> str:
+        value = self.normalized.get(text)
+        if value is None:
+            value = known.get(text)
+            if value is None:
+                value = normalize_text(text)
+            self.normalized[text] = value
+        return value
+
+    # ==================== CANDIDATOS POR CRITERIO ====================
+
+    def _similar_tokens(self, token: str) -> dict:
+        """Tokens indexados parecidos a `token` con su similitud (0-1)."""
+        similar = self._token_cache.get(token)
+        if similar is None:
+            query_trigrams = trigrams(token)
+            shared = Counter()
+            for trigram in query_trigrams:
+                shared.update(self.token_trigrams.get(trigram, ()))
+            similar = {}
+            for indexed_token, count in shared.items():
+                if indexed_token == token:
+                    similarity = 1.0
+                elif len(token) >= 3 and (token in indexed_token or indexed_token in token):
+                    # Coincidencia parcial ("mala" en "malaga")
+                    similarity = 0.9
+                else:
+                    similarity = 2 * count / (len(query_trigrams) + len(trigrams(indexed_token)))
+                if similarity >= TOKEN_MIN_SIMILARITY:
+                    similar[indexed_token] = similarity
+            if len(self._token_cache) >= TOKEN_CACHE_SIZE:
+                self._token_cache.clear()
+            self._token_cache[token] = similar
+        return similar
+
+    def _place_scores(self, zone: str) -> dict:
+        """
+        Lugares (zonas o títulos normalizados) que encajan con la consulta y su puntuación.
+        Una coincidencia literal en cualquier sentido vale 1; si no, la fracción de la
+        consulta encontrada en el lugar, ponderando cada token por su rareza.
+        """
+        query = normalize_text(zone)
+        tokens = tokenize(query, normalized=True)
+        if not tokens:
+            return {}
+
+        weights = []
+        best: dict[str, list] = {}
+        for i, token in enumerate(tokens):
+            similar = self._similar_tokens(token)
+            weights.append(max((self.token_weight[t] for t in similar), default=self.max_token_weight))
+            for indexed_token, similarity in similar.items():
+                for place in self.place_tokens[indexed_token]:
+                    scores = best.setdefault(place, [0.0] * len(tokens))
+                    scores[i] = max(scores[i], similarity)
+
+        total_weight = sum(weights)
+        place_scores = {}
+        for place, scores in best.items():
+            if query in place or place in query:
+                score = 1.0
+            else:
+                score = sum(w * s for w, s in zip(weights, scores)) / total_weight
+            if score >= ZONE_MIN_SCORE:
+                place_scores[place] = score
+        return place_scores
+
+    def zone_scores(self, zone: str) -> dict:
+        """Posición -> similitud de las propiedades cuya zona o título encaja con la consulta."""
+        position_scores = {}
+        for place, score in self._place_scores(zone).items():
+            for positions, weight in ((self.positions_by_zone, 1.0), (self.positions_by_title, TITLE_WEIGHT)):
+                for position in positions.get(place, ()):
+                    if score * weight > position_scores.get(position, 0):
+                        position_scores[position] = score * weight
+        return position_scores
+
+    def _price_range(self, min_price: Optional[int], max_price: Optional[int]) -> tuple:
+        """Índices [low, high) de sorted_prices dentro del rango de precio."""
+        low = int(np.searchsorted(self.sorted_prices, min_price, "left")) if min_price else 0
+        high = int(np.searchsorted(self.sorted_prices, max_price, "right")) if max_price else len(self.sorted_prices)
+        return low, max(low, high)
+
+    def _bedrooms_start(self, min_bedrooms: int) -> int:
+        return int(np.searchsorted(self.sorted_bedrooms, min_bedrooms, "left"))
+
+    # ==================== BÚSQUEDA ====================
+
+    def search(
+        self,
+        zone: Optional[str] = None,
+        property_type: Optional[str] = None,
+        max_price: Optional[int] = None,
+        min_bedrooms: Optional[int] = None,
+        objective: Optional[str] = None,
+        min_price: Optional[int] = None
+    ) -> list:
+        """
+        Propiedades que cumplen todos los criterios: con zona, de la más a la menos
+        parecida; sin zona, en el orden del catálogo.
+        """
+        # Estimación del número de candidatos de cada criterio
+        estimates = []
+        if property_type:
+            type_positions = self.by_type.get(property_type.lower(), NO_POSITIONS)
+            estimates.append((len(type_positions), "type"))
+        if objective:
+            objective_positions = self.by_objective.get(objective.lower(), NO_POSITIONS)
+            estimates.append((len(objective_positions), "objective"))
+        if max_price or min_price:
+            low, high = self._price_range(min_price, max_price)
+            estimates.append((high - low, "price"))
+        if min_bedrooms:
+            start = self._bedrooms_start(min_bedrooms)
+            estimates.append((len(self.sorted_bedrooms) - start, "bedrooms"))
+        if zone:
+            zone_scores = self.zone_scores(zone)
+            zone_positions = np.fromiter(zone_scores, dtype=np.intp, count=len(zone_scores))
+            estimates.append((len(zone_scores), "zone"))
+
+        if not estimates:
+            return list(self.properties)
+
+        # El criterio más selectivo genera los candidatos
+        _, driver = min(estimates)
+        if driver == "type":
+            candidates = type_positions
+        elif driver == "objective":
+            candidates = objective_positions
+        elif driver == "price":
+            candidates = self.price_order[low:high]
+        elif driver == "bedrooms":
+            candidates = self.bedroom_order[start:]
+        else:
+            candidates = zone_positions
+
+        # Los demás criterios se comprueban en bloque sobre las columnas
+        keep = np.ones(len(candidates), dtype=bool)
+        if property_type and driver != "type":
+            keep &= self.type_codes[candidates] == self.type_ids.get(property_type.lower(), -1)
+        if objective and driver != "objective":
+            keep &= self.objective_codes[candidates] == self.objective_ids.get(objective.lower(), -1)
+        if driver != "price":
+            if max_price:
+                keep &= self.prices[candidates] <= max_price
+            if min_price:
+                keep &= self.prices[candidates] >= min_price
+        if min_bedrooms and driver != "bedrooms":
+            keep &= self.bedrooms[candidates] >= min_bedrooms
+        if zone and driver != "zone":
+            keep &= np.isin(candidates, zone_positions, assume_unique=True)
+        results = candidates[keep]
+
+        if zone:
+            scores = np.fromiter((zone_scores[position] for position in results.tolist()),
+                                 dtype=np.float64, count=len(results))
+            results = results[np.lexsort((results, -scores))]
+        else:
+            results = np.sort(results)
+        return [self.properties[position] for position in results.tolist()]
@@ -0,0 +1,100 @@
+"""
+Propiedades más cercanas a unos criterios (búsqueda por puntuación).
+
+A diferencia de search_properties, que descarta todo lo que no cumple los
+filtros, aquí cada propiedad recibe una distancia ponderada a lo pedido y
+se devuelven las k más cercanas. Los atributos numéricos del catálogo se
+guardan en arrays de NumPy, así que la distancia se calcula en una sola
+pasada vectorizada y las k mejores se obtienen con argpartition, sin
+ordenar el catálogo entero.
+"""
+from typing import Optional
+
+import numpy as np
+
+# Peso de cada criterio en la distancia
+PRICE_WEIGHT = 3.0  # por cada 100% por encima del presupuesto
+BEDROOMS_WEIGHT = 1.0  # por cada habitación que falta
+BATHROOMS_WEIGHT = 0.5  # por cada baño que falta
+AREA_WEIGHT = 1.0  # por cada 100% de superficie que falta
+ZONE_WEIGHT = 2.0  # zona distinta (se reduce según la similitud de la zona)
+TYPE_WEIGHT = 1.0  # tipo distinto
+OBJECTIVE_WEIGHT = 2.0  # venta en lugar de alquiler o al revés
+
+# Precios por debajo de esto son alquileres mensuales
+MONTHLY_LIMIT = 10000
+
+
+class PropertyRanker:
+    """Columnas numéricas de una versión del catálogo para calcular distancias."""
+
+    def __init__(self, properties):
+        self.properties = properties
+        columns = properties.columns
+        self.price = columns.price.astype(np.float64)
+        self.bedrooms = columns.bedrooms.astype(np.float64)
+        self.bathrooms = columns.bathrooms.astype(np.float64)
+        self.area = columns.area.astype(np.float64)
+
+        # Tipo y objetivo como códigos enteros para compararlos en bloque
+        self.type_codes, self.types = self._encode(prop.type for prop in properties)
+        self.objective_codes, self.objectives = self._encode(prop.objective for prop in properties)
+
+    @staticmethod
+    def _encode(values) -> tuple:
+        codes = {}
+        encoded = np.array(
+            [codes.setdefault((value or "").lower(), len(codes)) for value in values],
+            dtype=np.int32
+        )
+        return encoded, codes
+
+    def distances(
+        self,
+        zone_scores: Optional[dict] = None,
+        property_type: Optional[str] = None,
+        max_price: Optional[int] = None,
+        min_bedrooms: Optional[int] = None,
+        min_bathrooms: Optional[int] = None,
+        min_area: Optional[int] = None,
+        objective: Optional[str] = None
+    ) -> np.ndarray:
+        """Distancia ponderada de cada propiedad a los criterios (0 = cumple todo)."""
+        distance = np.zeros(len(self.properties), dtype=np.float64)
+        if max_price:
+            distance += PRICE_WEIGHT * np.maximum(self.price - max_price, 0) / max_price
+            # Un presupuesto mensual no es comparable con un precio de venta (ni al revés)
+            distance += OBJECTIVE_WEIGHT * ((self.price < MONTHLY_LIMIT) != (max_price < MONTHLY_LIMIT))
+        if min_bedrooms:
+            distance += BEDROOMS_WEIGHT * np.maximum(min_bedrooms - self.bedrooms, 0)
+        if min_bathrooms:
+            distance += BATHROOMS_WEIGHT * np.maximum(min_bathrooms - self.bathrooms, 0)
+        if min_area:
+            distance += AREA_WEIGHT * np.maximum(min_area - self.area, 0) / min_area
+        if property_type:
+            code = self.types.get(property_type.lower(), -1)
+            distance += TYPE_WEIGHT * (self.type_codes != code)
+        if objective:
+            code = self.objectives.get(objective.lower(), -1)
+            distance += OBJECTIVE_WEIGHT * (self.objective_codes != code)
+        if zone_scores is not None:
+            similarity = np.zeros(len(self.properties), dtype=np.float64)
+            if zone_scores:
+                positions = np.fromiter(zone_scores.keys(), dtype=np.int64, count=len(zone_scores))
+                similarity[positions] = np.fromiter(zone_scores.values(), dtype=np.float64, count=len(zone_scores))
+            distance += ZONE_WEIGHT * (1 - similarity)
+        return distance
+
+    def closest(self, k: int = 3, **criteria) -> list:
+        """Las k propiedades más cercanas a los criterios, con su distancia, de menor a mayor."""
+        if not self.properties or k <= 0:
+            return []
+        distance = self.distances(**criteria)
+        k = min(k, len(distance))
+        if k < len(distance):
+            candidates = np.argpartition(distance, k - 1)[:k]
+        else:
+            candidates = np.arange(len(distance))
+        # Empates: primero la que aparece antes en el catálogo
+        order = candidates[np.lexsort((candidates, distance[candidates]))]
+        return [(self.properties[i], float(distance[i])) for i in order]
@@ -0,0 +1,175 @@
+"""
+Representación compacta de las propiedades del catálogo.
+
+Cada propiedad es un PropertyRecord (dataclass con __slots__) en lugar de un
+dict: sin diccionario por instancia ni claves repetidas. Los textos que se
+repiten entre propiedades (zona, tipo, objetivo, características, público)
+se internan, así que cada valor distinto existe una sola vez en memoria.
+
+Los campos numéricos (precio, habitaciones, baños, superficie) además se
+guardan por columnas en arrays de NumPy dentro de PropertyTable, para que
+los índices y el ranking los lean en bloque sin recorrer las propiedades.
+
+PropertyRecord se comporta como un mapping de solo lectura (prop["price"],
+prop.get("zone")), así que el código que trabajaba con dicts sigue
+funcionando sin convertir nada.
+"""
+import sys
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional
+
+import numpy as np
+
+# Clave JSON -> atributo, en el orden de properties.json
+FIELD_ATTRIBUTES = {
+    "id": "id",
+    "title": "title",
+    "type": "type",
+    "zone": "zone",
+    "objective": "objective",
+    "price": "price",
+    "priceType": "price_type",
+    "bedrooms": "bedrooms",
+    "bathrooms": "bathrooms",
+    "area": "area",
+    "description": "description",
+    "features": "features",
+    "target": "target"
+}
+NUMERIC_FIELDS = ("price", "bedrooms", "bathrooms", "area")
+# Textos con pocos valores distintos: se internan
+INTERNED_FIELDS = ("type", "zone", "objective", "priceType", "target")
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class PropertyRecord(Mapping):
+    """Propiedad del catálogo, inmutable. Un campo ausente en el origen vale None."""
+
+    id: Optional[str] = None
+    title: Optional[str] = None
+    type: Optional[str] = None
+    zone: Optional[str] = None
+    objective: Optional[str] = None
+    price: Optional[int] = None
+    price_type: Optional[str] = None
+    bedrooms: Optional[int] = None
+    bathrooms: Optional[int] = None
+    area: Optional[int] = None
+    description: Optional[str] = None
+    features: Optional[tuple] = None
+    target: Optional[str] = None
+    # Campos del origen que no forman parte del esquema (solo lectura)
+    extra: Optional[Mapping] = None
+
+    @classmethod
+    def from_dict(cls, data: dict, freeze=None) -> "PropertyRecord":
+        """
+        Crea el registro a partir de un dict de properties.json o de un feed.
+        `freeze` convierte en solo lectura los valores de campos desconocidos.
+        """
+        if isinstance(data, PropertyRecord):
+            return data
+        values = {}
+        extra = {}
+        for key, value in data.items():
+            attribute = FIELD_ATTRIBUTES.get(key)
+            if attribute is None:
+                extra[key] = freeze(value) if freeze else value
+            elif key == "features":
+                values[attribute] = tuple(_intern(feature) for feature in value) if value is not None else None
+            elif key in INTERNED_FIELDS:
+                values[attribute] = _intern(value)
+            else:
+                values[attribute] = value
+        if extra:
+            values["extra"] = MappingProxyType(extra)
+        return cls(**values)
+
+    def as_dict(self) -> dict:
+        """Dict con los campos presentes (para respuestas JSON y para guardar el catálogo)."""
+        data = {}
+        for key, attribute in FIELD_ATTRIBUTES.items():
+            value = getattr(self, attribute)
+            if value is not None:
+                data[key] = list(value) if key == "features" else value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    # ==================== INTERFAZ DE MAPPING ====================
+
+    def __getitem__(self, key: str):
+        attribute = FIELD_ATTRIBUTES.get(key)
+        if attribute is not None:
+            value = getattr(self, attribute)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        attribute = FIELD_ATTRIBUTES.get(key)
+        if attribute is not None:
+            value = getattr(self, attribute)
+            return default if value is None else value
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __iter__(self):
+        for key, attribute in FIELD_ATTRIBUTES.items():
+            if getattr(self, attribute) is not None:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"PropertyRecord(id={self.id!r}, title={self.title!r})"
+
+
+class PropertyColumns:
+    """Campos numéricos de un conjunto de propiedades como arrays de solo lectura (ausente = 0)."""
+
+    __slots__ = ("price", "bedrooms", "bathrooms", "area")
+
+    def __init__(self, records):
+        count = len(records)
+        self.price = self._column(records, "price", np.int64, count)
+        self.bedrooms = self._column(records, "bedrooms", np.int16, count)
+        self.bathrooms = self._column(records, "bathrooms", np.int16, count)
+        self.area = self._column(records, "area", np.int32, count)
+
+    @staticmethod
+    def _column(records, attribute: str, dtype, count: int) -> np.ndarray:
+        column = np.fromiter((getattr(record, attribute) or 0 for record in records), dtype=dtype, count=count)
+        column.setflags(write=False)
+        return column
+
+
+class PropertyTable(Sequence):
+    """Propiedades de una versión del catálogo: registros en orden más columnas numéricas."""
+
+    __slots__ = ("records", "columns")
+
+    def __init__(self, properties, freeze=None):
+        self.records = tuple(PropertyRecord.from_dict(prop, freeze) for prop in properties)
+        self.columns = PropertyColumns(self.records)
+
+    def __getitem__(self, position):
+        return self.records[position]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
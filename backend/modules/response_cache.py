@@ -0,0 +1,111 @@
+"""
+Caché de respuestas para los mensajes de apertura de una conversación.
+
+Buena parte de las conversaciones empiezan igual ("hola", "quiero ver
+propiedades", "dame los precios"). Mientras no hay historial la respuesta
+solo depende del texto, del canal y del catálogo, así que se guarda:
+
+- clave: texto normalizado (sin tildes, mayúsculas ni puntuación), canal y
+  versión del catálogo
+- valor: la respuesta final más los mensajes que el turno añadió al
+  historial (llamadas a herramientas y sus resultados), para que la
+  conversación continúe igual que si hubiera respondido el modelo
+
+Es una LRU acotada con caducidad; al publicarse otra versión del catálogo
+se vacía entera. No se guardan turnos que capturaron datos del cliente.
+"""
+import copy
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from modules.property_index import normalize_text
+
+# Mensajes más largos que esto (normalizados) no se cachean: raramente se repiten
+CACHEABLE_MAX_CHARS = 80
+
+
+class ResponseCache:
+    """LRU con TTL de respuestas a mensajes de apertura, con métricas de acierto."""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._catalog_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def key(self, message: str, channel: str, catalog_version: int) -> Optional[tuple]:
+        """Clave de un mensaje, o None si no merece cachearse."""
+        if not self.enabled:
+            return None
+        text = normalize_text(message)
+        if not text or len(text) > CACHEABLE_MAX_CHARS:
+            return None
+        return text, channel, catalog_version
+
+    def _check_version(self, catalog_version: int) -> bool:
+        """
+        Vacía la caché si el catálogo cambió (las respuestas citan propiedades y
+        precios). False si la clave es de una versión anterior a la vigente.
+        """
+        if self._catalog_version is not None and catalog_version < self._catalog_version:
+            return False
+        if catalog_version != self._catalog_version:
+            if self._entries:
+                self.invalidations += 1
+                print(f"[CACHE] Catálogo v{catalog_version}: se descartan {len(self._entries)} respuestas")
+                self._entries.clear()
+            self._catalog_version = catalog_version
+        return True
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """(respuesta, mensajes añadidos al historial) si hay una entrada vigente."""
+        entry = self._entries.get(key) if self._check_version(key[2]) else None
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Copias: el historial de cada sesión se modifica después
+        return entry[1], copy.deepcopy(entry[2])
+
+    def put(self, key: tuple, response: str, messages: list) -> None:
+        """Guarda la respuesta de un turno de apertura y los mensajes que añadió."""
+        if not self._check_version(key[2]):
+            # El catálogo cambió mientras se generaba la respuesta
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, response, copy.deepcopy(messages))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """Métricas de la caché."""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "catalog_version": self._catalog_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
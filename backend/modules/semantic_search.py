@@ -0,0 +1,305 @@
+"""
+Búsqueda por texto libre sobre descripción, características y público objetivo.
+
+Responde a peticiones como "algo tranquilo con chimenea" o "cerca del golf",
+que search_properties no puede expresar. El índice es BM25 sobre tokens
+normalizados (sin tildes, con un stemming ligero para español) y se guarda
+en formato columnar (postings CSR en arrays de NumPy):
+
+- se construye una vez por versión del catálogo (hash del contenido)
+- se persiste en disco como ficheros .npy y al arrancar se abre con
+  memory-map, sin reconstruirlo ni cargarlo entero en memoria
+- cada proceso lo escribe en un directorio temporal propio y lo publica con
+  un renombrado atómico bajo un lock de fichero; bajo ese mismo lock se
+  borran los índices antiguos (se conservan los KEEP_INDEXES más recientes)
+  y los temporales abandonados, así varios workers comparten el directorio
+  sin pisarse y no se acumula un índice por cada versión del catálogo
+- opcionalmente suma similitud de embeddings locales si está instalado
+  sentence-transformers y se configura SEMANTIC_EMBEDDING_MODEL
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+from modules.property_index import normalize_text
+
+try:
+    from sentence_transformers import SentenceTransformer  # Opcional: embeddings locales
+except ImportError:
+    SentenceTransformer = None
+
+try:
+    import fcntl  # POSIX: lock entre procesos al publicar el índice
+except ImportError:
+    fcntl = None
+
+# Parámetros de BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Peso de la similitud de embeddings frente a BM25 normalizado (si hay embeddings)
+EMBEDDING_WEIGHT = 0.5
+
+STOPWORDS = {
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los", "muy",
+    "o", "para", "por", "que", "se", "sin", "su", "sus", "un", "una", "unos", "unas",
+    "y", "algo", "busco", "quiero", "me", "mi", "como", "mas", "donde", "tiene", "este", "esta"
+}
+
+# Terminaciones que se recortan para agrupar variantes ("tranquilo", "tranquila", "tranquilidad")
+SUFFIXES = ("amente", "mente", "idades", "idad", "ciones", "cion", "os", "as", "es", "o", "a", "s")
+
+
+# Índices que se conservan en disco (el vigente y los anteriores más recientes,
+# por si algún worker aún no ha recargado el catálogo)
+KEEP_INDEXES = 3
+# Directorios temporales más antiguos que esto se consideran abandonados (proceso caído)
+STALE_TMP_SECONDS = 3600
+TMP_PREFIX = ".tmp-"
+
+# Modelos de embeddings cargados (uno por proceso, compartido entre versiones del catálogo)
+_embedders: dict = {}
+_embedders_lock = threading.Lock()
+
+
+def load_embedder(model_name: str):
+    """Modelo de sentence-transformers, cargado una sola vez por proceso."""
+    with _embedders_lock:
+        embedder = _embedders.get(model_name)
+        if embedder is None:
+            embedder = _embedders[model_name] = SentenceTransformer(model_name)
+        return embedder
+
+
+def remove_stale_indexes(base_directory: str, current: str) -> None:
+    """
+    Borra los índices de versiones antiguas (salvo los KEEP_INDEXES más recientes,
+    incluido `current`) y los temporales abandonados. Llamar bajo directory_lock.
+    """
+    now = time.time()
+    indexes = []
+    for name in os.listdir(base_directory):
+        path = os.path.join(base_directory, name)
+        if not os.path.isdir(path) or path == current:
+            continue
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        if name.startswith(TMP_PREFIX):
+            # Los temporales recientes son de otro proceso que aún está escribiendo
+            if now - mtime > STALE_TMP_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        else:
+            indexes.append((mtime, path))
+    # Los procesos que aún los tengan abiertos siguen leyéndolos (mmap de ficheros borrados)
+    for _, path in sorted(indexes, reverse=True)[KEEP_INDEXES - 1:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def directory_lock(directory: str):
+    """Lock de fichero (flock) sobre `directory`, compartido por todos los procesos."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def stem(token: str) -> str:
+    """Stemming ligero para español: recorta una terminación dejando al menos 4 letras."""
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+def analyze(text: str) -> list:
+    """Términos de un texto: normalizado, sin palabras vacías y con stemming."""
+    return [stem(token) for token in normalize_text(text).split() if token not in STOPWORDS]
+
+
+def document_text(prop) -> str:
+    """Texto indexado de una propiedad."""
+    return " ".join([
+        prop.get("description") or "",
+        " ".join(prop.get("features") or ()),
+        prop.get("target") or ""
+    ])
+
+
+class SemanticIndex:
+    """Índice BM25 (y embeddings opcionales) de una versión del catálogo."""
+
+    def __init__(self, properties, vocabulary: dict, arrays: dict, embedder=None):
+        self.properties = properties
+        self.vocabulary = vocabulary
+        self.offsets = arrays["offsets"]
+        self.doc_ids = arrays["doc_ids"]
+        self.weights = arrays["weights"]
+        self.embeddings = arrays.get("embeddings")
+        self.embedder = embedder
+
+    # ==================== CONSTRUCCIÓN ====================
+
+    @classmethod
+    def build(cls, properties, embedder=None) -> "SemanticIndex":
+        """Construye el índice en memoria a partir de las propiedades."""
+        postings: dict[str, dict] = {}
+        lengths = []
+        for position, prop in enumerate(properties):
+            terms = analyze(document_text(prop))
+            lengths.append(len(terms))
+            for term in terms:
+                counts = postings.setdefault(term, {})
+                counts[position] = counts.get(position, 0) + 1
+
+        total = len(properties)
+        lengths = np.array(lengths, dtype=np.float32)
+        average_length = float(lengths.mean()) if total and lengths.mean() > 0 else 1.0
+
+        vocabulary = {}
+        offsets = [0]
+        doc_ids = []
+        weights = []
+        for term in sorted(postings):
+            counts = postings[term]
+            vocabulary[term] = len(vocabulary)
+            idf = np.log(1 + (total - len(counts) + 0.5) / (len(counts) + 0.5))
+            for position, frequency in sorted(counts.items()):
+                # Peso BM25 precalculado: la consulta solo suma pesos
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[position] / average_length)
+                doc_ids.append(position)
+                weights.append(idf * frequency * (BM25_K1 + 1) / (frequency + norm))
+            offsets.append(len(doc_ids))
+
+        arrays = {
+            "offsets": np.array(offsets, dtype=np.int64),
+            "doc_ids": np.array(doc_ids, dtype=np.int32),
+            "weights": np.array(weights, dtype=np.float32)
+        }
+        if embedder is not None and total:
+            vectors = embedder.encode([document_text(prop) for prop in properties], normalize_embeddings=True)
+            arrays["embeddings"] = np.asarray(vectors, dtype=np.float32)
+        return cls(properties, vocabulary, arrays, embedder)
+
+    def save(self, directory: str, overwrite: bool = False) -> bool:
+        """
+        Guarda el índice en `directory`: se escribe en un directorio temporal
+        propio y se publica renombrándolo bajo el lock. Devuelve False si otro
+        proceso ya había publicado ese índice (se conserva el suyo, salvo con
+        `overwrite`, para sustituir uno inválido).
+        """
+        parent = os.path.dirname(directory) or "."
+        os.makedirs(parent, exist_ok=True)
+        tmp_directory = tempfile.mkdtemp(dir=parent, prefix=TMP_PREFIX)
+        try:
+            with open(os.path.join(tmp_directory, "vocabulary.json"), "w", encoding="utf-8") as f:
+                json.dump(self.vocabulary, f, ensure_ascii=False)
+            for name in ("offsets", "doc_ids", "weights", "embeddings"):
+                array = getattr(self, name)
+                if array is not None:
+                    np.save(os.path.join(tmp_directory, f"{name}.npy"), array)
+            with directory_lock(parent):
+                if os.path.exists(os.path.join(directory, "vocabulary.json")) and not overwrite:
+                    return False
+                shutil.rmtree(directory, ignore_errors=True)
+                os.replace(tmp_directory, directory)
+                return True
+        finally:
+            # Solo queda si no se llegó a publicar
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    @classmethod
+    def load(cls, properties, directory: str, embedder=None) -> "SemanticIndex":
+        """Abre un índice guardado; los arrays se mapean en memoria (mmap) sin leerlos enteros."""
+        with open(os.path.join(directory, "vocabulary.json"), "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        arrays = {}
+        for name in ("offsets", "doc_ids", "weights", "embeddings"):
+            path = os.path.join(directory, f"{name}.npy")
+            if os.path.exists(path):
+                arrays[name] = np.load(path, mmap_mode="r")
+        return cls(properties, vocabulary, arrays, embedder)
+
+    @classmethod
+    def open(cls, properties, base_directory: str, content_hash: str,
+             embedding_model: str = "") -> "SemanticIndex":
+        """
+        Índice de una versión del catálogo: se abre desde disco si ya se construyó
+        para ese contenido (y modelo de embeddings); si no, se construye y se guarda.
+        """
+        embedder = None
+        if embedding_model:
+            if SentenceTransformer is None:
+                print("[SEMANTIC] sentence-transformers no está instalado: solo BM25")
+                embedding_model = ""
+            else:
+                embedder = load_embedder(embedding_model)
+
+        key = content_hash + (f"-{embedding_model.replace('/', '_')}" if embedding_model else "")
+        directory = os.path.join(base_directory, key)
+        invalid = False
+        if os.path.exists(os.path.join(directory, "vocabulary.json")):
+            try:
+                index = cls.load(properties, directory, embedder)
+                if len(index.offsets) == len(index.vocabulary) + 1:
+                    return index
+                invalid = True
+            except (OSError, ValueError) as e:
+                print(f"[SEMANTIC] Índice en disco inválido, se reconstruye: {e}")
+                invalid = True
+
+        index = cls.build(properties, embedder)
+        try:
+            if index.save(directory, overwrite=invalid):
+                with directory_lock(base_directory):
+                    remove_stale_indexes(base_directory, directory)
+            index = cls.load(properties, directory, embedder)
+        except OSError as e:
+            print(f"[SEMANTIC] No se pudo guardar el índice: {e}")
+        print(f"[SEMANTIC] Índice construido: {len(properties)} propiedades, {len(index.vocabulary)} términos")
+        return index
+
+    # ==================== CONSULTA ====================
+
+    def scores(self, query: str) -> np.ndarray:
+        """Puntuación BM25 (más similitud de embeddings, si hay) de cada propiedad."""
+        scores = np.zeros(len(self.properties), dtype=np.float32)
+        for term in set(analyze(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # Cada documento aparece una sola vez por término: basta la suma indexada
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+
+        if self.embeddings is not None and self.embedder is not None:
+            top = scores.max()
+            if top > 0:
+                scores /= top
+            vector = self.embedder.encode([query], normalize_embeddings=True)[0].astype(np.float32)
+            scores += EMBEDDING_WEIGHT * np.clip(self.embeddings @ vector, 0, None)
+        return scores
+
+    def search(self, query: str, k: int = 3, min_score: Optional[float] = None) -> list:
+        """Las k propiedades que mejor encajan con el texto: [(propiedad, puntuación)]."""
+        if not self.properties or k <= 0:
+            return []
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        threshold = 0.0 if min_score is None else min_score
+        return [(self.properties[i], float(scores[i])) for i in order if scores[i] > threshold]
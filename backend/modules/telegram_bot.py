@@ -1,7 +1,17 @@
+import asyncio
+import time
+
 import httpx
 from typing import Optional
 
-from config import TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN
+from config import TELEGRAM_API_URL, TELEGRAM_BOT_TOKEN, TELEGRAM_EDIT_INTERVAL
+
+# Longitud máxima de un mensaje de Telegram
+TELEGRAM_MAX_LENGTH = 4096
+# Caracteres nuevos mínimos para editar el mensaje antes de la versión final
+TELEGRAM_EDIT_MIN_CHARS = 20
+# Intentos de la edición final si Telegram responde 429 (después se envía como mensaje nuevo)
+TELEGRAM_FINAL_EDIT_ATTEMPTS = 3
 
 
 async def send_telegram_message(chat_id: int, text: str, parse_mode: str = "Markdown") -> bool:
@@ -50,6 +60,122 @@ async def send_telegram_message(chat_id: int, text: str, parse_mode: str = "Mark
         return False
 
 
+class TelegramReplyStream:
+    """
+    Respuesta de Telegram que se escribe mientras el modelo la genera.
+
+    El primer fragmento se envía con sendMessage y los siguientes editan ese
+    mensaje (editMessageText) como mucho una vez cada `interval` segundos; si
+    Telegram responde 429 se espera lo que indique retry_after. Las versiones
+    parciales van sin formato (el Markdown a medias no es válido) y la final
+    con Markdown, igual que send_telegram_message.
+    """
+
+    def __init__(self, chat_id: int, interval: float = TELEGRAM_EDIT_INTERVAL):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.message_id: Optional[int] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._shown = ""
+        self._next_edit = 0.0
+        self._rate_limited = False
+
+    async def _call(self, method: str, payload: dict) -> Optional[dict]:
+        """Llama a la API de Telegram; retorna el resultado o None si falló."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10.0)
+        self._rate_limited = False
+        try:
+            response = await self._client.post(f"{TELEGRAM_API_URL}/{method}", json=payload)
+            data = response.json()
+        except Exception as e:
+            print(f"[TELEGRAM] Error en {method}: {str(e)}")
+            return None
+        if response.status_code == 429:
+            retry_after = data.get("parameters", {}).get("retry_after", 1)
+            self._next_edit = time.monotonic() + retry_after
+            self._rate_limited = True
+            print(f"[TELEGRAM] Límite de mensajes alcanzado, esperando {retry_after}s")
+            return None
+        if not data.get("ok"):
+            print(f"[TELEGRAM] {method} rechazado: {data.get('description')}")
+            return None
+        return data.get("result")
+
+    async def _show(self, text: str, parse_mode: Optional[str] = None) -> bool:
+        """Envía o edita el mensaje con `text`."""
+        payload = {"chat_id": self.chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        if self.message_id is None:
+            result = await self._call("sendMessage", payload)
+            if result:
+                self.message_id = result.get("message_id")
+        else:
+            payload["message_id"] = self.message_id
+            result = await self._call("editMessageText", payload)
+        if result:
+            self._shown = text
+            self._next_edit = max(self._next_edit, time.monotonic() + self.interval)
+        return bool(result)
+
+    async def update(self, text: str) -> None:
+        """Texto generado hasta ahora; solo se muestra si toca según el intervalo."""
+        if not TELEGRAM_BOT_TOKEN or not text.strip():
+            return
+        text = text[:TELEGRAM_MAX_LENGTH - 2] + " …"
+        if time.monotonic() < self._next_edit or len(text) - len(self._shown) < TELEGRAM_EDIT_MIN_CHARS:
+            return
+        await self._show(text)
+
+    async def _wait_turn(self) -> None:
+        """Espera hasta que se pueda volver a escribir (intervalo o retry_after)."""
+        delay = self._next_edit - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _final_edit(self, text: str) -> bool:
+        """
+        Edita el mensaje con la respuesta completa: primero con Markdown y, si
+        Telegram lo rechaza, sin formato. Tras un 429 espera retry_after antes
+        de reintentar (como mucho TELEGRAM_FINAL_EDIT_ATTEMPTS veces).
+        """
+        parse_mode = "Markdown"
+        attempts = 0
+        while attempts < TELEGRAM_FINAL_EDIT_ATTEMPTS:
+            await self._wait_turn()
+            if await self._show(text, parse_mode):
+                return True
+            if self._rate_limited:
+                attempts += 1
+            elif parse_mode:
+                # Markdown rechazado: se reintenta sin formato
+                parse_mode = None
+            else:
+                return False
+        return False
+
+    async def finish(self, text: str) -> bool:
+        """Muestra la respuesta completa (con Markdown) y libera la conexión."""
+        try:
+            if self.message_id is None:
+                return await send_telegram_message(self.chat_id, text)
+            first, rest = text[:TELEGRAM_MAX_LENGTH], text[TELEGRAM_MAX_LENGTH:]
+            sent = first == self._shown or await self._final_edit(first)
+            if not sent:
+                # La edición no entró: la respuesta completa va como mensaje nuevo
+                await self._wait_turn()
+                sent = await send_telegram_message(self.chat_id, first)
+            while rest:
+                sent = await send_telegram_message(self.chat_id, rest[:TELEGRAM_MAX_LENGTH]) and sent
+                rest = rest[TELEGRAM_MAX_LENGTH:]
+            return sent
+        finally:
+            if self._client is not None:
+                await self._client.aclose()
+                self._client = None
+
+
 async def set_webhook(webhook_url: str) -> dict:
     """
     Configura el webhook de Telegram.
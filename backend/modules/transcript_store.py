@@ -0,0 +1,67 @@
+"""
+Almacén de transcripciones de conversación, separado de los leads.
+
+Cada lead tiene su propio fichero NDJSON (un mensaje por línea) y en cada
+turno solo se añaden los mensajes nuevos. El registro del lead guarda
+únicamente la referencia (transcript_id) y el número de mensajes, de modo
+que escribir un lead cuesta lo mismo sea cual sea la longitud de la charla.
+"""
+import json
+import os
+import re
+import threading
+
+
+class TranscriptStore:
+    """Transcripciones append-only, un fichero por lead."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # Mensajes ya guardados de cada sesión en este proceso
+        self._session_offsets: dict[str, int] = {}
+
+    def _path(self, transcript_id: str) -> str:
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", transcript_id)
+        return os.path.join(self.directory, f"{safe_id}.jsonl")
+
+    def append(self, transcript_id: str, messages: list) -> int:
+        """Añade mensajes al final de la transcripción. Retorna cuántos se escribieron."""
+        if not messages:
+            return 0
+        lines = "".join(json.dumps(message, ensure_ascii=False) + "\n" for message in messages)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(transcript_id), "a", encoding="utf-8") as f:
+                f.write(lines)
+        return len(messages)
+
+    def append_new(self, transcript_id: str, session_key: str, conversation_history: list) -> int:
+        """
+        Añade solo los mensajes del historial de la sesión que aún no se guardaron.
+        Retorna cuántos mensajes nuevos se escribieron.
+        """
+        with self._lock:
+            offset = self._session_offsets.get(session_key, 0)
+            if len(conversation_history) < offset:
+                # El historial de la sesión se reinició: todo es nuevo
+                offset = 0
+            self._session_offsets[session_key] = len(conversation_history)
+        return self.append(transcript_id, conversation_history[offset:])
+
+    def read(self, transcript_id: str) -> list:
+        """Retorna todos los mensajes de una transcripción."""
+        messages = []
+        try:
+            with open(self._path(transcript_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return messages
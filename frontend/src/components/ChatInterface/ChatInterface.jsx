@@ -2,7 +2,7 @@ import { useState, useRef, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import Message, { TypingIndicator } from '../Message/Message.jsx';
 import VoiceRecorder from '../VoiceRecorder/VoiceRecorder.jsx';
-import { sendChatMessage } from '../../services/api';
+import { streamChatMessage } from '../../services/api';
 import './ChatInterface.css';
 
 // SVG Icons
@@ -115,21 +115,38 @@ const ChatInterface = () => {
         setIsLoading(true);
         setError(null);
 
+        // La respuesta del bot se va escribiendo según llegan los tokens
+        const botMessageId = Date.now() + 1;
+        let streamedText = '';
+        const showBotMessage = (content) => {
+            setIsLoading(false);
+            setMessages(prev => {
+                const botMessage = { id: botMessageId, content, role: 'assistant', timestamp: new Date() };
+                return prev.some(m => m.id === botMessageId)
+                    ? prev.map(m => (m.id === botMessageId ? botMessage : m))
+                    : [...prev, botMessage];
+            });
+        };
+
         try {
-            const response = await sendChatMessage(messageText.trim(), sessionId);
+            const response = await streamChatMessage(messageText.trim(), sessionId, {
+                onToken: (text) => {
+                    streamedText += text;
+                    showBotMessage(streamedText);
+                },
+                // El agente consulta una herramienta: el texto parcial se sustituye por la respuesta final
+                onTool: () => {
+                    streamedText = '';
+                    setMessages(prev => prev.filter(m => m.id !== botMessageId));
+                    setIsLoading(true);
+                }
+            });
 
             if (response.session_id) {
                 setSessionId(response.session_id);
             }
 
-            const botMessage = {
-                id: Date.now() + 1,
-                content: response.response,
-                role: 'assistant',
-                timestamp: new Date()
-            };
-
-            setMessages(prev => [...prev, botMessage]);
+            showBotMessage(response.response);
         } catch (err) {
             console.error('Error sending message:', err);
             setError('Error al conectar con el servidor. Por favor, verifica que el backend este corriendo.');
@@ -1,5 +1,5 @@
-import { useState, useEffect } from 'react';
-import { getLeads } from '../../services/api';
+import { useState, useEffect, useRef } from 'react';
+import { getLeads, getLeadById, getLeadStats, subscribeToLeadEvents } from '../../services/api';
 import './Dashboard.css';
 
 // SVG Icons
@@ -97,8 +97,15 @@ const SunIcon = () => (
     </svg>
 );
 
+// Leads por página del listado
+const PAGE_SIZE = 100;
+
 const Dashboard = () => {
     const [leads, setLeads] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    const [leadStats, setLeadStats] = useState(null);
+    const statsTimeout = useRef(null);
     const [filteredLeads, setFilteredLeads] = useState([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
@@ -108,23 +115,86 @@ const Dashboard = () => {
     const [temperatureFilter, setTemperatureFilter] = useState('all');
     const [searchQuery, setSearchQuery] = useState('');
 
+    const fetchLeads = async () => {
+        try {
+            setLoading(true);
+            const data = await getLeads({ limit: PAGE_SIZE });
+            setLeads(data.leads || []);
+            setFilteredLeads(data.leads || []);
+            setNextCursor(data.next_cursor || null);
+        } catch (err) {
+            console.error('Error fetching leads:', err);
+            setError('Error al cargar los leads. Verifica que el backend este corriendo.');
+        } finally {
+            setLoading(false);
+        }
+    };
+
+    const fetchStats = async () => {
+        try {
+            setLeadStats(await getLeadStats());
+        } catch (err) {
+            console.error('Error fetching lead stats:', err);
+        }
+    };
+
+    // Agrupa varios cambios seguidos en una sola recarga de estadisticas
+    const scheduleStatsRefresh = () => {
+        if (statsTimeout.current) return;
+        statsTimeout.current = setTimeout(() => {
+            statsTimeout.current = null;
+            fetchStats();
+        }, 1000);
+    };
+
     useEffect(() => {
-        const fetchLeads = async () => {
-            try {
-                setLoading(true);
-                const data = await getLeads();
-                setLeads(data.leads || []);
-                setFilteredLeads(data.leads || []);
-            } catch (err) {
-                console.error('Error fetching leads:', err);
-                setError('Error al cargar los leads. Verifica que el backend este corriendo.');
-            } finally {
-                setLoading(false);
-            }
-        };
         fetchLeads();
+        fetchStats();
+        return () => clearTimeout(statsTimeout.current);
+    }, []);
+
+    // Cambios en tiempo real: se aplican sobre la lista sin volver a descargarla
+    useEffect(() => {
+        const unsubscribe = subscribeToLeadEvents({
+            onCreated: (lead) => {
+                setLeads(current => [lead, ...current.filter(l => l.id !== lead.id)]);
+                scheduleStatsRefresh();
+            },
+            onUpdated: ({ id, changes }) => {
+                scheduleStatsRefresh();
+                setLeads(current => {
+                    const existing = current.find(l => l.id === id);
+                    if (!existing) return current;
+                    return [{ ...existing, ...changes }, ...current.filter(l => l.id !== id)];
+                });
+            },
+            onMerged: ({ id }) => {
+                // El lead se unió a otro de la misma persona: desaparece del listado
+                setLeads(current => current.filter(l => l.id !== id));
+                scheduleStatsRefresh();
+            },
+            onResync: () => {
+                fetchLeads();
+                fetchStats();
+            }
+        });
+        return unsubscribe;
     }, []);
 
+    const loadMoreLeads = async () => {
+        if (!nextCursor) return;
+        try {
+            setLoadingMore(true);
+            const data = await getLeads({ limit: PAGE_SIZE, cursor: nextCursor });
+            setLeads(current => [...current, ...(data.leads || [])]);
+            setNextCursor(data.next_cursor || null);
+        } catch (err) {
+            console.error('Error fetching more leads:', err);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     useEffect(() => {
         let result = [...leads];
 
@@ -148,11 +218,23 @@ const Dashboard = () => {
         setFilteredLeads(result);
     }, [leads, channelFilter, temperatureFilter, searchQuery]);
 
+    // Los totales vienen del backend (agregados de todos los leads, no solo los cargados)
     const stats = {
-        total: leads.length,
-        telegram: leads.filter(l => l.channel === 'telegram').length,
-        web: leads.filter(l => l.channel === 'web').length,
-        hot: leads.filter(l => l.temperature === 'caliente').length
+        total: leadStats?.total ?? leads.length,
+        telegram: leadStats?.by_channel?.telegram ?? 0,
+        web: leadStats?.by_channel?.web ?? 0,
+        hot: leadStats?.by_temperature?.caliente ?? 0
+    };
+
+    // El listado no incluye el historial: se pide al abrir el detalle
+    const openLeadDetail = async (lead) => {
+        setSelectedLead(lead);
+        try {
+            const detail = await getLeadById(lead.id);
+            setSelectedLead(current => (current && current.id === lead.id ? detail : current));
+        } catch (err) {
+            console.error('Error fetching lead detail:', err);
+        }
     };
 
     const formatDate = (dateString) => {
@@ -301,7 +383,7 @@ const Dashboard = () => {
                         <option value="all">Todas</option>
                         <option value="caliente">Caliente</option>
                         <option value="tibio">Tibio</option>
-                        <option value="frio">Frio</option>
+                        <option value="frío">Frio</option>
                     </select>
                 </div>
 
@@ -351,7 +433,7 @@ const Dashboard = () => {
                             </thead>
                             <tbody>
                                 {filteredLeads.map((lead) => (
-                                    <tr key={lead.id} onClick={() => setSelectedLead(lead)}>
+                                    <tr key={lead.id} onClick={() => openLeadDetail(lead)}>
                                         <td>
                                             <span className={`channel-badge channel-${lead.channel}`}>
                                                 {lead.channel === 'telegram' ? <TelegramIcon /> : <GlobeIcon />}
@@ -397,6 +479,11 @@ const Dashboard = () => {
                                 ))}
                             </tbody>
                         </table>
+                        {nextCursor && (
+                            <button className="load-more" onClick={loadMoreLeads} disabled={loadingMore}>
+                                {loadingMore ? 'Cargando...' : 'Cargar mas leads'}
+                            </button>
+                        )}
                     </div>
                 )}
             </section>
@@ -29,12 +29,56 @@ export const sendChatMessage = async (message, sessionId = null) => {
 };
 
 /**
- * Obtiene todos los leads
- * @returns {Promise<{total: number, leads: array}>}
+ * Envía un mensaje al chat y recibe la respuesta en streaming (SSE sobre POST)
+ * @param {string} message - Mensaje del usuario
+ * @param {string|null} sessionId - ID de sesión existente
+ * @param {object} handlers - { onToken(text), onTool(name) }
+ * @returns {Promise<{response: string, session_id: string, lead_data: object|null}>} - Evento final (done)
+ */
+export const streamChatMessage = async (message, sessionId = null, { onToken, onTool } = {}) => {
+    const response = await fetch(`${API_URL}/api/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message, session_id: sessionId }),
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`Error en el chat: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const raw of events) {
+            const type = raw.match(/^event: (.*)$/m)?.[1];
+            const data = raw.match(/^data: (.*)$/m)?.[1];
+            if (!type || !data) continue;
+            const payload = JSON.parse(data);
+            if (type === 'token') onToken?.(payload.text);
+            else if (type === 'tool') onTool?.(payload.name);
+            else if (type === 'done') result = payload;
+        }
+    }
+    if (!result) {
+        throw new Error('La respuesta del chat se interrumpió');
+    }
+    return result;
+};
+
+/**
+ * Obtiene una página de leads (más recientes primero)
+ * @param {object} params - Filtros y paginación (channel, temperature, status, min_score, max_score, cursor, limit, fields)
+ * @returns {Promise<{total: number, count: number, leads: array, next_cursor: string|null}>}
  */
-export const getLeads = async () => {
+export const getLeads = async (params = {}) => {
     try {
-        const response = await api.get('/api/leads');
+        const response = await api.get('/api/leads', { params });
         return response.data;
     } catch (error) {
         console.error('Error fetching leads:', error);
@@ -42,6 +86,35 @@ export const getLeads = async () => {
     }
 };
 
+/**
+ * Obtiene los agregados de leads (totales por canal, temperatura, estado, score medio...)
+ * @returns {Promise<{total: number, by_channel: object, by_temperature: object, by_status: object, average_score: number, score_histogram: array, visit_requests: number}>}
+ */
+export const getLeadStats = async () => {
+    try {
+        const response = await api.get('/api/leads/stats');
+        return response.data;
+    } catch (error) {
+        console.error('Error fetching lead stats:', error);
+        throw error;
+    }
+};
+
+/**
+ * Se suscribe al stream de cambios de leads (Server-Sent Events)
+ * @param {object} handlers - { onCreated(lead), onUpdated({id, changes}), onMerged({id, merged_into}), onResync() }
+ * @returns {function} - Función para cerrar la suscripción
+ */
+export const subscribeToLeadEvents = ({ onCreated, onUpdated, onMerged, onResync }) => {
+    const source = new EventSource(`${API_URL}/api/leads/stream`);
+    source.addEventListener('lead_created', (event) => onCreated?.(JSON.parse(event.data)));
+    source.addEventListener('lead_updated', (event) => onUpdated?.(JSON.parse(event.data)));
+    source.addEventListener('lead_merged', (event) => onMerged?.(JSON.parse(event.data)));
+    source.addEventListener('resync', () => onResync?.());
+    source.onerror = (error) => console.error('Error in lead events stream:', error);
+    return () => source.close();
+};
+
 /**
  * Obtiene un lead por ID
  * @param {string} leadId - ID del lead